@@ -0,0 +1,167 @@
+"""
+Benchmark do parser de prompt: parser atual (prompt_tokenizer + padrões compilados)
+contra o parser antigo (split em \\n###+ e regex por seção), em prompts sintéticos
+de 10 a 2.000 blocos.
+
+O parser antigo é lido do histórico do git (o prompt_parser.py do commit anterior
+ao que criou o prompt_tokenizer.py, ou --baseline REV) e carregado isolado. Os
+prints do parser antigo vão para /dev/null, mas continuam custando: é o que ele
+fazia em produção.
+
+Além do tempo, cada linha mostra blocos/rotas/errados (blocos que faltaram ou
+saíram com block_type/next_block_key diferente do gerado): o parser antigo dividia
+também nos #### das rotas, então não extraía rotas e as rotas viravam blocos
+(duplicando MSG/ENC).
+
+Resultado esperado: com --no-routes (mesmo trabalho nos dois) o atual fica ~1,4-1,9x
+mais rápido. Com rotas o atual é MAIS LENTO, ~0,7-0,8x do antigo (ex.: 2.000 blocos,
+~93 ms -> ~123 ms), porque extrai ~1 rota por bloco que o antigo nem tentava; a
+extração de cada rota (_parse_route) é o custo que sobra.
+
+    cd saas_server
+    python3 bench_prompt_parser.py
+    python3 bench_prompt_parser.py --sizes 10,100,2000 --repeat 3
+    python3 bench_prompt_parser.py --no-routes
+    python3 bench_prompt_parser.py --baseline <commit>
+"""
+import argparse
+import contextlib
+import os
+import subprocess
+import sys
+import time
+import types
+from typing import Callable, Dict, List, Optional, Tuple
+
+from saas_tools.services.prompt_parser import parse_prompt_base_to_blocks
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+PARSER_PATH = "saas_tools/services/prompt_parser.py"
+TOKENIZER_PATH = "saas_tools/services/prompt_tokenizer.py"
+
+INTRO = """# PROMPT - FLOW DO ASSISTENTE
+
+## IDENTIDADE
+Você é a assistente virtual da empresa. Fale de forma natural e educada.
+
+## COMO LER ESTE FLUXO
+FALAR = diga exatamente o texto entre aspas
+AGUARDAR = espere a resposta do lead
+
+"""
+
+
+def _git(*args: str) -> str:
+    return subprocess.run(["git", *args], cwd=HERE, capture_output=True, text=True, check=True).stdout
+
+
+def load_baseline_parser(rev: Optional[str]) -> Tuple[Optional[Callable], str]:
+    """parse_prompt_base_to_blocks do parser antigo (lido do git), ou (None, motivo)."""
+    try:
+        if not rev:
+            added = _git("log", "--diff-filter=A", "--format=%H", "--", TOKENIZER_PATH).split()
+            rev = f"{added[-1]}^" if added else "HEAD"
+        source = _git("show", f"{rev}:./{PARSER_PATH}")
+    except (OSError, subprocess.CalledProcessError) as e:
+        return None, f"parser antigo indisponível ({e})"
+    if "prompt_tokenizer" in source:
+        return None, f"{rev} já usa o prompt_tokenizer (passe --baseline com um commit anterior)"
+    module = types.ModuleType("prompt_parser_baseline")
+    exec(compile(source, f"{rev}:{PARSER_PATH}", "exec"), module.__dict__)
+    return module.parse_prompt_base_to_blocks, rev
+
+
+def _routes(n: int) -> str:
+    return (
+        f"#### + Confirmou a etapa {n}\n\n**Quando o lead disser:** `sim`, `isso`, `pode`\n\n"
+        f"**Fale:**\n\"Perfeito, vamos seguir.\"\n\n**Depois:** Continue para [MSG{n:03d}]\n\n"
+        f"#### x Recusou a etapa {n}\n\n**Quando o lead disser:** `não`, `agora não`\n\n"
+        f"**Fale:**\n\"Tudo bem, obrigado pelo seu tempo.\"\n\n**Depois:** Encerre em [ENC001]\n\n"
+        f"#### ? Não entendi\n\n**Quando nenhuma condicao acima for atendida**\n\n"
+        f"**Fale:**\n\"Desculpe, pode repetir?\"\n\n**Depois:** Volte para [AG{n:03d}] (maximo 2 tentativas)"
+    )
+
+
+def build_prompt(total_blocks: int, with_routes: bool = True) -> Tuple[str, Dict[str, Tuple[str, Optional[str]]]]:
+    """
+    Prompt no formato padrão (ABERTURA, grupos AGUARDAR/CAMINHOS/MENSAGEM e ENCERRAR)
+    e o esperado por block_key: (block_type, next_block_key).
+    """
+    parts: List[str] = [INTRO, "## FLUXO DA CONVERSA\n\n"]
+    expected: Dict[str, Tuple[str, Optional[str]]] = {"PM001": ("primeira_mensagem", "AG001"), "ENC001": ("encerrar", None)}
+    parts.append(
+        "### ABERTURA DA LIGACAO\n\n**Ao iniciar a ligacao, fale:**\n\n"
+        "\"Olá! Aqui é a Ana. Estou falando com o responsável?\"\n\n**Depois:** Va para [AG001]\n\n---\n\n"
+    )
+    groups = max(0, (total_blocks - 2) // 3)
+    for n in range(1, groups + 1):
+        last = n == groups
+        next_ag = "[ENC001]" if last else f"[AG{n + 1:03d}]"
+        expected[f"AG{n:03d}"] = ("aguardar", f"CAM{n:03d}")
+        expected[f"CAM{n:03d}"] = ("caminhos", f"MSG{n:03d}")
+        expected[f"MSG{n:03d}"] = ("mensagem", next_ag[1:-1])
+        parts.append(
+            f"### AGUARDAR [AG{n:03d}]\n\nEscute a resposta do lead sobre a etapa {n}.\n\n"
+            f"**Salvar em:** {{{{resposta_{n}}}}}\n\n**Depois:** Va para [CAM{n:03d}]\n\n---\n\n"
+            f"### CAMINHOS [CAM{n:03d}]\n\n**Analisando:** `{{{{resposta_{n}}}}}`\n\n"
+            f"{_routes(n) if with_routes else f'**Depois:** Continue para [MSG{n:03d}]'}\n\n---\n\n"
+            f"### MENSAGEM [MSG{n:03d}]\n\n**Fale:**\n\n\"Ótimo, etapa {n} concluída. Vamos para a próxima.\"\n\n"
+            f"**Depois:** Va para {next_ag}\n\n---\n\n"
+        )
+    parts.append(
+        "### ENCERRAR [ENC001]: finalizar\n\n**Fale antes de encerrar:**\n\n"
+        "\"Obrigado pelo seu tempo. Até logo!\"\n\n---\n"
+    )
+    return "".join(parts), expected
+
+
+def _wrong_blocks(blocks: list, expected: Dict[str, Tuple[str, Optional[str]]]) -> int:
+    """Blocos esperados que faltaram ou saíram com block_type/next_block_key diferente."""
+    parsed = {block["block_key"]: (block["block_type"], block["next_block_key"]) for block in blocks}
+    return sum(1 for block_key, wanted in expected.items() if parsed.get(block_key) != wanted)
+
+
+def best_time(parse: Callable, prompt: str, expected: Dict[str, Tuple[str, Optional[str]]], repeat: int) -> Tuple[float, str]:
+    """Melhor tempo (ms) em repeat execuções e o resumo blocos/rotas/blocos errados da última."""
+    best = float("inf")
+    blocks: list = []
+    routes: list = []
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        for _ in range(repeat):
+            started = time.perf_counter()
+            blocks, routes = parse(prompt, "bench", None, None)
+            best = min(best, time.perf_counter() - started)
+    return best * 1000, f"{len(blocks)}/{len(routes)}/{_wrong_blocks(blocks, expected)}"
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Benchmark do parser de prompt (atual x antigo)")
+    parser.add_argument("--sizes", default="10,50,200,500,1000,2000", help="quantidades de blocos, separadas por vírgula")
+    parser.add_argument("--repeat", type=int, default=5, help="execuções por tamanho (vale a melhor)")
+    parser.add_argument("--no-routes", action="store_true", help="CAMINHOS sem subcabeçalhos #### (mesmo trabalho nos dois parsers)")
+    parser.add_argument("--baseline", default=None, help="commit do parser antigo (padrão: antes do prompt_tokenizer)")
+    args = parser.parse_args()
+
+    baseline, label = load_baseline_parser(args.baseline)
+    if baseline is None:
+        print(f"⚠️ {label}; medindo só o parser atual")
+    else:
+        print(f"Parser antigo: {label}")
+
+    print(f"{'blocos':>7} {'chars':>9} {'antigo ms':>10} {'atual ms':>9} {'speedup':>8}  blocos/rotas/errados (antigo -> atual)")
+    for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+        prompt, expected = build_prompt(size, with_routes=not args.no_routes)
+        new_ms, new_summary = best_time(parse_prompt_base_to_blocks, prompt, expected, args.repeat)
+        if baseline is None:
+            print(f"{size:>7} {len(prompt):>9} {'-':>10} {new_ms:>9.2f} {'-':>8}  {new_summary}")
+            continue
+        old_ms, old_summary = best_time(baseline, prompt, expected, args.repeat)
+        print(
+            f"{size:>7} {len(prompt):>9} {old_ms:>10.2f} {new_ms:>9.2f} {old_ms / new_ms:>7.1f}x"
+            f"  {old_summary} -> {new_summary}"
+        )
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,385 @@
+"""
+Servidor LLM falso para benchmarks offline dos caminhos de IA (análise e patch).
+
+Fala os formatos de wire da OpenAI (POST /v1/chat/completions) e da Anthropic
+(POST /v1/messages), com e sem streaming (SSE), sem rede e sem gastar tokens.
+As respostas são geradas a partir da própria requisição:
+
+- análise de prompt (FlowAIAnalyzer): JSON {"blocks": [...]} montado a partir das
+  seções ### do prompt/trecho (ou o conteúdo de FAKE_LLM_CANNED_ANALYSIS, se definido);
+- patch por seção (AIPromptPatcher modo section): a "NOVA SEÇÃO FORMATADA";
+- patch completo (modo full): o prompt original com a seção do bloco trocada.
+
+Rodar e apontar o SaaS para ele:
+
+    cd saas_server
+    python3 -m uvicorn fake_llm_server:app --port 8090
+    # no .env do SaaS:
+    OPENAI_BASE_URL=http://127.0.0.1:8090/v1
+    ANTHROPIC_BASE_URL=http://127.0.0.1:8090
+
+Latência, velocidade e injeção de erros (variáveis de ambiente, ou em tempo de
+execução via POST /fake/config com os mesmos nomes em minúsculas sem o prefixo):
+
+    FAKE_LLM_FIRST_TOKEN_MS=300        tempo até o primeiro token
+    FAKE_LLM_TOKENS_PER_SECOND=80      velocidade de geração (0 = sem limite)
+    FAKE_LLM_CHUNK_TOKENS=4            tokens por pedaço do stream
+    FAKE_LLM_ERROR_RATE=0              fração de requisições que falham (0-1)
+    FAKE_LLM_ERROR_STATUS=500          status do erro injetado (429, 500, 529...)
+    FAKE_LLM_STALL_RATE=0              fração de requisições que travam antes do 1º token
+    FAKE_LLM_STALL_SECONDS=120         quanto tempo a requisição travada fica parada
+    FAKE_LLM_SEED=                     semente do sorteio (benchmarks reproduzíveis)
+"""
+import asyncio
+import json
+import os
+import random
+import re
+import time
+import uuid
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+PREFIX_TYPES = {
+    "PM": "primeira_mensagem",
+    "AG": "aguardar",
+    "CAM": "caminhos",
+    "MSG": "mensagem",
+    "ENC": "encerrar",
+}
+SECTION_RE = re.compile(r"^###(?!#)[^\n]*(?:\n(?!###(?!#)).*)*", re.MULTILINE)
+KEY_RE = re.compile(r"\[([A-Z]{2,3}\d+)\]")
+NEXT_RE = re.compile(r"Va para\s*\[([A-Z]{2,3}\d+)\]", re.IGNORECASE)
+QUOTE_RE = re.compile(r'"([^"\n]+)"')
+VARIABLE_RE = re.compile(r"\{\{\s*([a-zA-Z_][\w]*)\s*\}\}")
+ROUTE_RE = re.compile(r"^####+\s*([+\-x?])?\s*([^\n]*)((?:\n(?!####).*)*)", re.MULTILINE)
+
+
+class FakeLLMConfig:
+    """Parâmetros de latência/erros (mudam em tempo de execução por POST /fake/config)."""
+
+    FIELDS = {
+        "first_token_ms": float,
+        "tokens_per_second": float,
+        "chunk_tokens": int,
+        "error_rate": float,
+        "error_status": int,
+        "stall_rate": float,
+        "stall_seconds": float,
+    }
+
+    def __init__(self):
+        self.first_token_ms = float(os.getenv("FAKE_LLM_FIRST_TOKEN_MS", "300"))
+        self.tokens_per_second = float(os.getenv("FAKE_LLM_TOKENS_PER_SECOND", "80"))
+        self.chunk_tokens = int(os.getenv("FAKE_LLM_CHUNK_TOKENS", "4"))
+        self.error_rate = float(os.getenv("FAKE_LLM_ERROR_RATE", "0"))
+        self.error_status = int(os.getenv("FAKE_LLM_ERROR_STATUS", "500"))
+        self.stall_rate = float(os.getenv("FAKE_LLM_STALL_RATE", "0"))
+        self.stall_seconds = float(os.getenv("FAKE_LLM_STALL_SECONDS", "120"))
+        self.canned_analysis = _read_canned(os.getenv("FAKE_LLM_CANNED_ANALYSIS", ""))
+        seed = os.getenv("FAKE_LLM_SEED", "")
+        self.random = random.Random(int(seed) if seed else None)
+
+    def update(self, values: Dict[str, Any]) -> None:
+        for name, cast in self.FIELDS.items():
+            if name in values:
+                setattr(self, name, cast(values[name]))
+        if "seed" in values:
+            self.random.seed(values["seed"])
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {name: getattr(self, name) for name in self.FIELDS}
+
+
+def _read_canned(path: str) -> Optional[str]:
+    if not path:
+        return None
+    with open(path, encoding="utf-8") as f:
+        return f.read()
+
+
+config = FakeLLMConfig()
+counters = {"requests": 0, "streamed": 0, "errors_injected": 0, "stalls_injected": 0, "output_tokens": 0}
+app = FastAPI(title="Fake LLM (OpenAI + Anthropic)", version="1.0.0")
+
+
+def estimate_tokens(text: str) -> int:
+    """Mesma estimativa do llm_accounting (~4 caracteres por token)."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+# ---------------------------------------------------------------------------
+# Geração das respostas
+# ---------------------------------------------------------------------------
+
+def _between(text: str, start: str, end: str) -> Optional[str]:
+    begin = text.find(start)
+    if begin == -1:
+        return None
+    begin += len(start)
+    finish = text.find(end, begin)
+    return text[begin:finish if finish != -1 else len(text)].strip()
+
+
+def _block_from_section(section: str, order_index: int) -> Optional[Dict[str, Any]]:
+    header = section.split("\n", 1)[0]
+    key_match = KEY_RE.search(header.upper())
+    if key_match:
+        block_key = key_match.group(1)
+    elif "ABERTURA" in header.upper():
+        block_key = "PM001"
+    else:
+        return None
+    block_type = PREFIX_TYPES.get(re.match(r"[A-Z]+", block_key).group(0), "mensagem")
+    body = section.split("\n", 1)[1] if "\n" in section else ""
+
+    quote = QUOTE_RE.search(body)
+    next_match = NEXT_RE.search(body)
+    variable = VARIABLE_RE.search(body)
+    block: Dict[str, Any] = {
+        "block_key": block_key,
+        "block_type": block_type,
+        "content": quote.group(1) if quote else f"Bloco {block_key}",
+        "next_block_key": next_match.group(1) if next_match else None,
+        "order_index": order_index,
+    }
+    if block_type == "aguardar":
+        block["variable_name"] = variable.group(1) if variable else None
+    elif block_type == "caminhos":
+        block["analyze_variable"] = variable.group(1) if variable else None
+        block["next_block_key"] = None
+        block["routes_data"] = [
+            {
+                "route_key": f"{block_key}_r{index}",
+                "label": label.strip() or f"Rota {index}",
+                "ordem": index,
+                "cor": "#6b7280" if symbol == "?" else "#22c55e" if symbol == "+" else "#ef4444",
+                "keywords": [],
+                "response": "",
+                "destination_type": "continuar",
+                "destination_block_key": (NEXT_RE.search(route_body) or KEY_RE.search(route_body) or [None, None])[1],
+                "max_loop_attempts": 2,
+                "is_fallback": symbol == "?",
+            }
+            for index, (symbol, label, route_body) in enumerate(ROUTE_RE.findall(body), 1)
+        ] or [
+            {"route_key": f"{block_key}_r1", "label": "Outro", "ordem": 1, "cor": "#6b7280", "keywords": [],
+             "response": "", "destination_type": "continuar", "destination_block_key": None,
+             "max_loop_attempts": 2, "is_fallback": True},
+        ]
+    return block
+
+
+def analysis_response(user_prompt: str) -> str:
+    """JSON de blocos do prompt (ou do TRECHO, no modo sections)."""
+    if config.canned_analysis is not None:
+        return config.canned_analysis
+    source = user_prompt.split("TRECHO:\n", 1)[1] if "TRECHO:\n" in user_prompt else user_prompt
+    blocks: List[Dict[str, Any]] = []
+    for section in SECTION_RE.findall(source):
+        block = _block_from_section(section, len(blocks))
+        if block:
+            blocks.append(block)
+    return json.dumps({"blocks": blocks}, ensure_ascii=False, indent=2)
+
+
+def full_patch_response(user_prompt: str) -> str:
+    """Prompt original com a seção do bloco trocada pela nova seção formatada."""
+    original = _between(user_prompt, "## PROMPT ORIGINAL (COMPLETO)\n\n", "\n\n---\n\n## BLOCO A ATUALIZAR") or ""
+    new_section = _between(user_prompt, "**Nova Seção Formatada:**\n\n", "\n\n---\n\n## TAREFA") or ""
+    block_key = (_between(user_prompt, "**ID do Bloco:**", "\n") or "").strip()
+    for match in SECTION_RE.finditer(original):
+        if f"[{block_key}]" in match.group(0).split("\n", 1)[0]:
+            section = match.group(0)
+            # Não engole o separador "---" que fecha a seção
+            separator = re.search(r"\n---\s*(\n|$)", section)
+            body = section[:separator.start()] if separator else section
+            end = match.start() + len(body.rstrip())
+            return original[:match.start()] + new_section + original[end:]
+    return original
+
+
+def generate_response(system_prompt: str, user_prompt: str) -> str:
+    if "## SEÇÃO ALVO" in user_prompt:
+        return _between(user_prompt, "## NOVA SEÇÃO FORMATADA\n\n", "\n\n---\n\n## TAREFA") or ""
+    if "## PROMPT ORIGINAL (COMPLETO)" in user_prompt:
+        return full_patch_response(user_prompt)
+    return analysis_response(user_prompt)
+
+
+# ---------------------------------------------------------------------------
+# Latência, erros e streaming
+# ---------------------------------------------------------------------------
+
+async def _inject_faults(provider: str) -> Optional[JSONResponse]:
+    """Sorteia erro (resposta pronta) ou travamento antes do primeiro token."""
+    counters["requests"] += 1
+    if config.random.random() < config.error_rate:
+        counters["errors_injected"] += 1
+        status = config.error_status
+        if provider == "anthropic":
+            error_type = {429: "rate_limit_error", 529: "overloaded_error"}.get(status, "api_error")
+            return JSONResponse({"type": "error", "error": {"type": error_type, "message": "erro injetado (fake)"}}, status_code=status)
+        error_type = "rate_limit_exceeded" if status == 429 else "server_error"
+        return JSONResponse({"error": {"message": "erro injetado (fake)", "type": error_type, "code": None}}, status_code=status)
+    if config.random.random() < config.stall_rate:
+        counters["stalls_injected"] += 1
+        await asyncio.sleep(config.stall_seconds)
+    await asyncio.sleep(config.first_token_ms / 1000)
+    return None
+
+
+async def _paced_chunks(text: str) -> AsyncIterator[str]:
+    """Texto em pedaços de FAKE_LLM_CHUNK_TOKENS tokens na velocidade configurada."""
+    size = max(1, config.chunk_tokens) * 4
+    delay = config.chunk_tokens / config.tokens_per_second if config.tokens_per_second > 0 else 0
+    for start in range(0, len(text), size):
+        if start and delay:
+            await asyncio.sleep(delay)
+        yield text[start:start + size]
+
+
+async def _generation_time(text: str) -> None:
+    """Resposta sem streaming também leva o tempo de gerar os tokens."""
+    if config.tokens_per_second > 0:
+        await asyncio.sleep(estimate_tokens(text) / config.tokens_per_second)
+
+
+def _sse(data: Dict[str, Any], event: Optional[str] = None) -> str:
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _split_openai_messages(messages: List[Dict[str, Any]]) -> Tuple[str, str]:
+    system = "\n".join(_text(m.get("content")) for m in messages if m.get("role") == "system")
+    user = "\n".join(_text(m.get("content")) for m in messages if m.get("role") == "user")
+    return system, user
+
+
+def _text(content: Any) -> str:
+    """content pode ser string ou lista de partes {"type": "text", "text": ...}."""
+    if isinstance(content, list):
+        return "".join(part.get("text", "") for part in content if isinstance(part, dict))
+    return content or ""
+
+
+# ---------------------------------------------------------------------------
+# Endpoints
+# ---------------------------------------------------------------------------
+
+@app.post("/v1/chat/completions")
+async def openai_chat_completions(request: Request):
+    payload = await request.json()
+    model = payload.get("model", "fake-openai")
+    system, user = _split_openai_messages(payload.get("messages", []))
+    fault = await _inject_faults("openai")
+    if fault is not None:
+        return fault
+
+    text = generate_response(system, user)
+    prompt_tokens = estimate_tokens(system + user)
+    completion_tokens = estimate_tokens(text)
+    counters["output_tokens"] += completion_tokens
+    completion_id = f"chatcmpl-{uuid.uuid4().hex[:24]}"
+    created = int(time.time())
+    usage = {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens, "total_tokens": prompt_tokens + completion_tokens}
+
+    if not payload.get("stream"):
+        await _generation_time(text)
+        return {
+            "id": completion_id,
+            "object": "chat.completion",
+            "created": created,
+            "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": usage,
+        }
+
+    counters["streamed"] += 1
+    include_usage = bool((payload.get("stream_options") or {}).get("include_usage"))
+
+    async def events() -> AsyncIterator[str]:
+        base = {"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model}
+        yield _sse({**base, "choices": [{"index": 0, "delta": {"role": "assistant", "content": ""}, "finish_reason": None}]})
+        async for piece in _paced_chunks(text):
+            yield _sse({**base, "choices": [{"index": 0, "delta": {"content": piece}, "finish_reason": None}]})
+        yield _sse({**base, "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]})
+        if include_usage:
+            yield _sse({**base, "choices": [], "usage": usage})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/messages")
+async def anthropic_messages(request: Request):
+    payload = await request.json()
+    model = payload.get("model", "fake-anthropic")
+    system = _text(payload.get("system"))
+    user = "\n".join(_text(m.get("content")) for m in payload.get("messages", []) if m.get("role") == "user")
+    fault = await _inject_faults("anthropic")
+    if fault is not None:
+        return fault
+
+    text = generate_response(system, user)
+    input_tokens = estimate_tokens(system + user)
+    output_tokens = estimate_tokens(text)
+    counters["output_tokens"] += output_tokens
+    message_id = f"msg_{uuid.uuid4().hex[:24]}"
+
+    if not payload.get("stream"):
+        await _generation_time(text)
+        return {
+            "id": message_id,
+            "type": "message",
+            "role": "assistant",
+            "model": model,
+            "content": [{"type": "text", "text": text}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": input_tokens, "output_tokens": output_tokens},
+        }
+
+    counters["streamed"] += 1
+
+    async def events() -> AsyncIterator[str]:
+        yield _sse({
+            "type": "message_start",
+            "message": {
+                "id": message_id, "type": "message", "role": "assistant", "model": model, "content": [],
+                "stop_reason": None, "stop_sequence": None,
+                "usage": {"input_tokens": input_tokens, "output_tokens": 1},
+            },
+        }, event="message_start")
+        yield _sse({"type": "content_block_start", "index": 0, "content_block": {"type": "text", "text": ""}}, event="content_block_start")
+        yield _sse({"type": "ping"}, event="ping")
+        async for piece in _paced_chunks(text):
+            yield _sse({"type": "content_block_delta", "index": 0, "delta": {"type": "text_delta", "text": piece}}, event="content_block_delta")
+        yield _sse({"type": "content_block_stop", "index": 0}, event="content_block_stop")
+        yield _sse({
+            "type": "message_delta",
+            "delta": {"stop_reason": "end_turn", "stop_sequence": None},
+            "usage": {"output_tokens": output_tokens},
+        }, event="message_delta")
+        yield _sse({"type": "message_stop"}, event="message_stop")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.get("/fake/config")
+def get_fake_config() -> dict:
+    return {"config": config.to_dict(), "counters": counters}
+
+
+@app.post("/fake/config")
+async def update_fake_config(request: Request) -> dict:
+    """Muda latência/erros sem reiniciar (ex: {"error_rate": 0.2, "error_status": 529})."""
+    config.update(await request.json())
+    return {"config": config.to_dict(), "counters": counters}
+
+
+@app.get("/health")
+def health():
+    return {"status": "ok"}
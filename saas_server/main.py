@@ -1,3 +1,4 @@
+import asyncio
 import os
 import logging
 from pathlib import Path
@@ -11,6 +12,10 @@ from saas_tools.api.tools import router as tools_router
 from saas_tools.api.assistants import router as assistants_router
 from saas_tools.api.dashboard import router as dashboard_router
 from saas_tools.api.flows import router as flows_router
+from saas_tools.api.admin import router as admin_router
+from saas_tools.services.ai_jobs import ai_job_queue
+from saas_tools.services.assistant_schema import assistant_schema
+from saas_tools.services.async_supabase_service import async_supabase_service
 
 # Configurar logging
 logging.basicConfig(
@@ -45,11 +50,30 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+@app.on_event("startup")
+async def resolve_assistant_schema():
+    """Descobre a tabela de assistentes uma vez (se falhar, tenta de novo na primeira leitura)."""
+    await asyncio.to_thread(assistant_schema.resolve)
+
+
+@app.on_event("shutdown")
+async def close_supabase_pool():
+    """Fecha o pool HTTP keep-alive compartilhado pelo cliente async do Supabase."""
+    await async_supabase_service.aclose()
+
+
+@app.on_event("shutdown")
+def stop_ai_jobs():
+    """Para o pool de jobs de IA (jobs em andamento não são aguardados)."""
+    ai_job_queue.shutdown()
+
+
 # APIs do tools manager (igual vapi-tools-manager, agora dentro do SaaS)
 app.include_router(tools_router, prefix="/api")
 app.include_router(assistants_router, prefix="/api")
 app.include_router(dashboard_router, prefix="/api")
 app.include_router(flows_router, prefix="/api")
+app.include_router(admin_router, prefix="/api")
 
 # Servir o SaaS estático inteiro
 app.mount("/menu_principal", StaticFiles(directory=str(ROOT / "menu_principal")), name="menu_principal")
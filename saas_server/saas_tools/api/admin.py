@@ -0,0 +1,40 @@
+"""
+Admin API: uso dos LLMs (tokens, latência e custo por tenant e por endpoint).
+"""
+from fastapi import APIRouter, Header, HTTPException, Query
+from typing import Optional
+import hmac
+import logging
+
+from saas_tools.config import settings
+from saas_tools.services.llm_accounting import llm_accounting
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(tags=["admin"])
+
+
+def _check_admin_token(token: Optional[str]) -> None:
+    # Sem ADMIN_API_TOKEN configurado os endpoints ficam fechados (não abertos)
+    if not settings.ADMIN_API_TOKEN:
+        raise HTTPException(status_code=503, detail="Admin API desabilitada: defina ADMIN_API_TOKEN")
+    # compare_digest: tempo constante, não vaza o token pelo tempo de resposta
+    if not token or not hmac.compare_digest(token.encode(), settings.ADMIN_API_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Token de admin inválido")
+
+
+@router.get("/admin/llm/usage")
+async def get_llm_usage(
+    tenant_id: Optional[str] = Query(None, description="Filtra as chamadas recentes por tenant"),
+    limit: int = Query(100, ge=0, le=2000, description="Quantas chamadas recentes devolver"),
+    x_admin_token: Optional[str] = Header(None),
+) -> dict:
+    """
+    Acumulados das chamadas aos LLMs por tenant e por endpoint (desde o início do
+    processo) + as chamadas mais recentes do ring buffer.
+    """
+    _check_admin_token(x_admin_token)
+    return {
+        **llm_accounting.rollups(),
+        "recent": llm_accounting.recent(limit=limit, tenant_id=tenant_id),
+    }
@@ -8,7 +8,7 @@ from saas_tools.models.schemas import (
     AssistantFlowUpsert,
     PromptImportParseRequest,
 )
-from saas_tools.services.supabase_service import supabase_service
+from saas_tools.services.async_supabase_service import async_supabase_service
 
 logger = logging.getLogger(__name__)
 
@@ -173,7 +173,7 @@ def parse_prompt_master(prompt_master: str) -> Dict[str, Any]:
 @router.get("/assistants/{assistant_id}/profile")
 async def get_profile(assistant_id: str):
     try:
-        profile = supabase_service.get_assistant_profile(assistant_id)
+        profile = await async_supabase_service.get_assistant_profile(assistant_id)
         if not profile:
             return {"success": True, "profile": {"assistant_id": assistant_id}}
         return {"success": True, "profile": profile}
@@ -185,7 +185,7 @@ async def get_profile(assistant_id: str):
 @router.put("/assistants/{assistant_id}/profile")
 async def upsert_profile(assistant_id: str, payload: AssistantProfileUpsert):
     try:
-        saved = supabase_service.upsert_assistant_profile(assistant_id, payload.model_dump())
+        saved = await async_supabase_service.upsert_assistant_profile(assistant_id, payload.model_dump())
         return {"success": True, "profile": saved}
     except Exception as e:
         logger.error(f"Erro ao salvar assistant_profile: {e}")
@@ -195,7 +195,7 @@ async def upsert_profile(assistant_id: str, payload: AssistantProfileUpsert):
 @router.get("/assistants/{assistant_id}/flow")
 async def get_flow(assistant_id: str):
     try:
-        flow = supabase_service.get_assistant_flow(assistant_id)
+        flow = await async_supabase_service.get_assistant_flow(assistant_id)
         if not flow:
             return {"success": True, "flow": None}
         return {"success": True, "flow": flow}
@@ -207,7 +207,7 @@ async def get_flow(assistant_id: str):
 @router.put("/assistants/{assistant_id}/flow")
 async def upsert_flow(assistant_id: str, payload: AssistantFlowUpsert):
     try:
-        saved = supabase_service.upsert_assistant_flow(
+        saved = await async_supabase_service.upsert_assistant_flow(
             assistant_id,
             payload.flow_json,
             meta={"title": payload.title, "description": payload.description},
@@ -224,7 +224,7 @@ async def prompt_import_parse(assistant_id: str, req: PromptImportParseRequest):
         parsed = parse_prompt_master(req.prompt_master)
         # optional: store history (best-effort)
         try:
-            supabase_service.create_prompt_import_run(
+            await async_supabase_service.create_prompt_import_run(
                 assistant_id,
                 {
                     "input_text": req.prompt_master,
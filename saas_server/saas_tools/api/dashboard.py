@@ -1,7 +1,7 @@
 from fastapi import APIRouter, HTTPException, Query
 import logging
 
-from saas_tools.services.supabase_service import supabase_service
+from saas_tools.services.async_supabase_service import async_supabase_service
 
 logger = logging.getLogger(__name__)
 
@@ -9,7 +9,7 @@ router = APIRouter(tags=["dashboard"])
 
 
 @router.get("/dashboard/ia-insights")
-def get_ia_insights(
+async def get_ia_insights(
     tenant_id: str = Query(..., description="ID do tenant"),
     data: str = Query(..., description="Data no formato YYYY-MM-DD"),
 ):
@@ -19,7 +19,7 @@ def get_ia_insights(
     usa como base o total que já está no dashboard (KPI).
     """
     try:
-        row = supabase_service.get_ia_insights(tenant_id, data)
+        row = await async_supabase_service.get_ia_insights(tenant_id, data)
         if not row:
             return {
                 "success": True,
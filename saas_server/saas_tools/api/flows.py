@@ -2,8 +2,12 @@
 Flow Editor API: list, get, create, save, update flows; get built prompt.
 """
 from fastapi import APIRouter, HTTPException, Query
-from typing import Dict, Any
+from fastapi.responses import StreamingResponse
+from typing import Dict, Any, Iterator
+import asyncio
+import json
 import logging
+import time
 
 from saas_tools.models.schemas import (
     FlowCreate,
@@ -12,9 +16,19 @@ from saas_tools.models.schemas import (
     SaveFlowResult,
     FlowBlockUpsert,
 )
+from saas_tools.services import async_flow_service
 from saas_tools.services import flow_service
+from saas_tools.services.ai_jobs import ai_job_queue
 from saas_tools.services import prompt_builder
-from saas_tools.services.supabase_service import supabase_service
+from saas_tools.services.async_supabase_service import async_supabase_service
+from saas_tools.services.flow_ai_analyzer import FlowAIAnalyzer
+from saas_tools.services.flow_cache import flow_snapshot_cache
+from saas_tools.services.llm_cache import llm_cache
+from saas_tools.services.llm_hedging import llm_hedger
+from saas_tools.services.llm_providers import llm_providers
+from saas_tools.services.llm_resilience import LLMCallError, llm_resilience
+from saas_tools.services.llm_routing import model_router
+from saas_tools.services.prompt_parse_sessions import parse_session_store
 
 logger = logging.getLogger(__name__)
 
@@ -121,14 +135,14 @@ def _save_block_routes(client, flow_id: str, block_key: str, routes: list, assis
 
 
 @router.get("/flows")
-def list_flows(tenant_id: str = Query(..., description="Tenant ID")) -> list:
+async def list_flows(tenant_id: str = Query(..., description="Tenant ID")) -> list:
     """List flows for the given tenant."""
-    flows = flow_service.list_flows_by_tenant(tenant_id)
+    flows = await async_flow_service.list_flows_by_tenant(tenant_id)
     return flows
 
 
 @router.get("/flows/by-assistant/{assistente_id}")
-def get_flow_by_assistant(
+async def get_flow_by_assistant(
     assistente_id: str,
     tenant_id: str = Query(..., description="Tenant ID (used to create flow if none exists)"),
     create_if_missing: bool = Query(True, description="Create a default flow if none linked"),
@@ -136,88 +150,30 @@ def get_flow_by_assistant(
     """Return the flow linked to this assistant."""
     """Return the flow linked to this assistant."""
     logger.info(f"🌐 [API] get_flow_by_assistant: assistente_id={assistente_id}, tenant_id={tenant_id}")
-    flow = flow_service.get_flow_by_assistant(assistente_id)
+    flow = await async_flow_service.get_flow_by_assistant(assistente_id)
     if flow:
         logger.info(f"✅ [API] Flow encontrado: flow_id={flow.get('id')}")
-        complete = flow_service.get_flow_complete(flow["id"])
+        complete = await async_flow_service.get_flow_complete(flow["id"])
         if complete:
             # ⭐ NOVO: Routes agora estão em routes_data (JSONB) dentro de flow_blocks
             # Não retornar routes separadas, apenas blocos (que já têm routes_data)
             blocks = complete.get("blocks") or []
             
-            # 🔍 DEBUG CRÍTICO: Verificar se routes_data está presente nos blocos ANTES de retornar
-            caminhos_blocks = [b for b in blocks if b.get("block_type") == "caminhos"]
-            if caminhos_blocks:
-                logger.info(f"🔍 [API] Verificando {len(caminhos_blocks)} blocos de caminhos antes de retornar")
-                for block in caminhos_blocks:
-                    block_key = block.get("block_key", "SEM_KEY")
-                    has_routes_data = "routes_data" in block
-                    routes_data_value = block.get("routes_data")
-                    routes_data_type = type(routes_data_value).__name__ if routes_data_value is not None else "None"
-                    routes_data_length = len(routes_data_value) if isinstance(routes_data_value, list) else "N/A"
-                    
-                    logger.info(f"🔍 [API] Bloco {block_key}:")
-                    logger.info(f"  - has_routes_data: {has_routes_data}")
-                    logger.info(f"  - routes_data_type: {routes_data_type}")
-                    logger.info(f"  - routes_data_length: {routes_data_length}")
-                    logger.info(f"  - routes_data_value: {str(routes_data_value)[:200] if routes_data_value else 'None'}")
-                    logger.info(f"  - TODAS propriedades: {list(block.keys())}")
-                    
-                    # ⚠️ VERIFICAÇÃO CRÍTICA: Se CAM001 não tem routes_data, buscar diretamente
-                    if block_key == "CAM001" and (not has_routes_data or routes_data_value is None):
-                        logger.error(f"❌ [API] CAM001 SEM routes_data! Buscando diretamente do banco...")
-                        try:
-                            client = supabase_service._require_client()
-                            direct_resp = client.table("flow_blocks").select("routes_data").eq("block_key", "CAM001").eq("flow_id", flow["id"]).single().execute()
-                            if direct_resp.data and "routes_data" in direct_resp.data:
-                                block["routes_data"] = direct_resp.data["routes_data"]
-                                logger.info(f"✅ [API] routes_data recuperado para CAM001: {len(block['routes_data'])} routes")
-                        except Exception as e:
-                            logger.error(f"❌ [API] Erro ao buscar routes_data para CAM001: {str(e)}")
-            
-            # ⚠️ GARANTIR que routes_data está presente antes de serializar JSON
-            for block in blocks:
-                if block.get("block_type") == "caminhos" and "routes_data" not in block:
-                    logger.warning(f"⚠️ [API] Bloco {block.get('block_key')} não tem routes_data antes de serializar!")
-                    block["routes_data"] = []
-            
+            # routes_data já vem normalizado pelo snapshot (blocos de caminhos sempre com lista)
             result = {
                 "flow": complete.get("flow") or flow,
                 "blocks": blocks,  # ⭐ Blocos com routes_data
                 "routes": [],  # ⚠️ DEPRECATED: routes agora em routes_data dos blocos
+                "generation_pending": complete.get("generation_pending", False),
+                "generation_job_id": complete.get("generation_job_id"),
             }
             
-            # 🔍 DEBUG FINAL: Verificar CAM001 no resultado final ANTES de serializar
-            cam001_in_result = next((b for b in result["blocks"] if b.get("block_key") == "CAM001"), None)
-            if cam001_in_result:
-                logger.info(f"🔍 [API] CAM001 NO RESULTADO FINAL ANTES DE SERIALIZAR:")
-                logger.info(f"  - has_routes_data: {'routes_data' in cam001_in_result}")
-                logger.info(f"  - routes_data_type: {type(cam001_in_result.get('routes_data')).__name__}")
-                logger.info(f"  - routes_data_length: {len(cam001_in_result.get('routes_data', [])) if isinstance(cam001_in_result.get('routes_data'), list) else 'N/A'}")
-                logger.info(f"  - routes_data_value: {str(cam001_in_result.get('routes_data'))[:500]}")
-                logger.info(f"  - TODAS propriedades: {list(cam001_in_result.keys())}")
-            
-            blocks_count = len(result.get('blocks', []))
-            # Contar routes em routes_data para log
             routes_in_data = sum(
-                len(b.get("routes_data", [])) 
-                for b in result.get("blocks", []) 
-                if b.get("block_type") == "caminhos" and b.get("routes_data")
+                len(b.get("routes_data") or [])
+                for b in blocks
+                if b.get("block_type") == "caminhos"
             )
-            logger.info(f"✅ [API] Retornando: {blocks_count} blocos, {routes_in_data} routes em routes_data")
-            
-            # ⚠️ VERIFICAÇÃO FINAL: Se CAM001 não tem routes_data no resultado, buscar diretamente
-            if cam001_in_result and (not cam001_in_result.get("routes_data") or len(cam001_in_result.get("routes_data", [])) == 0):
-                logger.error(f"❌ [API] CAM001 SEM routes_data no resultado final! Buscando diretamente...")
-                try:
-                    from saas_tools.services.supabase_service import supabase_service
-                    client = supabase_service._require_client()
-                    direct_resp = client.table("flow_blocks").select("routes_data").eq("block_key", "CAM001").eq("flow_id", flow["id"]).single().execute()
-                    if direct_resp.data and "routes_data" in direct_resp.data and direct_resp.data["routes_data"]:
-                        cam001_in_result["routes_data"] = direct_resp.data["routes_data"]
-                        logger.info(f"✅ [API] routes_data recuperado para CAM001 no resultado final: {len(cam001_in_result['routes_data'])} routes")
-                except Exception as e:
-                    logger.error(f"❌ [API] Erro ao buscar routes_data para CAM001 no resultado final: {str(e)}")
+            logger.info(f"✅ [API] Retornando: {len(blocks)} blocos, {routes_in_data} routes em routes_data")
             
             return result
         return {"flow": flow, "blocks": [], "routes": []}
@@ -227,22 +183,14 @@ def get_flow_by_assistant(
     # Buscar prompt_voz do assistente antes de criar o flow
     prompt_base = None
     try:
-        client = supabase_service._require_client()
-        table_names = ["assistentes", "assistents", "assistants"]
-        for table_name in table_names:
-            try:
-                resp = client.table(table_name).select("prompt_voz").eq("id", assistente_id).limit(1).execute()
-                if resp.data and resp.data[0].get("prompt_voz"):
-                    prompt_base = resp.data[0].get("prompt_voz") or ""
-                    logger.info(f"✅ [API] Buscado prompt_voz do assistente (tabela: {table_name}), length: {len(prompt_base)}")
-                    break
-            except Exception:
-                continue
+        prompt_base = await async_flow_service.get_assistant_prompt_voz(assistente_id)
+        if prompt_base:
+            logger.info(f"✅ [API] Buscado prompt_voz do assistente, length: {len(prompt_base)}")
     except Exception as e:
         logger.warning(f"⚠️ [API] Erro ao buscar prompt_voz: {e}")
     
     try:
-        new_flow = flow_service.create_flow(
+        new_flow = await async_flow_service.create_flow(
             tenant_id=tenant_id,
             name=f"Flow do assistente {assistente_id[:8] if len(assistente_id) >= 8 else assistente_id}",
             assistente_id=assistente_id,
@@ -258,23 +206,147 @@ def get_flow_by_assistant(
         raise HTTPException(status_code=500, detail="Erro ao criar flow (resposta vazia)")
     
     # Após criar, chamar get_flow_complete que vai gerar blocos automaticamente se necessário
-    complete = flow_service.get_flow_complete(new_flow["id"])
+    complete = await async_flow_service.get_flow_complete(new_flow["id"])
     return complete or {"flow": new_flow, "blocks": [], "routes": []}
 
 
+@router.get("/flows/cache/stats")
+async def get_flow_cache_stats() -> dict:
+    """Contadores dos caches: snapshots de flow (memória), sessões de parse e respostas de LLM (disco)."""
+    return {
+        "flow_snapshots": flow_snapshot_cache.stats(),
+        "parse_sessions": parse_session_store.stats(),
+        "llm_responses": await asyncio.to_thread(llm_cache.stats),
+    }
+
+
+@router.post("/flows/assistant-schema/refresh")
+async def refresh_assistant_schema() -> dict:
+    """Refaz a descoberta da tabela de assistentes (use depois de migrações no banco)."""
+    return await async_flow_service.refresh_schema()
+
+
+@router.get("/flows/jobs/stats")
+async def get_ai_job_stats() -> dict:
+    """Fila de jobs de IA, deduplicação, clientes de LLM, hedging (p50/p99), circuit breakers e roteamento small/large."""
+    return {
+        "queue": ai_job_queue.stats(),
+        "single_flight": flow_service.ai_analysis_flight.stats(),
+        "llm_providers": llm_providers.stats(),
+        "llm_hedging": llm_hedger.stats(),
+        "llm_resilience": llm_resilience.stats(),
+        "llm_routing": model_router.stats(),
+    }
+
+
+@router.get("/flows/jobs/{job_id}")
+async def get_ai_job(job_id: str) -> dict:
+    """Status completo de um job de geração de blocos (inclui result/error)."""
+    job = ai_job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return job.to_dict()
+
+
+@router.get("/flows/jobs/{job_id}/progress")
+async def get_ai_job_progress(job_id: str) -> dict:
+    """Progresso resumido (para polling do editor)."""
+    job = ai_job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job não encontrado")
+    return {"job_id": job.id, "status": job.status, "progress": job.progress, "stage": job.stage}
+
+
+@router.post("/flows/{flow_id}/generate")
+async def generate_flow_blocks(flow_id: str) -> dict:
+    """Enfileira a geração de blocos pela IA para o flow; acompanhe por /flows/jobs/{job_id}."""
+    flow = await async_flow_service.get_flow(flow_id)
+    if not flow:
+        raise HTTPException(status_code=404, detail="Flow não encontrado")
+    try:
+        job = await async_flow_service.generate_blocks(flow_id)
+    except RuntimeError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return job.to_dict()
+
+
+def _sse_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+def _stream_analysis_events(analyzer: FlowAIAnalyzer, flow_id: str, prompt: str) -> Iterator[str]:
+    """
+    Eventos SSE da análise: start, um block por bloco completo, done (ou error).
+    Blocos que não passam em validate_blocks vão como invalid_block (com o problema).
+    """
+    started = time.monotonic()
+    first_block_ms = None
+    count = 0
+    invalid = 0
+    yield _sse_event("start", {"flow_id": flow_id, "prompt_chars": len(prompt)})
+    try:
+        for block, problem in analyzer.stream_prompt_blocks(prompt):
+            if problem:
+                invalid += 1
+                yield _sse_event("invalid_block", {"block": block, "problem": problem})
+                continue
+            if first_block_ms is None:
+                first_block_ms = int((time.monotonic() - started) * 1000)
+            count += 1
+            yield _sse_event("block", block)
+    except LLMCallError as e:
+        # Motivo da falha (timeout, circuito aberto, rate limit...) vai para o editor
+        logger.error("❌ [API] analyze/stream: Erro no streaming do flow %s: %s", flow_id, e)
+        yield _sse_event("error", {"detail": str(e)[:500], "blocks": count, **e.to_dict()})
+        return
+    except Exception as e:
+        logger.error("❌ [API] analyze/stream: Erro no streaming do flow %s: %s", flow_id, e)
+        yield _sse_event("error", {"detail": str(e)[:500], "blocks": count})
+        return
+    total_ms = int((time.monotonic() - started) * 1000)
+    logger.info("✅ [API] analyze/stream: flow %s, %d blocos (%d inválidos), primeiro em %sms, total %dms",
+                flow_id, count, invalid, first_block_ms, total_ms)
+    yield _sse_event("done", {"blocks": count, "invalid_blocks": invalid, "first_block_ms": first_block_ms, "total_ms": total_ms})
+
+
+@router.get("/flows/{flow_id}/analyze/stream")
+async def stream_flow_analysis(flow_id: str, provider: str = Query("openai", description="anthropic ou openai")):
+    """
+    Análise do prompt pela IA em Server-Sent Events: cada bloco é enviado (event: block)
+    assim que o objeto dele fica completo na resposta do modelo, para o editor ir
+    desenhando o canvas; blocos fora do esquema vêm como event: invalid_block.
+    Não grava nada; para gravar use POST /flows/{flow_id}/generate.
+    """
+    snapshot = await asyncio.to_thread(flow_service.load_flow_snapshot, flow_id)
+    if not snapshot:
+        raise HTTPException(status_code=404, detail="Flow não encontrado")
+    prompt = snapshot.prompt_to_parse
+    if not prompt or not prompt.strip():
+        raise HTTPException(status_code=400, detail="Flow não tem prompt_base nem prompt_voz para analisar")
+    try:
+        analyzer = FlowAIAnalyzer(provider=provider, tenant_id=snapshot.flow.get("tenant_id"), flow_id=flow_id)
+    except ValueError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return StreamingResponse(
+        _stream_analysis_events(analyzer, flow_id, prompt),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
 @router.get("/flows/{flow_id}")
-def get_flow_complete(flow_id: str) -> dict:
-    """Return flow + blocks + routes for the editor."""
-    data = flow_service.get_flow_complete(flow_id)
+async def get_flow_complete(flow_id: str) -> dict:
+    """Return flow + blocks + routes for the editor (generation_pending se a IA ainda está gerando blocos)."""
+    data = await async_flow_service.get_flow_complete(flow_id)
     if not data:
         raise HTTPException(status_code=404, detail="Flow não encontrado")
     return data
 
 
 @router.post("/flows")
-def create_flow(payload: FlowCreate) -> dict:
+async def create_flow(payload: FlowCreate) -> dict:
     """Create a new flow."""
-    flow = flow_service.create_flow(
+    flow = await async_flow_service.create_flow(
         tenant_id=payload.tenant_id,
         name=payload.name,
         assistente_id=payload.assistente_id,
@@ -287,7 +359,7 @@ def create_flow(payload: FlowCreate) -> dict:
 
 
 @router.post("/flows/save", response_model=SaveFlowResult)
-def save_flow(payload: SaveFlowPayload) -> dict:
+async def save_flow(payload: SaveFlowPayload) -> dict:
     """Save flow blocks and routes (DELETE all + INSERT all), increment version."""
     logger.info("🔵 [API] save_flow chamado - flow_id=%s, blocks=%d, routes=%d", 
                payload.flow_id, len(payload.blocks), len(payload.routes))
@@ -310,7 +382,7 @@ def save_flow(payload: SaveFlowPayload) -> dict:
     else:
         logger.warning("⚠️ [API] Nenhuma route recebida do frontend")
     
-    result = flow_service.save_flow(payload)
+    result = await async_flow_service.save_flow(payload)
     if not result.get("success"):
         err = result.get("error") or ""
         logger.error("❌ [API] save_flow falhou: %s", err)
@@ -318,12 +390,13 @@ def save_flow(payload: SaveFlowPayload) -> dict:
             status_code=404 if "não encontrado" in err else 500,
             detail=err or "Erro ao salvar flow",
         )
-    logger.info("✅ [API] save_flow concluído - version=%d", result.get("version", 0))
+    logger.info("✅ [API] save_flow concluído - version=%d, gravados=%d, pulados=%d",
+               result.get("version", 0), result.get("written", 0), result.get("skipped", 0))
     return result
 
 
 @router.patch("/flows/{flow_id}/blocks/{block_key}")
-def update_single_block(
+async def update_single_block(
     flow_id: str,
     block_key: str,
     block: FlowBlockUpsert,
@@ -332,13 +405,24 @@ def update_single_block(
     ⚡ MÉTODO SIMPLES: Atualiza apenas um bloco específico na tabela flow_blocks.
     Use este endpoint quando você editar apenas um bloco no Flow Editor.
     """
+    try:
+        result = await _write_single_block(flow_id, block_key, block)
+        # flows.version avança: o cache (deste e de outros processos) para de servir o snapshot antigo
+        await async_flow_service.bump_flow_version(flow_id)
+        return result
+    finally:
+        flow_snapshot_cache.invalidate(flow_id)
+
+
+async def _write_single_block(flow_id: str, block_key: str, block: FlowBlockUpsert) -> dict:
+    """UPDATE/INSERT do bloco (RPC update_flow_block_simple, com fallback para o método tradicional)."""
     logger.info("🔵 [API] update_single_block: flow_id=%s, block_key=%s", flow_id, block_key)
     
     try:
-        client = supabase_service._require_client()
+        client = await async_supabase_service._require_client()
         
         # Buscar o flow para pegar assistente_id e tenant_id
-        flow_resp = client.table("flows").select("assistente_id, tenant_id").eq("id", flow_id).limit(1).execute()
+        flow_resp = await client.table("flows").select("assistente_id, tenant_id").eq("id", flow_id).limit(1).execute()
         if not flow_resp.data:
             raise HTTPException(status_code=404, detail="Flow não encontrado")
         
@@ -411,10 +495,10 @@ def update_single_block(
             if "routes_data" in update_data:
                 logger.info("🔵 [API] Bloco %s tem routes_data, usando UPDATE direto em vez de RPC", block_key)
                 # Verificar se existe
-                existing_resp = client.table("flow_blocks").select("id").eq("flow_id", flow_id).eq("block_key", block_key).limit(1).execute()
+                existing_resp = await client.table("flow_blocks").select("id").eq("flow_id", flow_id).eq("block_key", block_key).limit(1).execute()
                 if existing_resp.data:
                     # UPDATE com routes_data
-                    result_direct = client.table("flow_blocks").update(update_data).eq("flow_id", flow_id).eq("block_key", block_key).execute()
+                    result_direct = await client.table("flow_blocks").update(update_data).eq("flow_id", flow_id).eq("block_key", block_key).execute()
                     if result_direct.data:
                         routes_data_count = len(update_data.get("routes_data", [])) if isinstance(update_data.get("routes_data"), list) else 0
                         return {
@@ -434,7 +518,7 @@ def update_single_block(
                         "tenant_id": tenant_id,
                         **update_data
                     }
-                    result_direct = client.table("flow_blocks").insert(insert_data_with_routes).execute()
+                    result_direct = await client.table("flow_blocks").insert(insert_data_with_routes).execute()
                     if result_direct.data:
                         routes_data_count = len(update_data.get("routes_data", [])) if isinstance(update_data.get("routes_data"), list) else 0
                         return {
@@ -465,7 +549,7 @@ def update_single_block(
                 "p_next_block_key": update_data.get("next_block_key"),
             }
             
-            result = client.rpc("update_flow_block_simple", rpc_params).execute()
+            result = await client.rpc("update_flow_block_simple", rpc_params).execute()
             
             if result.data and len(result.data) > 0:
                 rpc_result = result.data[0]
@@ -486,7 +570,7 @@ def update_single_block(
                         logger.info("🔵 [API] Bloco %s é do tipo 'caminhos' sem routes_data", block_key)
                 
                 # Buscar o bloco completo para retornar
-                block_resp = client.table("flow_blocks").select("*").eq("flow_id", flow_id).eq("block_key", block_key).single().execute()
+                block_resp = await client.table("flow_blocks").select("*").eq("flow_id", flow_id).eq("block_key", block_key).single().execute()
                 
                 return {
                     "success": True,
@@ -506,11 +590,11 @@ def update_single_block(
             # Fallback: método tradicional (pode dar timeout, mas tenta)
             try:
                 # Verificar se existe
-                existing_resp = client.table("flow_blocks").select("id").eq("flow_id", flow_id).eq("block_key", block_key).limit(1).execute()
+                existing_resp = await client.table("flow_blocks").select("id").eq("flow_id", flow_id).eq("block_key", block_key).limit(1).execute()
                 
                 if existing_resp.data:
                     # UPDATE tradicional
-                    result = client.table("flow_blocks").update(update_data).eq("flow_id", flow_id).eq("block_key", block_key).execute()
+                    result = await client.table("flow_blocks").update(update_data).eq("flow_id", flow_id).eq("block_key", block_key).execute()
                     if result.data:
                         # ⭐ Routes agora estão em routes_data (JSONB), já foram salvas no UPDATE acima
                         routes_data_count = 0
@@ -536,7 +620,7 @@ def update_single_block(
                         "tenant_id": tenant_id,
                         **update_data
                     }
-                    result = client.table("flow_blocks").insert(insert_data).execute()
+                    result = await client.table("flow_blocks").insert(insert_data).execute()
                     if result.data:
                         # ⭐ Routes agora estão em routes_data (JSONB), já foram salvas no INSERT acima
                         routes_data_count = 0
@@ -569,45 +653,45 @@ def update_single_block(
 
 
 @router.patch("/flows/{flow_id}")
-def update_flow(flow_id: str, payload: FlowUpdate) -> dict:
+async def update_flow(flow_id: str, payload: FlowUpdate) -> dict:
     """Update flow metadata (name, description, prompt_base, status, is_active)."""
-    flow = flow_service.get_flow(flow_id)
+    flow = await async_flow_service.get_flow(flow_id)
     if not flow:
         raise HTTPException(status_code=404, detail="Flow não encontrado")
     data = payload.model_dump(exclude_unset=True)
-    ok = flow_service.update_flow(flow_id, data)
+    ok = await async_flow_service.update_flow(flow_id, data)
     if not ok:
         raise HTTPException(status_code=500, detail="Erro ao atualizar flow")
-    updated = flow_service.get_flow(flow_id)
+    updated = await async_flow_service.get_flow(flow_id)
     return updated or flow
 
 
 @router.get("/flows/{flow_id}/prompt")
-def get_flow_prompt(flow_id: str) -> dict:
+async def get_flow_prompt(flow_id: str) -> dict:
     """Return the built prompt text for this flow."""
-    text = prompt_builder.get_prompt_for_flow(flow_id)
+    text = await asyncio.to_thread(prompt_builder.get_prompt_for_flow, flow_id)
     if text is None:
         raise HTTPException(status_code=404, detail="Flow não encontrado")
     return {"prompt": text}
 
 
 @router.get("/flows/by-assistant/{assistente_id}/prompt")
-def get_prompt_by_assistant(assistente_id: str) -> dict:
+async def get_prompt_by_assistant(assistente_id: str) -> dict:
     """Return the built prompt for the flow linked to this assistant."""
-    flow = flow_service.get_flow_by_assistant(assistente_id)
+    flow = await async_flow_service.get_flow_by_assistant(assistente_id)
     if not flow:
         raise HTTPException(
             status_code=404,
             detail="Nenhum flow vinculado a este assistente",
         )
-    text = prompt_builder.get_prompt_for_flow(flow["id"])
+    text = await asyncio.to_thread(prompt_builder.get_prompt_for_flow, flow["id"])
     if text is None:
         raise HTTPException(status_code=404, detail="Flow não encontrado")
     return {"prompt": text, "flow_id": flow["id"]}
 
 
 @router.delete("/flows/{flow_id}/blocks")
-def clear_flow_blocks(flow_id: str) -> dict:
+async def clear_flow_blocks(flow_id: str) -> dict:
     """
     Limpa todos os blocos de um flow (reset visual).
     NÃO deleta o flow nem o prompt_base, apenas os blocos.
@@ -616,17 +700,14 @@ def clear_flow_blocks(flow_id: str) -> dict:
     logger.info(f"🧹 [API] clear_flow_blocks: flow_id={flow_id}")
     
     try:
-        client = supabase_service._require_client()
-        
         # Deletar todos os blocos do flow
-        delete_result = client.table("flow_blocks").delete().eq("flow_id", flow_id).execute()
-        deleted_count = len(delete_result.data) if delete_result.data else 0
+        deleted_count = await async_flow_service.clear_flow_blocks(flow_id)
         
         logger.info(f"✅ [API] {deleted_count} blocos deletados do flow {flow_id}")
         
         return {
             "success": True,
-            "message": f"{deleted_count} blocos removidos. Ao recarregar, a IA gerará novos blocos automaticamente.",
+            "message": f"{deleted_count} blocos removidos. Ao recarregar, a IA gerará novos blocos em background.",
             "deleted_count": deleted_count
         }
     except Exception as e:
@@ -641,13 +722,16 @@ def parse_prompt(payload: dict) -> dict:
     """
     Parse prompt_base e gera blocos e rotas automaticamente.
     Retorna blocos prontos para inserir no banco.
+
+    Incremental: a resposta traz session_id; mandando ele de volta na próxima
+    chamada, só as seções ### alteradas são reparseadas e "diff" lista os blocos
+    added/removed/changed/reordered em relação à chamada anterior.
     """
-    from saas_tools.services.prompt_parser import parse_prompt_base_to_blocks
-    
     prompt_base = payload.get("prompt_base", "")
     flow_id = payload.get("flow_id", "")
     assistente_id = payload.get("assistente_id")
     tenant_id = payload.get("tenant_id")
+    session_id = payload.get("session_id")
     
     if not prompt_base or not prompt_base.strip():
         raise HTTPException(status_code=400, detail="prompt_base não pode estar vazio")
@@ -657,11 +741,12 @@ def parse_prompt(payload: dict) -> dict:
     
     try:
         logger.info("🔵 [API] parse-prompt: Parseando prompt de %d caracteres", len(prompt_base))
-        parsed_blocks, parsed_routes = parse_prompt_base_to_blocks(
-            prompt_base, flow_id, assistente_id, tenant_id
-        )
+        parsed = parse_session_store.parse(prompt_base, flow_id, assistente_id, tenant_id, session_id=session_id)
+        parsed_blocks, parsed_routes = parsed["blocks"], parsed["routes"]
         
-        logger.info("✅ [API] parse-prompt: Gerados %d blocos e %d rotas", len(parsed_blocks), len(parsed_routes))
+        logger.info("✅ [API] parse-prompt: Gerados %d blocos e %d rotas (%d/%d seções reparseadas)",
+                    len(parsed_blocks), len(parsed_routes),
+                    parsed["stats"]["reparsed_sections"], parsed["stats"]["sections"])
         
         # Converter routes para routes_data nos blocos
         # Agrupar routes por block_key
@@ -696,9 +781,18 @@ def parse_prompt(payload: dict) -> dict:
             "success": True,
             "blocks": parsed_blocks,
             "routes": parsed_routes,  # Manter para compatibilidade
+            "session_id": parsed["session_id"],
+            "diff": parsed["diff"],
+            "stats": parsed["stats"],
         }
     except Exception as e:
         logger.error("❌ [API] parse-prompt: Erro ao parsear prompt: %s", str(e))
         import traceback
         logger.error("Traceback: %s", traceback.format_exc())
         raise HTTPException(status_code=500, detail=f"Erro ao parsear prompt: {str(e)}")
+
+
+@router.delete("/flows/parse-prompt/sessions/{session_id}")
+def discard_parse_session(session_id: str) -> dict:
+    """Descarta a sessão de parse incremental (ex: ao fechar a tela de importação)."""
+    return {"success": True, "discarded": parse_session_store.discard(session_id)}
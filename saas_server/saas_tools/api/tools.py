@@ -3,8 +3,8 @@ from typing import Any, Dict
 import logging
 
 from saas_tools.models.schemas import ToolCreate, ToolUpdate
-from saas_tools.services.supabase_service import supabase_service
-from saas_tools.services.file_service import file_service
+from saas_tools.services.async_supabase_service import async_supabase_service
+from saas_tools.services.file_service import async_file_service
 
 logger = logging.getLogger(__name__)
 
@@ -15,7 +15,7 @@ router = APIRouter(tags=["tools"])
 async def get_tools(tenant_id: str):
     """Busca todas as tools de um tenant (igual vapi-tools-manager)."""
     try:
-        tools = supabase_service.get_tools_by_tenant(tenant_id)
+        tools = await async_supabase_service.get_tools_by_tenant(tenant_id)
         return {"success": True, "total": len(tools), "tools": tools}
     except Exception as e:
         logger.error(f"Erro ao buscar tools: {e}")
@@ -30,7 +30,7 @@ async def create_tool(tool: ToolCreate):
             raise HTTPException(status_code=400, detail="Instância é obrigatória para tools de mensagem")
 
         tool_data = tool.model_dump()
-        created_tool = supabase_service.create_tool(tool_data)
+        created_tool = await async_supabase_service.create_tool(tool_data)
         if not created_tool:
             raise HTTPException(status_code=500, detail="Erro ao criar tool")
 
@@ -54,12 +54,12 @@ async def update_tool(tool_id: str, tool: ToolUpdate):
 
         update_data["updated_at"] = datetime.now().isoformat()
 
-        existing_tool = supabase_service.get_tool_by_id(tool_id, "")
+        existing_tool = await async_supabase_service.get_tool_by_id(tool_id, "")
         if not existing_tool:
             raise HTTPException(status_code=404, detail="Tool não encontrada")
 
         tenant_id = existing_tool.get("tenant_id")
-        updated_tool = supabase_service.update_tool(tool_id, tenant_id, update_data)
+        updated_tool = await async_supabase_service.update_tool(tool_id, tenant_id, update_data)
         if not updated_tool:
             raise HTTPException(status_code=500, detail="Erro ao atualizar tool")
 
@@ -75,7 +75,7 @@ async def update_tool(tool_id: str, tool: ToolUpdate):
 async def delete_tool(tool_id: str, tenant_id: str):
     """Desativa uma tool (soft delete) (igual vapi-tools-manager)."""
     try:
-        success = supabase_service.delete_tool(tool_id, tenant_id)
+        success = await async_supabase_service.delete_tool(tool_id, tenant_id)
         if not success:
             raise HTTPException(status_code=404, detail="Tool não encontrada")
         return {"success": True, "message": "Tool desativada com sucesso"}
@@ -91,11 +91,11 @@ async def upload_file(file: UploadFile = File(...), tenant_id: str = Form(...)):
     """Upload de arquivo para Supabase Storage (igual vapi-tools-manager)."""
     try:
         file_content = await file.read()
-        is_valid, error_msg = file_service.validate_file(file.filename, len(file_content))
+        is_valid, error_msg = async_file_service.validate_file(file.filename, len(file_content))
         if not is_valid:
             raise HTTPException(status_code=400, detail=error_msg)
 
-        result = await file_service.upload_file(
+        result = await async_file_service.upload_file(
             file_content=file_content,
             filename=file.filename,
             tenant_id=tenant_id,
@@ -113,7 +113,7 @@ async def upload_file(file: UploadFile = File(...), tenant_id: str = Form(...)):
 async def get_instances(tenant_id: str):
     """Busca instâncias WhatsApp conectadas de um tenant (igual vapi-tools-manager)."""
     try:
-        instances = supabase_service.get_instances_by_tenant(tenant_id)
+        instances = await async_supabase_service.get_instances_by_tenant(tenant_id)
         return {"success": True, "total": len(instances), "instances": instances}
     except Exception as e:
         logger.error(f"Erro ao buscar instâncias: {e}")
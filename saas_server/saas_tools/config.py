@@ -1,4 +1,5 @@
 import os
+from pathlib import Path
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,6 +10,67 @@ class Settings:
     SUPABASE_URL: str = os.getenv("SUPABASE_URL", "https://gwjcgzeybqiyqezuswpt.supabase.co")
     SUPABASE_KEY: str = os.getenv("SUPABASE_KEY", "")
 
+    # Pool HTTP (keep-alive) compartilhado pelo cliente async do Supabase
+    SUPABASE_POOL_MAX_CONNECTIONS: int = int(os.getenv("SUPABASE_POOL_MAX_CONNECTIONS", "100"))
+    SUPABASE_POOL_MAX_KEEPALIVE: int = int(os.getenv("SUPABASE_POOL_MAX_KEEPALIVE", "20"))
+    SUPABASE_POOL_KEEPALIVE_EXPIRY: float = float(os.getenv("SUPABASE_POOL_KEEPALIVE_EXPIRY", "30"))
+    SUPABASE_HTTP_TIMEOUT: float = float(os.getenv("SUPABASE_HTTP_TIMEOUT", "30"))
+
+    # Cache em memória de snapshots de flow (LRU por flow_id + version)
+    FLOW_CACHE_MAX_ENTRIES: int = int(os.getenv("FLOW_CACHE_MAX_ENTRIES", "256"))
+    # Rede de segurança para escritas feitas fora deste processo (0 = sem expiração)
+    FLOW_CACHE_TTL_SECONDS: float = float(os.getenv("FLOW_CACHE_TTL_SECONDS", "300"))
+    # Confere flows.version/updated_at (SELECT leve) a cada hit do cache; desligado, o cache
+    # confia nas invalidações deste processo + TTL (leituras repetidas não vão ao banco)
+    FLOW_CACHE_VALIDATE: bool = os.getenv("FLOW_CACHE_VALIDATE", "false").lower() in ("1", "true", "yes")
+    # Blocos por lote no upsert do save_flow (lotes que dão timeout são divididos ao meio)
+    FLOW_SAVE_BATCH_SIZE: int = max(1, int(os.getenv("FLOW_SAVE_BATCH_SIZE", "25")))
+
+    # Sessões de parse incremental (POST /flows/parse-prompt com session_id): LRU + TTL por inatividade
+    PARSE_SESSION_MAX_ENTRIES: int = int(os.getenv("PARSE_SESSION_MAX_ENTRIES", "200"))
+    PARSE_SESSION_TTL_SECONDS: float = float(os.getenv("PARSE_SESSION_TTL_SECONDS", "1800"))
+
+    # Jobs de geração de blocos pela IA (fila em background)
+    AI_JOB_MAX_WORKERS: int = int(os.getenv("AI_JOB_MAX_WORKERS", "2"))
+    AI_JOB_MAX_PENDING: int = int(os.getenv("AI_JOB_MAX_PENDING", "50"))
+    AI_JOB_HISTORY: int = int(os.getenv("AI_JOB_HISTORY", "200"))
+
+    # Cache persistente de respostas dos LLMs (análise de prompt / patch com IA)
+    LLM_CACHE_ENABLED: bool = os.getenv("LLM_CACHE_ENABLED", "true").lower() in ("1", "true", "yes")
+    LLM_CACHE_DIR: str = os.getenv("LLM_CACHE_DIR", str(Path(__file__).resolve().parent.parent / ".llm_cache"))
+    LLM_CACHE_MAX_MB: int = int(os.getenv("LLM_CACHE_MAX_MB", "200"))
+    # Máximo de requisições simultâneas aos LLMs por processo (o resto espera na fila)
+    LLM_MAX_CONCURRENCY: int = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+    # Hedging: sem primeiro token do provedor principal nesse prazo, dispara no outro provedor
+    LLM_HEDGE_ENABLED: bool = os.getenv("LLM_HEDGE_ENABLED", "true").lower() in ("1", "true", "yes")
+    LLM_HEDGE_DEADLINE_SECONDS: float = float(os.getenv("LLM_HEDGE_DEADLINE_SECONDS", "5"))
+    LLM_LATENCY_WINDOW: int = int(os.getenv("LLM_LATENCY_WINDOW", "500"))
+    # Contabilidade das chamadas aos LLMs (ring buffer em memória + acumulados)
+    LLM_ACCOUNTING_CAPACITY: int = int(os.getenv("LLM_ACCOUNTING_CAPACITY", "2000"))
+    LLM_ACCOUNTING_AGGREGATE_SECONDS: float = float(os.getenv("LLM_ACCOUNTING_AGGREGATE_SECONDS", "30"))
+    # Base URL dos provedores (vazio = API oficial). Benchmarks offline: fake_llm_server.py
+    OPENAI_BASE_URL: str = os.getenv("OPENAI_BASE_URL", "")
+    ANTHROPIC_BASE_URL: str = os.getenv("ANTHROPIC_BASE_URL", "")
+    # Resiliência: prazo por chamada, retries com backoff (erros transitórios) e circuit breaker por provedor
+    LLM_TIMEOUT_SECONDS: float = float(os.getenv("LLM_TIMEOUT_SECONDS", "60"))
+    LLM_MAX_RETRIES: int = int(os.getenv("LLM_MAX_RETRIES", "2"))
+    LLM_BACKOFF_BASE_SECONDS: float = float(os.getenv("LLM_BACKOFF_BASE_SECONDS", "0.5"))
+    LLM_BACKOFF_MAX_SECONDS: float = float(os.getenv("LLM_BACKOFF_MAX_SECONDS", "8"))
+    LLM_BREAKER_FAILURES: int = int(os.getenv("LLM_BREAKER_FAILURES", "5"))
+    LLM_BREAKER_RESET_SECONDS: float = float(os.getenv("LLM_BREAKER_RESET_SECONDS", "30"))
+    # Roteamento por tamanho: pedidos pequenos/simples vão para o model "small" (OPENAI_SMALL_MODEL/ANTHROPIC_SMALL_MODEL)
+    LLM_ROUTING_ENABLED: bool = os.getenv("LLM_ROUTING_ENABLED", "true").lower() in ("1", "true", "yes")
+    LLM_ROUTING_SMALL_MAX_CHARS: int = int(os.getenv("LLM_ROUTING_SMALL_MAX_CHARS", "6000"))
+    LLM_ROUTING_SMALL_MAX_BLOCKS: int = int(os.getenv("LLM_ROUTING_SMALL_MAX_BLOCKS", "6"))
+    # Os endpoints /api/admin/* exigem o header X-Admin-Token; vazio = endpoints desabilitados (503)
+    ADMIN_API_TOKEN: str = os.getenv("ADMIN_API_TOKEN", "")
+    # Análise pela IA: prompt compactado acima do orçamento (tokens) é dividido nos cabeçalhos ###
+    AI_ANALYSIS_TOKEN_BUDGET: int = int(os.getenv("AI_ANALYSIS_TOKEN_BUDGET", "3000"))
+    AI_ANALYSIS_CHUNK_TOKENS: int = int(os.getenv("AI_ANALYSIS_CHUNK_TOKENS", "1500"))
+    AI_ANALYSIS_MAX_PARALLEL: int = int(os.getenv("AI_ANALYSIS_MAX_PARALLEL", "4"))
+    # Análise híbrida: seções com confiança do parser abaixo disso vão para a IA (0-1)
+    HYBRID_MIN_CONFIDENCE: float = float(os.getenv("HYBRID_MIN_CONFIDENCE", "0.7"))
+
     # Storage
     BUCKET_NAME: str = os.getenv("BUCKET_NAME", "arquivos_tools")
 
@@ -131,6 +131,36 @@ class SaveFlowResult(BaseModel):
     success: bool
     version: int = 0
     error: Optional[str] = None
+    written: int = 0  # blocos gravados (content_hash mudou)
+    skipped: int = 0  # blocos sem mudança, não reescritos
+    deleted: int = 0  # blocos removidos (block_keys que não vieram no payload)
+    batches: List[Dict[str, Any]] = []  # um item por lote do upsert: size, ms, ok
+
+
+class FlowSnapshot(BaseModel):
+    """Foto do flow lida em uma única ida ao banco: flow + blocos (com routes_data) + prompt_voz."""
+    flow: Dict[str, Any]
+    blocks: List[Dict[str, Any]] = []
+    prompt_voz: Optional[str] = None
+
+    @property
+    def flow_id(self) -> str:
+        return str(self.flow.get("id") or "")
+
+    @property
+    def version(self) -> int:
+        return int(self.flow.get("version") or 0)
+
+    @property
+    def updated_at(self) -> str:
+        return str(self.flow.get("updated_at") or "")
+
+    @property
+    def prompt_to_parse(self) -> str:
+        """prompt_voz do assistente; se vazio, prompt_base do flow."""
+        if self.prompt_voz and self.prompt_voz.strip():
+            return self.prompt_voz
+        return self.flow.get("prompt_base") or ""
 
 
 class FlowCreate(BaseModel):
@@ -1,10 +1,14 @@
 # Services module
+from saas_tools.services import async_flow_service
+from saas_tools.services import async_supabase_service
 from saas_tools.services import flow_service
 from saas_tools.services import prompt_builder
 from saas_tools.services import prompt_parser
 from saas_tools.services import supabase_service
 
 __all__ = [
+    "async_flow_service",
+    "async_supabase_service",
     "flow_service",
     "prompt_builder",
     "prompt_parser",
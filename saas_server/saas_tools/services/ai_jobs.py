@@ -0,0 +1,187 @@
+"""
+Fila de jobs em background para a geração de blocos pela IA.
+
+A análise do prompt pela IA (até 4096 tokens de saída + gravação dos blocos)
+levava dezenas de segundos dentro do GET /flows/{flow_id}. Agora o GET só
+enfileira um job aqui e responde na hora com os blocos atuais; o editor
+acompanha o job pelos endpoints /flows/jobs/{job_id}.
+
+Os jobs rodam num pool de threads limitado (AI_JOB_MAX_WORKERS) e o estado fica
+em memória (últimos AI_JOB_HISTORY jobs).
+"""
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Hashable, Optional
+
+from saas_tools.config import settings
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+ACTIVE_STATUSES = (JOB_QUEUED, JOB_RUNNING)
+
+
+class AIJob:
+    """Estado de um job (lido pelos endpoints de status/progresso)."""
+
+    def __init__(self, flow_id: str, kind: str, dedup_key: Hashable):
+        self.id = uuid.uuid4().hex
+        self.flow_id = flow_id
+        self.kind = kind
+        self.dedup_key = dedup_key
+        self.status = JOB_QUEUED
+        self.progress = 0
+        self.stage = "na fila"
+        self.result: Optional[Dict[str, Any]] = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+
+    def report(self, progress: int, stage: str) -> None:
+        """Callback de progresso passado para a função do job (0-100)."""
+        self.progress = max(self.progress, min(100, int(progress)))
+        self.stage = stage
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "job_id": self.id,
+            "flow_id": self.flow_id,
+            "kind": self.kind,
+            "status": self.status,
+            "progress": self.progress,
+            "stage": self.stage,
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class AIJobQueue:
+    """Pool limitado de workers + registro dos jobs por id e por flow."""
+
+    def __init__(self, max_workers: int = 2, max_pending: int = 50, history: int = 200):
+        self.max_workers = max(1, max_workers)
+        self.max_pending = max_pending
+        self.history = history
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._jobs: "OrderedDict[str, AIJob]" = OrderedDict()
+        self._active_by_key: Dict[Hashable, str] = {}
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.duplicates_avoided = 0
+
+    def _require_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="ai-job")
+        return self._executor
+
+    def submit(
+        self,
+        flow_id: str,
+        kind: str,
+        fn: Callable[..., Optional[Dict[str, Any]]],
+        *args,
+        dedup_key: Optional[Hashable] = None,
+    ) -> AIJob:
+        """
+        Enfileira fn(*args, report=job.report). Se já existe um job ativo com a mesma
+        dedup_key (padrão: flow_id), devolve esse job em vez de criar outro (o editor
+        fica recarregando) e conta em duplicates_avoided.
+        Levanta RuntimeError se a fila estiver cheia.
+        """
+        dedup_key = dedup_key if dedup_key is not None else flow_id
+        with self._lock:
+            active_id = self._active_by_key.get(dedup_key)
+            if active_id and self._jobs[active_id].is_active:
+                self.duplicates_avoided += 1
+                return self._jobs[active_id]
+            pending = sum(1 for job in self._jobs.values() if job.is_active)
+            if pending >= self.max_pending:
+                raise RuntimeError(f"Fila de jobs de IA cheia ({pending} jobs pendentes)")
+            job = AIJob(flow_id, kind, dedup_key)
+            self._jobs[job.id] = job
+            self._active_by_key[dedup_key] = job.id
+            self.submitted += 1
+            self._trim_history()
+            executor = self._require_executor()
+        executor.submit(self._run, job, fn, args)
+        logger.info("AIJobQueue: 📥 job %s (%s) enfileirado para flow %s", job.id, kind, flow_id)
+        return job
+
+    def _run(self, job: AIJob, fn: Callable[..., Optional[Dict[str, Any]]], args: tuple) -> None:
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job.report(1, "iniciado")
+        try:
+            job.result = fn(*args, report=job.report) or {}
+            job.status = JOB_DONE
+            job.report(100, "concluído")
+            logger.info("AIJobQueue: ✅ job %s concluído em %.1fs", job.id, time.time() - job.started_at)
+        except Exception as e:
+            job.status = JOB_FAILED
+            job.error = str(e)[:500]
+            job.stage = "falhou"
+            logger.error("AIJobQueue: ❌ job %s falhou: %s", job.id, e, exc_info=True)
+        finally:
+            job.finished_at = time.time()
+            with self._lock:
+                if self._active_by_key.get(job.dedup_key) == job.id:
+                    del self._active_by_key[job.dedup_key]
+
+    def get(self, job_id: str) -> Optional[AIJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def active_job_for(self, flow_id: str) -> Optional[AIJob]:
+        with self._lock:
+            for job_id in self._active_by_key.values():
+                job = self._jobs[job_id]
+                if job.flow_id == flow_id:
+                    return job
+            return None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            active = [job for job in self._jobs.values() if job.is_active]
+            return {
+                "max_workers": self.max_workers,
+                "queued": sum(1 for job in active if job.status == JOB_QUEUED),
+                "running": sum(1 for job in active if job.status == JOB_RUNNING),
+                "submitted": self.submitted,
+                "duplicates_avoided": self.duplicates_avoided,
+            }
+
+    def shutdown(self) -> None:
+        """Chamado no shutdown do app: não espera os jobs em andamento."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def _trim_history(self) -> None:
+        """Descarta os jobs finalizados mais antigos (chamar com o lock)."""
+        excess = len(self._jobs) - self.history
+        if excess <= 0:
+            return
+        for job_id in [jid for jid, job in self._jobs.items() if not job.is_active][:excess]:
+            del self._jobs[job_id]
+
+
+ai_job_queue = AIJobQueue(
+    max_workers=settings.AI_JOB_MAX_WORKERS,
+    max_pending=settings.AI_JOB_MAX_PENDING,
+    history=settings.AI_JOB_HISTORY,
+)
@@ -3,79 +3,26 @@ Serviço de Patch Inteligente de Prompts usando IA Generativa
 Usa Claude/GPT para fazer atualizações cirúrgicas em prompts grandes
 """
 
-import os
 import logging
-from typing import Dict, Any, Optional
+import re
+from typing import Callable, Dict, Any, Optional
 import json
 
+from saas_tools.services.llm_accounting import llm_accounting
+from saas_tools.services.llm_cache import llm_cache
+from saas_tools.services.llm_hedging import llm_hedger
+from saas_tools.services.llm_providers import llm_providers
+from saas_tools.services.llm_resilience import LLMCallError, as_call_error
+from saas_tools.services.llm_routing import RouteDecision, model_router
+from saas_tools.services.prompt_patcher import block_header_pattern
+from saas_tools.services.prompt_section_index import PromptSectionIndex
+from saas_tools.services.prompt_tokenizer import SectionToken
+
 # Configurar logger
 logger = logging.getLogger(__name__)
 
-# Importar cliente da IA (Anthropic Claude ou OpenAI)
-try:
-    from anthropic import Anthropic
-    ANTHROPIC_AVAILABLE = True
-except ImportError:
-    ANTHROPIC_AVAILABLE = False
-    logger.warning("Anthropic SDK não disponível. Instale com: pip install anthropic")
-
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    logger.warning("OpenAI SDK não disponível. Instale com: pip install openai")
-
-
-class AIPromptPatcher:
-    """Classe para fazer patch cirúrgico de prompts usando IA"""
-    
-    def __init__(self, provider: str = "anthropic"):
-        """
-        Inicializa o patcher com o provedor de IA
-        
-        Args:
-            provider: "anthropic" (Claude) ou "openai" (GPT)
-        """
-        self.provider = provider
-        
-        if provider == "anthropic" and ANTHROPIC_AVAILABLE:
-            api_key = os.getenv("ANTHROPIC_API_KEY")
-            if not api_key:
-                raise ValueError("ANTHROPIC_API_KEY não configurada")
-            self.client = Anthropic(api_key=api_key)
-            self.model = os.getenv("ANTHROPIC_MODEL", "claude-3-haiku-20240307")
-        elif provider == "openai" and OPENAI_AVAILABLE:
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY não configurada")
-            self.client = openai.OpenAI(api_key=api_key)
-            self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        else:
-            raise ValueError(f"Provedor {provider} não disponível ou não configurado")
-    
-    def _build_system_prompt(self) -> str:
-        """Constrói o prompt do sistema com as instruções para a IA"""
-        return """Você é um especialista em processamento de texto e edição cirúrgica de documentos.
-
-## TAREFA
-Você receberá:
-1. Um prompt completo de uma IA de voz (formato Markdown)
-2. Um bloco específico que precisa ser atualizado (com seu ID único)
-3. O novo conteúdo desse bloco
-
-Sua tarefa é fazer um "patch cirúrgico": substituir APENAS a seção correspondente ao bloco no prompt original, mantendo TODO o resto do prompt exatamente igual.
-
-## REGRAS ABSOLUTAS
-- ✅ MANTER: Todo o texto antes da seção alvo
-- ✅ MANTER: Todo o texto depois da seção alvo  
-- ✅ MANTER: Formatação, espaçamentos, quebras de linha
-- ✅ SUBSTITUIR: Apenas a seção específica do bloco
-- ❌ NÃO ADICIONAR: Texto novo que não estava no original
-- ❌ NÃO REMOVER: Nada além da seção alvo
-- ❌ NÃO REFORMATAR: Manter o estilo de formatação original
-
-## FORMATO DOS BLOCOS
+# Formato das seções de cada tipo de bloco (usado nos dois modos de patch)
+BLOCK_FORMATS = """## FORMATO DOS BLOCOS
 
 Os blocos seguem este padrão:
 
@@ -126,7 +73,51 @@ Salvar resposta do lead em: `{{nome_da_variavel}}`
 
 "[conteúdo da mensagem]"
 ```
+"""
+
+# Tokens de saída no modo seção: ~4 caracteres por token, com folga
+SECTION_MIN_TOKENS = 1024
+FULL_PROMPT_MAX_TOKENS = 8000
+
+
+class AIPromptPatcher:
+    """Classe para fazer patch cirúrgico de prompts usando IA"""
+    
+    def __init__(self, provider: str = "anthropic", tenant_id: Optional[str] = None, flow_id: Optional[str] = None):
+        """
+        Inicializa o patcher com o provedor de IA
+        
+        Args:
+            provider: "anthropic" (Claude) ou "openai" (GPT)
+            tenant_id / flow_id: para quem as chamadas são feitas (llm_accounting)
+        """
+        self.provider = provider
+        self.tags = {"endpoint": "ai_prompt_patcher", "tenant_id": tenant_id, "flow_id": flow_id}
+        # Cliente compartilhado pelo processo (um por provider/model, conexões reaproveitadas)
+        self.client, self.model = llm_providers.get(provider)
+    
+    def _build_system_prompt(self) -> str:
+        """Constrói o prompt do sistema com as instruções para a IA"""
+        return """Você é um especialista em processamento de texto e edição cirúrgica de documentos.
 
+## TAREFA
+Você receberá:
+1. Um prompt completo de uma IA de voz (formato Markdown)
+2. Um bloco específico que precisa ser atualizado (com seu ID único)
+3. O novo conteúdo desse bloco
+
+Sua tarefa é fazer um "patch cirúrgico": substituir APENAS a seção correspondente ao bloco no prompt original, mantendo TODO o resto do prompt exatamente igual.
+
+## REGRAS ABSOLUTAS
+- ✅ MANTER: Todo o texto antes da seção alvo
+- ✅ MANTER: Todo o texto depois da seção alvo  
+- ✅ MANTER: Formatação, espaçamentos, quebras de linha
+- ✅ SUBSTITUIR: Apenas a seção específica do bloco
+- ❌ NÃO ADICIONAR: Texto novo que não estava no original
+- ❌ NÃO REMOVER: Nada além da seção alvo
+- ❌ NÃO REFORMATAR: Manter o estilo de formatação original
+
+""" + BLOCK_FORMATS + """
 ## INSTRUÇÕES DE PROCESSAMENTO
 
 1. **IDENTIFICAR** a seção no prompt original usando o block_key (ex: ENC001, MSG001)
@@ -218,9 +209,111 @@ Retorne o prompt completo atualizado."""
         
         return section
     
+    def _build_section_system_prompt(self) -> str:
+        """Prompt do sistema do modo seção: a IA só vê e só devolve a seção do bloco"""
+        return """Você é um especialista em processamento de texto e edição cirúrgica de documentos.
+
+## TAREFA
+Você receberá UM TRECHO de um prompt de uma IA de voz (formato Markdown):
+1. A seção anterior (apenas contexto, NÃO faz parte da resposta)
+2. A SEÇÃO ALVO de um bloco específico (com seu ID único)
+3. A seção seguinte (apenas contexto, NÃO faz parte da resposta)
+E a nova seção formatada do bloco.
+
+Reescreva a SEÇÃO ALVO com o conteúdo da nova seção, mantendo o estilo do original
+(formatação, espaçamentos, quebras de linha) e qualquer texto da seção alvo que a nova
+seção não substitui.
+
+## REGRAS ABSOLUTAS
+- ✅ RETORNAR: Apenas a seção alvo atualizada, começando pelo título ###
+- ❌ NÃO INCLUIR: As seções de contexto (anterior/seguinte)
+- ❌ NÃO ADICIONAR: Outras seções ### ou separadores ---
+- ❌ NÃO REFORMATAR: Manter o estilo de formatação original
+
+""" + BLOCK_FORMATS + """
+## FORMATO DE RESPOSTA
+
+Retorne APENAS a seção alvo atualizada, sem explicações adicionais."""
+    
+    def _build_section_user_prompt(self, context_before: str, target_section: str, context_after: str,
+                                   block_key: str, block_type: str, new_section: str) -> str:
+        """Constrói o prompt do usuário do modo seção"""
+        return f"""## SEÇÃO ANTERIOR (apenas contexto)
+
+{context_before.strip() or "(nenhuma)"}
+
+---
+
+## SEÇÃO ALVO (bloco {block_key}, tipo {block_type})
+
+{target_section.strip()}
+
+---
+
+## SEÇÃO SEGUINTE (apenas contexto)
+
+{context_after.strip() or "(nenhuma)"}
+
+---
+
+## NOVA SEÇÃO FORMATADA
+
+{new_section}
+
+---
+
+## TAREFA
+
+Reescreva APENAS a seção alvo do bloco `{block_key}` e retorne somente ela."""
+    
+    def _complete(self, system_prompt: str, user_prompt: str, max_tokens: int,
+                  model: Optional[str] = None, tier: str = "large",
+                  validate: Optional[Callable[[str], bool]] = None) -> str:
+        """
+        Uma chamada ao provedor (com cache em disco). Levanta LLMCallError em caso de erro.
+        model/tier vêm do llm_routing (padrão: model large); com validate, só respostas
+        válidas vão para o cache.
+        """
+        try:
+            client, model = llm_providers.get(self.provider, model or self.model)
+        except ValueError as e:
+            raise as_call_error(self.provider, e) from e
+        # ⚡ Cache em disco: mesma entrada = mesma resposta, sem chamar o provedor
+        cache_key = llm_cache.make_key(self.provider, model, system_prompt, user_prompt, max_tokens=max_tokens)
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info("⚡ Patch encontrado no cache de LLM")
+            llm_accounting.record(provider=self.provider, model=model, cache_hit=True, **self.tags)
+            return cached
+        
+        # Hedging: sem primeiro token no prazo, a mesma requisição vai para o outro provedor
+        result = llm_hedger.complete(self.provider, client, model, system_prompt, user_prompt,
+                                     max_tokens=max_tokens, tags=self.tags, tier=tier)
+        text = result.text.strip()
+        if result.provider != self.provider:
+            logger.info(f"🔀 Patch respondido por {result.provider} ({result.model})")
+        
+        if validate is None or validate(text):
+            llm_cache.set(cache_key, text, provider=self.provider, model=model)
+        return text
+    
+    def _complete_routed(self, decision: RouteDecision, system_prompt: str, user_prompt: str,
+                         max_tokens: int, validate: Callable[[str], bool]) -> str:
+        """
+        Chamada no tier escolhido pelo model_router; se a resposta do model small não
+        passar em validate, repete no model large (escalada registrada no router).
+        """
+        model = model_router.model_for(self.provider, decision)
+        text = self._complete(system_prompt, user_prompt, max_tokens, model, decision.tier, validate)
+        if validate(text) or not model_router.can_escalate(self.provider, decision):
+            return text
+        model_router.record_escalation(decision, f"resposta de {model} não passou na validação do patch")
+        return self._complete(system_prompt, user_prompt, max_tokens, validate=validate)
+    
     def patch_prompt(self, original_prompt: str, block_key: str, block_type: str,
                     new_content: str, next_block_key: Optional[str] = None,
-                    variable_name: Optional[str] = None) -> str:
+                    variable_name: Optional[str] = None, mode: str = "section",
+                    index: Optional[PromptSectionIndex] = None) -> str:
         """
         Faz patch cirúrgico no prompt usando IA
         
@@ -231,10 +324,27 @@ Retorne o prompt completo atualizado."""
             new_content: Novo conteúdo do bloco
             next_block_key: Próximo bloco (opcional)
             variable_name: Nome da variável (opcional, para aguardar)
+            mode: "section" (só a seção do bloco e as vizinhas vão para a IA; a troca é
+                  feita localmente) ou "full" (prompt completo ida e volta)
+            index: PromptSectionIndex de original_prompt (opcional); sai atualizado
+                   com o prompt devolvido
         
         Returns:
             Prompt atualizado com apenas a seção específica modificada
+        
+        Raises:
+            LLMCallError: provedor indisponível/timeout depois dos retries (o prompt
+            original não é devolvido como se o patch tivesse sido feito)
         """
+        if mode == "section":
+            if index is None or index.text != original_prompt:
+                index = PromptSectionIndex(original_prompt)
+            token = index.get(block_key, block_type)
+            if token is not None:
+                return self._patch_section(index, token, block_key, block_type,
+                                           new_content, next_block_key, variable_name)
+            logger.info(f"Seção do bloco {block_key} não encontrada, usando patch do prompt completo")
+        
         try:
             system_prompt = self._build_system_prompt()
             user_prompt = self._build_user_prompt(
@@ -243,46 +353,98 @@ Retorne o prompt completo atualizado."""
             )
             
             logger.info(f"Fazendo patch do bloco {block_key} (tipo: {block_type}) usando {self.provider}")
-            
-            if self.provider == "anthropic":
-                response = self.client.messages.create(
-                    model=self.model,
-                    max_tokens=8000,
-                    system=system_prompt,
-                    messages=[
-                        {"role": "user", "content": user_prompt}
-                    ]
-                )
-                updated_prompt = response.content[0].text.strip()
-            
-            elif self.provider == "openai":
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {"role": "user", "content": user_prompt}
-                    ],
-                    temperature=0.1,  # Baixa temperatura para mais consistência
-                    max_tokens=8000
-                )
-                updated_prompt = response.choices[0].message.content.strip()
-            
-            else:
-                raise ValueError(f"Provedor {self.provider} não suportado")
-            
+            decision = model_router.choose("patch", original_prompt, block_type, provider=self.provider)
+            updated_prompt = self._complete_routed(
+                decision, system_prompt, user_prompt, FULL_PROMPT_MAX_TOKENS,
+                lambda text: _is_full_patch(text, original_prompt, block_key),
+            )
             logger.info(f"✅ Patch concluído para bloco {block_key}")
+            if index is not None:
+                index.rebuild(updated_prompt)
             return updated_prompt
         
-        except Exception as e:
+        except LLMCallError as e:
             logger.error(f"❌ Erro ao fazer patch do bloco {block_key}: {str(e)}")
-            # Em caso de erro, retornar o prompt original
-            return original_prompt
+            raise
+    
+    def _patch_section(self, index: PromptSectionIndex, token: SectionToken, block_key: str, block_type: str,
+                       new_content: str, next_block_key: Optional[str], variable_name: Optional[str]) -> str:
+        """
+        Manda para a IA só a seção do bloco (e as vizinhas como contexto) e troca a
+        seção localmente. Se a resposta não for uma seção válida, usa a nova seção
+        formatada sem IA; falha do provedor sobe como LLMCallError.
+        """
+        original_prompt = index.text
+        section_start, section_end = index.section_span(token)
+        context_start, context_end = index.neighbours(token)
+        target_section = original_prompt[section_start:section_end]
+        new_section = self._format_block_section(block_key, block_type, new_content,
+                                                 next_block_key, variable_name)
+        
+        try:
+            user_prompt = self._build_section_user_prompt(
+                original_prompt[context_start:section_start], target_section,
+                original_prompt[section_end:context_end], block_key, block_type, new_section
+            )
+            max_tokens = min(FULL_PROMPT_MAX_TOKENS, max(SECTION_MIN_TOKENS, (len(target_section) + len(new_section)) // 2))
+            logger.info(f"Fazendo patch da seção do bloco {block_key} ({len(user_prompt)} de {len(original_prompt)} caracteres) usando {self.provider}")
+            # Tamanho/complexidade medidos só na seção alvo e na nova seção (o contexto é fixo)
+            decision = model_router.choose("patch", target_section + "\n" + new_section, block_type, provider=self.provider)
+            rewritten = _strip_code_fence(self._complete_routed(
+                decision, self._build_section_system_prompt(), user_prompt, max_tokens,
+                lambda text: _is_single_section(_strip_code_fence(text), block_key, block_type),
+            ))
+        except LLMCallError as e:
+            logger.error(f"❌ Erro ao fazer patch da seção do bloco {block_key}: {str(e)}")
+            raise
+        
+        if not rewritten or not _is_single_section(rewritten, block_key, block_type):
+            logger.warning(f"⚠️ Resposta da IA não é uma seção válida para {block_key}, usando a seção formatada")
+            rewritten = new_section
+        
+        # Mantém o espaçamento que vinha depois da seção original (antes do --- / próximo ###)
+        trailing = target_section[len(target_section.rstrip()):] or "\n"
+        index.splice(section_start, section_end, rewritten.rstrip() + trailing)
+        logger.info(f"✅ Patch da seção concluído para bloco {block_key}")
+        return index.text
+
+
+def _strip_code_fence(text: str) -> str:
+    text = text.strip()
+    if text.startswith("```"):
+        text = text.split("\n", 1)[1] if "\n" in text else ""
+    if text.endswith("```"):
+        text = text[:-3]
+    return text.strip()
+
+
+def _is_single_section(text: str, block_key: str, block_type: str) -> bool:
+    """A resposta do modo seção tem que ser exatamente uma seção ### do bloco pedido."""
+    if not re.match(block_header_pattern(block_key, block_type), text, re.IGNORECASE):
+        return False
+    headers = re.findall(r'^###(?!#)', text, re.MULTILINE)
+    return len(headers) == 1 and not re.search(r'^---\s*$', text, re.MULTILINE)
+
+
+def _is_full_patch(text: str, original_prompt: str, block_key: str) -> bool:
+    """
+    Validação do modo full: o prompt devolvido não perdeu metade do texto e ainda
+    cita o bloco, se o original citava.
+    """
+    text = _strip_code_fence(text)
+    if len(text) < len(original_prompt) // 2:
+        return False
+    return block_key not in original_prompt or block_key in text
 
 
 def patch_prompt_with_ai(original_prompt: str, block_key: str, block_type: str,
                          new_content: str, provider: str = "anthropic",
                          next_block_key: Optional[str] = None,
-                         variable_name: Optional[str] = None) -> str:
+                         variable_name: Optional[str] = None,
+                         mode: str = "section",
+                         tenant_id: Optional[str] = None,
+                         flow_id: Optional[str] = None,
+                         index: Optional[PromptSectionIndex] = None) -> str:
     """
     Função helper para fazer patch de prompt usando IA
     
@@ -294,12 +456,18 @@ def patch_prompt_with_ai(original_prompt: str, block_key: str, block_type: str,
         provider: "anthropic" ou "openai"
         next_block_key: Próximo bloco (opcional)
         variable_name: Nome da variável (opcional)
+        mode: "section" (padrão) ou "full" (ver AIPromptPatcher.patch_prompt)
+        tenant_id / flow_id: para quem o patch é feito (llm_accounting)
+        index: PromptSectionIndex de original_prompt (opcional, ver AIPromptPatcher.patch_prompt)
     
     Returns:
         Prompt atualizado
+    
+    Raises:
+        LLMCallError: falha do provedor (ver AIPromptPatcher.patch_prompt)
     """
-    patcher = AIPromptPatcher(provider=provider)
+    patcher = AIPromptPatcher(provider=provider, tenant_id=tenant_id, flow_id=flow_id)
     return patcher.patch_prompt(
         original_prompt, block_key, block_type, new_content,
-        next_block_key, variable_name
+        next_block_key, variable_name, mode=mode, index=index
     )
@@ -0,0 +1,155 @@
+"""
+Descoberta (uma única vez) da tabela de assistentes e suas colunas.
+
+O nome da tabela varia entre ambientes ("assistentes", "assistants", ...). Em vez de
+tentar todos os nomes a cada leitura de prompt_voz, a tabela real é resolvida no
+startup (ou na primeira leitura) e guardada aqui. Use refresh() depois de uma
+migração para forçar nova descoberta.
+
+Só "tabela não existe" ou "coluna prompt_voz não existe" descarta um candidato. Qualquer outro erro (rede, timeout,
+5xx) deixa a descoberta pendente e ela é refeita com backoff, em vez de fixar
+"nenhuma tabela" até o próximo refresh().
+"""
+import asyncio
+import logging
+import threading
+import time
+from typing import FrozenSet, Optional, Tuple
+
+from saas_tools.services.async_supabase_service import async_supabase_service
+from saas_tools.services.supabase_service import supabase_service
+
+logger = logging.getLogger(__name__)
+
+CANDIDATE_TABLES = ["assistentes", "assistents", "assistants", "assistente", "assistant"]
+
+# PostgREST / Postgres: tabela não encontrada
+MISSING_TABLE_CODES: Tuple[str, ...] = ("PGRST205", "42P01")
+# PostgREST / Postgres: coluna não encontrada (tabela existe, mas sem prompt_voz)
+MISSING_COLUMN_CODES: Tuple[str, ...] = ("42703", "PGRST204")
+# A sonda pede só as colunas que a leitura usa: tabela vazia também confirma o schema
+PROBE_COLUMNS = ("id", "prompt_voz")
+# Backoff entre tentativas de descoberta que falharam (dobra a cada falha)
+RETRY_BASE_SECONDS = 5.0
+RETRY_MAX_SECONDS = 300.0
+
+
+def _is_missing_table(error: Exception) -> bool:
+    """Tabela ou coluna sondada não existe: o candidato é descartado (não é erro transitório)."""
+    codes = MISSING_TABLE_CODES + MISSING_COLUMN_CODES
+    code = getattr(error, "code", None)
+    if code:
+        return str(code) in codes
+    message = str(error)
+    return any(candidate in message for candidate in codes) or "does not exist" in message
+
+
+class AssistantSchema:
+    """Tabela de assistentes resolvida + colunas conhecidas (thread-safe)."""
+
+    def __init__(self):
+        self._table: Optional[str] = None
+        self._columns: FrozenSet[str] = frozenset()
+        self._resolved = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self._lock = threading.Lock()
+
+    @property
+    def table(self) -> Optional[str]:
+        self.resolve()
+        return self._table
+
+    @property
+    def columns(self) -> FrozenSet[str]:
+        self.resolve()
+        return self._columns
+
+    def resolve(self, force: bool = False) -> Optional[str]:
+        """Descobre a tabela que tem prompt_voz. Só consulta o banco na primeira vez (ou com force)."""
+        if self._resolved and not force:
+            return self._table
+        with self._lock:
+            if self._resolved and not force:
+                return self._table
+            if not force and time.monotonic() < self._retry_at:
+                return None
+            try:
+                client = supabase_service._require_client()
+            except Exception as e:
+                # Sem cliente não marca como resolvido: tenta de novo na próxima leitura
+                logger.warning("AssistantSchema: Supabase indisponível, descoberta adiada: %s", e)
+                return None
+
+            table: Optional[str] = None
+            columns: FrozenSet[str] = frozenset()
+            for table_name in CANDIDATE_TABLES:
+                try:
+                    client.table(table_name).select(", ".join(PROBE_COLUMNS)).limit(1).execute()
+                except Exception as e:
+                    if _is_missing_table(e):
+                        continue
+                    # Erro transitório: não dá para saber se esta é a tabela certa, então
+                    # nada é fixado e a descoberta é refeita depois do backoff
+                    return self._defer(table_name, e)
+                # A consulta passou: a tabela tem id e prompt_voz, mesmo sem linhas
+                table = table_name
+                columns = frozenset(PROBE_COLUMNS)
+                break
+
+            self._table = table
+            self._columns = columns
+            self._resolved = True
+            self._failures = 0
+            self._retry_at = 0.0
+            if table:
+                logger.info("AssistantSchema: tabela de assistentes = %s (%d colunas)", table, len(columns))
+            else:
+                logger.warning("AssistantSchema: nenhuma tabela de assistentes com prompt_voz encontrada (%s)", CANDIDATE_TABLES)
+            return table
+
+    def _defer(self, table_name: str, error: Exception) -> None:
+        """Deixa a descoberta pendente e agenda a próxima tentativa (chamar com o lock)."""
+        delay = min(RETRY_BASE_SECONDS * 2 ** self._failures, RETRY_MAX_SECONDS)
+        self._failures += 1
+        self._retry_at = time.monotonic() + delay
+        logger.warning(
+            "AssistantSchema: erro ao consultar %s (%s); descoberta adiada por %.0fs",
+            table_name, str(error)[:200], delay,
+        )
+        return None
+
+    def refresh(self) -> Optional[str]:
+        """Hook explícito: refaz a descoberta (ex.: depois de renomear a tabela)."""
+        return self.resolve(force=True)
+
+    def get_prompt_voz(self, assistente_id: str) -> Optional[str]:
+        """Lê prompt_voz do assistente na tabela resolvida (uma consulta)."""
+        table = self.table
+        if not table or not assistente_id:
+            return None
+        try:
+            client = supabase_service._require_client()
+            resp = client.table(table).select("prompt_voz").eq("id", assistente_id).limit(1).execute()
+            if resp.data:
+                return resp.data[0].get("prompt_voz")
+        except Exception as e:
+            logger.warning("AssistantSchema: erro ao ler prompt_voz de %s.%s: %s", table, assistente_id, e)
+        return None
+
+    async def aget_prompt_voz(self, assistente_id: str) -> Optional[str]:
+        """Versão async de get_prompt_voz (usa o pool do AsyncSupabaseService)."""
+        table = self._table if self._resolved else await asyncio.to_thread(self.resolve)
+        if not table or not assistente_id:
+            return None
+        try:
+            client = await async_supabase_service._require_client()
+            resp = await client.table(table).select("prompt_voz").eq("id", assistente_id).limit(1).execute()
+            if resp.data:
+                return resp.data[0].get("prompt_voz")
+        except Exception as e:
+            logger.warning("AssistantSchema: erro ao ler prompt_voz de %s.%s: %s", table, assistente_id, e)
+        return None
+
+
+assistant_schema = AssistantSchema()
@@ -0,0 +1,185 @@
+"""
+Flow Service async: mesmas operações de flow_service, usando o AsyncSupabaseService
+(pool HTTP keep-alive compartilhado) para não bloquear o event loop.
+
+As orquestrações pesadas (get_flow_complete, save_flow) continuam implementadas
+em flow_service e rodam em thread via asyncio.to_thread, assim o event loop fica
+livre enquanto elas fazem várias chamadas ao banco / IA.
+"""
+import asyncio
+import logging
+from typing import Dict, Any, List, Optional
+
+from saas_tools.services import flow_service
+from saas_tools.services.ai_jobs import ai_job_queue
+from saas_tools.services.assistant_schema import assistant_schema
+from saas_tools.services.async_supabase_service import async_supabase_service
+from saas_tools.services.flow_cache import flow_snapshot_cache
+
+logger = logging.getLogger(__name__)
+
+
+async def get_flow(flow_id: str) -> Optional[Dict[str, Any]]:
+    """Get flow by ID."""
+    try:
+        client = await async_supabase_service._require_client()
+        resp = await client.table("flows").select("*").eq("id", flow_id).limit(1).execute()
+        if resp.data:
+            return resp.data[0]
+        return None
+    except Exception as e:
+        logger.error("get_flow: Erro ao buscar flow %s: %s", flow_id, e)
+        return None
+
+
+async def get_flow_by_assistant(assistente_id: str) -> Optional[Dict[str, Any]]:
+    """Get flow linked to an assistant."""
+    try:
+        client = await async_supabase_service._require_client()
+        resp = await (
+            client.table("flows")
+            .select("*")
+            .eq("assistente_id", assistente_id)
+            .limit(1)
+            .execute()
+        )
+        if resp.data:
+            return resp.data[0]
+        return None
+    except Exception as e:
+        logger.error("get_flow_by_assistant: Erro ao buscar flow para assistente %s: %s", assistente_id, e)
+        return None
+
+
+async def get_flow_blocks(flow_id: str) -> List[Dict[str, Any]]:
+    """Get all blocks for a flow (blocos de caminhos sempre com routes_data)."""
+    try:
+        client = await async_supabase_service._require_client()
+        resp = await (
+            client.table("flow_blocks")
+            .select("*, routes_data")
+            .eq("flow_id", flow_id)
+            .order("order_index")
+            .execute()
+        )
+        blocks = resp.data or []
+        for block in blocks:
+            if block.get("block_type") == "caminhos" and block.get("routes_data") is None:
+                block["routes_data"] = []
+        return blocks
+    except Exception as e:
+        logger.error("get_flow_blocks: Erro ao buscar blocos para flow %s: %s", flow_id, e)
+        return []
+
+
+async def list_flows_by_tenant(tenant_id: str) -> List[Dict[str, Any]]:
+    """List all flows for a tenant."""
+    try:
+        client = await async_supabase_service._require_client()
+        resp = await (
+            client.table("flows")
+            .select("*")
+            .eq("tenant_id", tenant_id)
+            .order("created_at", desc=True)
+            .execute()
+        )
+        return resp.data or []
+    except Exception as e:
+        logger.error("list_flows_by_tenant: Erro ao listar flows para tenant %s: %s", tenant_id, e)
+        return []
+
+
+async def create_flow(
+    tenant_id: str,
+    name: str,
+    assistente_id: Optional[str] = None,
+    prompt_base: Optional[str] = None,
+    description: Optional[str] = None,
+) -> Optional[Dict[str, Any]]:
+    """Create a new flow."""
+    try:
+        client = await async_supabase_service._require_client()
+        data = {
+            "tenant_id": tenant_id,
+            "name": name,
+            "prompt_base": prompt_base or "",
+            "description": description,
+            "version": 1,
+        }
+        if assistente_id:
+            data["assistente_id"] = assistente_id
+
+        resp = await client.table("flows").insert(data).execute()
+        if resp.data:
+            logger.info("create_flow: ✅ Flow criado com sucesso: %s", resp.data[0].get("id"))
+            return resp.data[0]
+
+        logger.warning("create_flow: Insert não retornou dados, buscando flow criado...")
+        if assistente_id:
+            flow = await get_flow_by_assistant(assistente_id)
+            if flow:
+                return flow
+        logger.error("create_flow: ❌ Não foi possível criar ou encontrar o flow")
+        return None
+    except Exception as e:
+        logger.error("create_flow: Erro ao criar flow: %s", e)
+        return None
+
+
+async def update_flow(flow_id: str, data: Dict[str, Any]) -> bool:
+    """Update flow metadata."""
+    try:
+        client = await async_supabase_service._require_client()
+        await client.table("flows").update(data).eq("id", flow_id).execute()
+        return True
+    except Exception as e:
+        logger.error("update_flow: Erro ao atualizar flow %s: %s", flow_id, e)
+        return False
+    finally:
+        flow_snapshot_cache.invalidate(flow_id)
+
+
+async def clear_flow_blocks(flow_id: str) -> int:
+    """Deleta todos os blocos de um flow. Retorna quantos foram removidos."""
+    client = await async_supabase_service._require_client()
+    try:
+        resp = await client.table("flow_blocks").delete().eq("flow_id", flow_id).execute()
+    finally:
+        flow_snapshot_cache.invalidate(flow_id)
+    await bump_flow_version(flow_id)
+    return len(resp.data) if resp.data else 0
+
+
+async def bump_flow_version(flow_id: str) -> Optional[int]:
+    """Versão awaitable de flow_service.bump_flow_version (roda em thread)."""
+    return await asyncio.to_thread(flow_service.bump_flow_version, flow_id)
+
+
+async def get_assistant_prompt_voz(assistente_id: str) -> Optional[str]:
+    """Busca prompt_voz do assistente na tabela resolvida por assistant_schema."""
+    return await assistant_schema.aget_prompt_voz(assistente_id)
+
+
+async def refresh_schema() -> Dict[str, Any]:
+    """Versão awaitable de flow_service.refresh_schema (roda em thread)."""
+    return await asyncio.to_thread(flow_service.refresh_schema)
+
+
+async def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
+    """Versão awaitable de flow_service.get_flow_complete (roda em thread)."""
+    return await asyncio.to_thread(flow_service.get_flow_complete, flow_id)
+
+
+async def generate_blocks(flow_id: str):
+    """Enfileira a geração de blocos pela IA (ou devolve o job já ativo para o mesmo flow + prompt)."""
+    snapshot = await asyncio.to_thread(flow_service.load_flow_snapshot, flow_id)
+    prompt = snapshot.prompt_to_parse if snapshot else ""
+    return ai_job_queue.submit(
+        flow_id, "generate_blocks", flow_service.generate_blocks_for_flow, flow_id,
+        dedup_key=flow_service.analysis_key(flow_id, prompt),
+    )
+
+
+async def save_flow(payload) -> Dict[str, Any]:
+    """Versão awaitable de flow_service.save_flow (roda em thread)."""
+    return await asyncio.to_thread(flow_service.save_flow, payload)
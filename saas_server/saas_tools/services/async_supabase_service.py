@@ -0,0 +1,261 @@
+"""
+Versão async do SupabaseService.
+
+Os handlers `async def` dos routers não podem usar o cliente síncrono sem travar
+o event loop. Aqui todas as operações são awaitable e TODOS os clientes
+(PostgREST, Storage) compartilham um único pool HTTP keep-alive, com limites
+configuráveis em settings (SUPABASE_POOL_*).
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import List, Optional, Dict, Any
+import logging
+
+import httpx
+from supabase import acreate_client, AsyncClient
+from supabase.lib.client_options import AsyncClientOptions
+from supabase._sync.client import SupabaseException
+
+from saas_tools.config import settings
+from saas_tools.services.supabase_service import _normalize_ia_insights_row
+
+logger = logging.getLogger(__name__)
+
+
+def _build_http_client() -> httpx.AsyncClient:
+    """Pool HTTP único (keep-alive) usado por todos os clientes async."""
+    limits = httpx.Limits(
+        max_connections=settings.SUPABASE_POOL_MAX_CONNECTIONS,
+        max_keepalive_connections=settings.SUPABASE_POOL_MAX_KEEPALIVE,
+        keepalive_expiry=settings.SUPABASE_POOL_KEEPALIVE_EXPIRY,
+    )
+    return httpx.AsyncClient(
+        limits=limits,
+        timeout=httpx.Timeout(settings.SUPABASE_HTTP_TIMEOUT),
+    )
+
+
+class AsyncSupabaseService:
+    """Service async para operações com Supabase (mesma API do SupabaseService, com await)."""
+
+    def __init__(self):
+        # O cliente é criado sob demanda (acreate_client é async e precisa de um loop rodando).
+        self.client: AsyncClient | None = None
+        self._http: httpx.AsyncClient | None = None
+        self._lock = asyncio.Lock()
+
+    async def _require_client(self) -> AsyncClient:
+        if self.client is not None:
+            return self.client
+        if not settings.SUPABASE_KEY:
+            raise SupabaseException("SUPABASE_KEY is required (defina SUPABASE_KEY no ambiente do saas_server)")
+        async with self._lock:
+            if self.client is None:
+                self._http = _build_http_client()
+                options = AsyncClientOptions(
+                    httpx_client=self._http,
+                    postgrest_client_timeout=settings.SUPABASE_HTTP_TIMEOUT,
+                    storage_client_timeout=int(settings.SUPABASE_HTTP_TIMEOUT),
+                )
+                self.client = await acreate_client(settings.SUPABASE_URL, settings.SUPABASE_KEY, options=options)
+                logger.info(
+                    "AsyncSupabaseService: pool HTTP criado (max_connections=%d, keepalive=%d)",
+                    settings.SUPABASE_POOL_MAX_CONNECTIONS,
+                    settings.SUPABASE_POOL_MAX_KEEPALIVE,
+                )
+        return self.client
+
+    async def aclose(self) -> None:
+        """Fecha o pool HTTP compartilhado (chamado no shutdown do app)."""
+        if self._http is not None:
+            await self._http.aclose()
+        self._http = None
+        self.client = None
+
+    async def get_tools_by_tenant(self, tenant_id: str) -> List[Dict[str, Any]]:
+        try:
+            client = await self._require_client()
+            response = await (
+                client.table("vapi_tools")
+                .select("*")
+                .eq("tenant_id", tenant_id)
+                .eq("is_active", True)
+                .order("created_at", desc=True)
+                .execute()
+            )
+            return response.data
+        except Exception as e:
+            logger.error(f"Erro ao buscar tools: {e}")
+            raise
+
+    async def get_tool_by_id(self, tool_id: str, tenant_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            client = await self._require_client()
+            response = await (
+                client.table("vapi_tools")
+                .select("*")
+                .eq("id", tool_id)
+                .eq("tenant_id", tenant_id)
+                .single()
+                .execute()
+            )
+            return response.data
+        except Exception as e:
+            logger.error(f"Erro ao buscar tool: {e}")
+            return None
+
+    async def create_tool(self, tool_data: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            client = await self._require_client()
+            response = await client.table("vapi_tools").insert(tool_data).execute()
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Erro ao criar tool: {e}")
+            raise
+
+    async def update_tool(self, tool_id: str, tenant_id: str, update_data: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            client = await self._require_client()
+            response = await (
+                client.table("vapi_tools")
+                .update(update_data)
+                .eq("id", tool_id)
+                .eq("tenant_id", tenant_id)
+                .execute()
+            )
+            return response.data[0] if response.data else None
+        except Exception as e:
+            logger.error(f"Erro ao atualizar tool: {e}")
+            raise
+
+    async def delete_tool(self, tool_id: str, tenant_id: str) -> bool:
+        try:
+            client = await self._require_client()
+            response = await (
+                client.table("vapi_tools")
+                .update({"is_active": False})
+                .eq("id", tool_id)
+                .eq("tenant_id", tenant_id)
+                .execute()
+            )
+            return len(response.data) > 0
+        except Exception as e:
+            logger.error(f"Erro ao deletar tool: {e}")
+            raise
+
+    async def get_instances_by_tenant(self, tenant_id: str) -> List[Dict[str, Any]]:
+        try:
+            client = await self._require_client()
+            response = await (
+                client.table("whatsapp_instances")
+                .select("id, instance_name, phone_number, status")
+                .eq("tenant_id", tenant_id)
+                .eq("status", "conectada")
+                .execute()
+            )
+            return response.data
+        except Exception as e:
+            logger.error(f"Erro ao buscar instâncias: {e}")
+            raise
+
+    # ============================================================================
+    # Assistants: profiles / flows
+    # ============================================================================
+    async def get_assistant_profile(self, assistant_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            client = await self._require_client()
+            response = await (
+                client.table("assistant_profiles")
+                .select("*")
+                .eq("assistant_id", assistant_id)
+                .single()
+                .execute()
+            )
+            return response.data
+        except Exception as e:
+            logger.info(f"assistant_profiles not found for assistant_id={assistant_id}: {e}")
+            return None
+
+    async def upsert_assistant_profile(self, assistant_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            client = await self._require_client()
+            payload = {"assistant_id": assistant_id, **data}
+            response = await (
+                client.table("assistant_profiles")
+                .upsert(payload, on_conflict="assistant_id")
+                .execute()
+            )
+            return response.data[0] if response.data else payload
+        except Exception as e:
+            logger.error(f"Erro ao upsert assistant_profile: {e}")
+            raise
+
+    async def get_assistant_flow(self, assistant_id: str) -> Optional[Dict[str, Any]]:
+        try:
+            client = await self._require_client()
+            response = await (
+                client.table("assistant_flows")
+                .select("*")
+                .eq("assistant_id", assistant_id)
+                .single()
+                .execute()
+            )
+            return response.data
+        except Exception as e:
+            logger.info(f"assistant_flows not found for assistant_id={assistant_id}: {e}")
+            return None
+
+    async def upsert_assistant_flow(self, assistant_id: str, flow_json: Dict[str, Any], meta: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        try:
+            client = await self._require_client()
+            payload: Dict[str, Any] = {"assistant_id": assistant_id, "flow_json": flow_json}
+            if meta:
+                payload.update(meta)
+            response = await (
+                client.table("assistant_flows")
+                .upsert(payload, on_conflict="assistant_id")
+                .execute()
+            )
+            return response.data[0] if response.data else payload
+        except Exception as e:
+            logger.error(f"Erro ao upsert assistant_flow: {e}")
+            raise
+
+    async def create_prompt_import_run(self, assistant_id: str, data: Dict[str, Any]) -> Dict[str, Any]:
+        try:
+            client = await self._require_client()
+            payload = {"assistant_id": assistant_id, **data}
+            response = await client.table("prompt_import_runs").insert(payload).execute()
+            return response.data[0] if response.data else payload
+        except Exception as e:
+            logger.error(f"Erro ao criar prompt_import_run: {e}")
+            raise
+
+    # ============================================================================
+    # Dashboard: ia_insights
+    # ============================================================================
+    async def get_ia_insights(self, tenant_id: str, data_filtro: str) -> Optional[Dict[str, Any]]:
+        """Mesmo contrato de SupabaseService.get_ia_insights (data_filtro: YYYY-MM-DD)."""
+        client = await self._require_client()
+        d = datetime.strptime(data_filtro, "%Y-%m-%d")
+        start = d.strftime("%Y-%m-%dT00:00:00")
+        end = (d + timedelta(days=1)).strftime("%Y-%m-%dT00:00:00")
+        try:
+            response = await (
+                client.table("ia_insights")
+                .select("geral, calls, conversas, agendamentos, consideracoes")
+                .eq("tenant_id", tenant_id)
+                .gte("criado_dia", start)
+                .lt("criado_dia", end)
+                .order("criado_dia", desc=True)
+                .limit(1)
+                .execute()
+            )
+            if response.data and len(response.data) > 0:
+                return _normalize_ia_insights_row(response.data[0])
+        except Exception as e:
+            logger.warning("ia_insights: tenant_id=%s data=%s: %s", tenant_id, data_filtro, e)
+        return None
+
+
+async_supabase_service = AsyncSupabaseService()
@@ -7,6 +7,7 @@ from supabase import create_client
 from supabase._sync.client import SupabaseException
 
 from saas_tools.config import settings
+from saas_tools.services.async_supabase_service import async_supabase_service
 
 logger = logging.getLogger(__name__)
 
@@ -77,5 +78,49 @@ class FileService:
         return True, ""
 
 
+class AsyncFileService(FileService):
+    """FileService async: usa o cliente do AsyncSupabaseService (mesmo pool HTTP keep-alive)."""
+
+    def __init__(self):
+        self.client = None
+        self.bucket_name = settings.BUCKET_NAME
+
+    async def _require_client(self):
+        return await async_supabase_service._require_client()
+
+    async def upload_file(self, file_content: bytes, filename: str, tenant_id: str, content_type: str) -> dict:
+        try:
+            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            unique_id = str(uuid.uuid4())[:8]
+            safe_filename = filename.replace(" ", "_")
+            final_filename = f"{timestamp}_{unique_id}_{safe_filename}"
+
+            file_path = f"{tenant_id}/{final_filename}"
+
+            client = await self._require_client()
+            bucket = client.storage.from_(self.bucket_name)
+            await bucket.upload(
+                path=file_path,
+                file=file_content,
+                file_options={"content-type": content_type},
+            )
+
+            public_url = await bucket.get_public_url(file_path)
+
+            file_extension = Path(filename).suffix.lower()
+            file_type = self._get_file_type(file_extension)
+
+            return {
+                "file_url": public_url,
+                "file_name": final_filename,
+                "file_type": file_type,
+                "file_size": len(file_content),
+            }
+        except Exception as e:
+            logger.error(f"Erro ao fazer upload: {e}")
+            raise
+
+
 file_service = FileService()
+async_file_service = AsyncFileService()
 
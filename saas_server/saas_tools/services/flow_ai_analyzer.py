@@ -3,55 +3,41 @@ Serviço de Análise Inteligente de Prompts usando IA
 Analisa o prompt completo do assistente e cria/atualiza blocos automaticamente
 Garante que blocos dentro de rotas sejam criados corretamente
 """
-import os
 import logging
-from typing import Dict, Any, List, Optional
+import re
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 import json
 
-logger = logging.getLogger(__name__)
-
-# Importar cliente da IA (Anthropic Claude ou OpenAI)
-try:
-    from anthropic import Anthropic
-    ANTHROPIC_AVAILABLE = True
-except ImportError:
-    ANTHROPIC_AVAILABLE = False
-    logger.warning("Anthropic SDK não disponível. Instale com: pip install anthropic")
+from saas_tools.config import settings
+from saas_tools.services.incremental_json import BlockStreamParser
+from saas_tools.services.llm_accounting import estimate_tokens, llm_accounting
+from saas_tools.services.llm_cache import llm_cache
+from saas_tools.services.llm_hedging import llm_hedger
+from saas_tools.services.llm_providers import llm_providers, stream_completion
+from saas_tools.services.llm_resilience import LLMCallError, as_call_error, llm_resilience
+from saas_tools.services.llm_routing import model_router
+from saas_tools.services.prompt_compactor import compact_prompt
 
-try:
-    import openai
-    OPENAI_AVAILABLE = True
-except ImportError:
-    OPENAI_AVAILABLE = False
-    logger.warning("OpenAI SDK não disponível. Instale com: pip install openai")
+logger = logging.getLogger(__name__)
 
 
 class FlowAIAnalyzer:
     """Classe para analisar prompts usando IA e criar blocos automaticamente"""
     
-    def __init__(self, provider: str = "openai"):
+    def __init__(self, provider: str = "openai", tenant_id: Optional[str] = None, flow_id: Optional[str] = None):
         """
         Inicializa o analyzer com o provedor de IA
         
         Args:
             provider: "anthropic" (Claude) ou "openai" (GPT)
+            tenant_id / flow_id: para quem as chamadas são feitas (llm_accounting)
         """
         self.provider = provider
-        
-        if provider == "anthropic" and ANTHROPIC_AVAILABLE:
-            api_key = os.getenv("ANTHROPIC_API_KEY")
-            if not api_key:
-                raise ValueError("ANTHROPIC_API_KEY não configurada")
-            self.client = Anthropic(api_key=api_key)
-            self.model = os.getenv("ANTHROPIC_MODEL", "claude-3-haiku-20240307")
-        elif provider == "openai" and OPENAI_AVAILABLE:
-            api_key = os.getenv("OPENAI_API_KEY")
-            if not api_key:
-                raise ValueError("OPENAI_API_KEY não configurada")
-            self.client = openai.OpenAI(api_key=api_key)
-            self.model = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
-        else:
-            raise ValueError(f"Provedor {provider} não disponível ou não configurado")
+        self.tags = {"endpoint": "flow_ai_analyzer", "tenant_id": tenant_id, "flow_id": flow_id}
+        # Cliente compartilhado pelo processo (um por provider/model, conexões reaproveitadas)
+        self.client, self.model = llm_providers.get(provider)
     
     def _build_system_prompt(self) -> str:
         """Constrói o prompt do sistema com as instruções para a IA"""
@@ -544,58 +530,255 @@ Antes de retornar o JSON, verifique:
 
 Retorne APENAS o JSON válido, sem markdown, sem explicações adicionais."""
 
-    def analyze_prompt_to_blocks(self, prompt: str) -> List[Dict[str, Any]]:
+    def _build_user_prompt(self, prompt: str) -> str:
+        """Mensagem do usuário do modo "full" (prompt inteiro numa requisição)"""
+        return f"""Analise este prompt completo e extraia TODOS os blocos, incluindo blocos que estão DENTRO de rotas:
+
+{prompt}
+
+Retorne APENAS o JSON válido com a estrutura de blocos especificada."""
+
+    def analyze_prompt_to_blocks(self, prompt: str, mode: str = "auto") -> List[Dict[str, Any]]:
         """
         Analisa o prompt completo e retorna lista de blocos estruturados
         
         Args:
             prompt: Prompt completo do assistente (formato Markdown)
+            mode: "full" (uma requisição com o prompt inteiro), "sections" (trechos
+                  divididos nos cabeçalhos ### analisados em paralelo) ou "auto"
+                  (sections quando o prompt compactado passa de AI_ANALYSIS_TOKEN_BUDGET tokens)
             
         Returns:
             Lista de blocos com estrutura completa, incluindo blocos dentro de rotas
+        
+        Raises:
+            LLMCallError: provedor indisponível/timeout depois dos retries (motivo em kind/reason)
         """
         if not prompt or not prompt.strip():
             logger.warning("analyze_prompt_to_blocks: Prompt vazio")
             return []
         
+        # ✂️ Só o fluxo vai para a IA (sem identidade/regras/pronúncia, espaços e boilerplate)
+        compacted = compact_prompt(prompt)
+        prompt = compacted.text
+        if mode == "auto":
+            mode = "sections" if compacted.over_budget else "full"
+        if mode == "sections":
+            chunks = compacted.chunks()
+            if len(chunks) > 1:
+                return self.analyze_prompt_in_sections(prompt, chunks)
+        
+        blocks = self._request_blocks(self._build_user_prompt(prompt), source=prompt)
+        
+        logger.info(f"✅ [FlowAIAnalyzer] IA analisou prompt e encontrou {len(blocks)} blocos")
+        
+        # Log detalhado
+        for block in blocks:
+            block_key = block.get("block_key", "SEM_KEY")
+            block_type = block.get("block_type", "SEM_TIPO")
+            parent_router = block.get("parentRouterId")
+            route_id = block.get("routeId")
+            
+            if parent_router:
+                logger.info(f"  📍 Bloco {block_key} ({block_type}) está DENTRO da rota {route_id} do bloco {parent_router}")
+            else:
+                logger.info(f"  📍 Bloco {block_key} ({block_type}) está na sequência principal")
+        
+        return blocks
+    
+    def stream_prompt_blocks(self, prompt: str) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+        """
+        Versão em streaming do modo "full": usa a API de streaming do provedor e
+        entrega cada bloco assim que o objeto dele fecha no JSON (BlockStreamParser),
+        sem esperar o fim da resposta. Model e chave de cache saem da mesma decisão
+        do llm_routing do modo "full" (prompt compactado), então um compartilha o
+        cache do outro. Sem escalada: blocos já entregues não voltam atrás.
+        Cada item é (bloco, problema): problema é o que validate_blocks apontou no
+        bloco (None = bloco válido); quem consome decide o que fazer com os inválidos.
+        Levanta LLMCallError se o provedor falhar ou estiver com o circuito aberto
+        (quem consome decide como avisar o cliente).
+        """
+        if not prompt or not prompt.strip():
+            return
+        compacted_text = compact_prompt(prompt).text
         system_prompt = self._build_system_prompt()
+        user_prompt = self._build_user_prompt(compacted_text)
+        decision = model_router.choose("analysis", compacted_text, provider=self.provider)
+        try:
+            client, model = llm_providers.get(self.provider, model_router.model_for(self.provider, decision))
+        except ValueError as e:
+            raise as_call_error(self.provider, e) from e
+        cache_key = llm_cache.make_key(self.provider, model, system_prompt, user_prompt, max_tokens=4096)
+        parser = BlockStreamParser()
+        invalid = 0
         
+        def checked(blocks: Iterator[Dict[str, Any]]) -> Iterator[Tuple[Dict[str, Any], Optional[str]]]:
+            nonlocal invalid
+            for block in blocks:
+                problem = validate_blocks([block])
+                if problem:
+                    invalid += 1
+                    logger.warning(f"⚠️ [FlowAIAnalyzer] Bloco do streaming fora do esquema ({model}): {problem}")
+                yield block, problem
+        
+        tags = {**self.tags, "endpoint": "flow_ai_analyzer.stream"}
+        cached = llm_cache.get(cache_key)
+        if cached is not None:
+            logger.info("⚡ [FlowAIAnalyzer] Streaming servido do cache de LLM")
+            llm_accounting.record(provider=self.provider, model=model, cache_hit=True, **tags)
+            yield from checked(parser.feed(cached))
+            return
+        
+        # Streaming não tem hedging nem retry (blocos já foram entregues), só o circuit breaker
+        llm_resilience.acquire(self.provider)
+        started = time.monotonic()
+        first_token_ms = None
+        usage: Dict[str, int] = {}
+        outcome = "error"
         try:
-            if self.provider == "anthropic":
-                message = self.client.messages.create(
-                    model=self.model,
-                    max_tokens=4096,
-                    system=system_prompt,
-                    messages=[
-                        {
-                            "role": "user",
-                            "content": f"""Analise este prompt completo e extraia TODOS os blocos, incluindo blocos que estão DENTRO de rotas:
-
-{prompt}
-
-Retorne APENAS o JSON válido com a estrutura de blocos especificada."""
-                        }
-                    ]
-                )
-                response_text = message.content[0].text
-            else:  # OpenAI
-                response = self.client.chat.completions.create(
-                    model=self.model,
-                    messages=[
-                        {"role": "system", "content": system_prompt},
-                        {
-                            "role": "user",
-                            "content": f"""Analise este prompt completo e extraia TODOS os blocos, incluindo blocos que estão DENTRO de rotas:
-
-{prompt}
-
-Retorne APENAS o JSON válido com a estrutura de blocos especificada."""
-                        }
-                    ],
-                    temperature=0.1,
-                    max_tokens=4096
-                )
-                response_text = response.choices[0].message.content
+            with llm_providers.slot():
+                for text in stream_completion(self.provider, client, model, system_prompt, user_prompt,
+                                              max_tokens=4096, usage=usage):
+                    if first_token_ms is None:
+                        first_token_ms = (time.monotonic() - started) * 1000
+                    yield from checked(parser.feed(text))
+            outcome = "ok"
+        except GeneratorExit:
+            # Cliente desconectou do SSE
+            outcome = "cancelled"
+            llm_resilience.record(self.provider, cancelled=True)
+            raise
+        except Exception as e:
+            llm_resilience.record(self.provider, e)
+            raise as_call_error(self.provider, e) from e
+        finally:
+            llm_accounting.record(
+                provider=self.provider,
+                model=model,
+                input_tokens=usage.get("input_tokens", estimate_tokens(system_prompt + user_prompt)),
+                output_tokens=usage.get("output_tokens", estimate_tokens(parser.text)),
+                first_token_ms=first_token_ms,
+                total_ms=(time.monotonic() - started) * 1000,
+                outcome=outcome,
+                tokens_estimated=not usage,
+                **tags,
+            )
+        
+        llm_resilience.record(self.provider)
+        logger.info(f"✅ [FlowAIAnalyzer] Streaming concluído: {parser.emitted} blocos ({invalid} fora do esquema)")
+        if parser.finished and (not invalid or decision.tier == "large"):
+            # Mesma regra do modo "full": só respostas fechadas, e do model small só as válidas
+            llm_cache.set(cache_key, parser.text, provider=self.provider, model=model)
+    
+    def analyze_prompt_in_sections(self, prompt: str, chunks: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Divide o prompt nos cabeçalhos ### e analisa os trechos em paralelo
+        (no máximo AI_ANALYSIS_MAX_PARALLEL ao mesmo tempo). Cada trecho recebe o
+        índice de cabeçalhos do prompt inteiro para referenciar blocos de outros
+        trechos; no fim as listas parciais são unidas por merge_chunk_blocks.
+        """
+        if chunks is None:
+            compacted = compact_prompt(prompt)
+            prompt, chunks = compacted.text, compacted.chunks()
+        blocks = merge_chunk_blocks(self.analyze_chunks(prompt, chunks))
+        logger.info(f"✅ [FlowAIAnalyzer] {len(chunks)} trechos analisados, {len(blocks)} blocos após merge")
+        return blocks
+    
+    def analyze_chunks(
+        self,
+        prompt: str,
+        chunks: List[str],
+        errors: Optional[Dict[int, LLMCallError]] = None,
+    ) -> List[List[Dict[str, Any]]]:
+        """
+        Analisa cada trecho em paralelo e devolve uma lista de blocos por trecho (mesma ordem).
+        Sem errors, a falha de um trecho sobe como LLMCallError; com errors, ela é
+        guardada em errors[índice do trecho] e o trecho volta vazio, para quem chama
+        usar o parser só nele.
+        """
+        header_index = "\n".join(
+            line.strip() for line in prompt.splitlines() if SECTION_HEADER_RE.match(line)
+        )
+        total = len(chunks)
+        logger.info(f"🧩 [FlowAIAnalyzer] Analisando {total} trechos (até {settings.AI_ANALYSIS_MAX_PARALLEL} em paralelo)")
+        
+        def analyze_chunk(index: int) -> List[Dict[str, Any]]:
+            user_prompt = f"""Este é o TRECHO {index + 1} de {total} de um prompt maior. Extraia TODOS os blocos DESTE trecho, incluindo blocos que estão DENTRO de rotas.
+
+Cabeçalhos de todas as seções do prompt completo (use os IDs para next_block_key, destination_block_key e parentRouterId que apontam para outros trechos):
+{header_index}
+
+TRECHO:
+{chunks[index]}
+
+Retorne APENAS o JSON válido com a estrutura de blocos especificada, somente com os blocos deste trecho."""
+            if errors is None:
+                return self._request_blocks(user_prompt, source=chunks[index])
+            try:
+                return self._request_blocks(user_prompt, source=chunks[index])
+            except LLMCallError as e:
+                logger.error(f"❌ [FlowAIAnalyzer] Trecho {index + 1}/{total} falhou: {e}")
+                errors[index] = e
+                return []
+        
+        with ThreadPoolExecutor(max_workers=max(1, settings.AI_ANALYSIS_MAX_PARALLEL)) as pool:
+            return list(pool.map(analyze_chunk, range(total)))
+    
+    def _request_blocks(self, user_prompt: str, source: Optional[str] = None) -> List[Dict[str, Any]]:
+        """
+        Uma requisição ao LLM que devolve a lista "blocks" do JSON. O tier do model
+        (llm_routing) sai do tamanho/complexidade de source (o prompt ou trecho
+        analisado); se a resposta do model small não passar em validate_blocks, a
+        mesma requisição é repetida no model large.
+        Resposta final sem nenhum bloco aproveitável (JSON inválido, sem "blocks",
+        lista vazia) levanta LLMCallError(kind="invalid_response"): quem chama cai
+        para o parser em vez de tratar [] como "a IA não achou blocos".
+        """
+        decision = model_router.choose("analysis", user_prompt if source is None else source, provider=self.provider)
+        model, tier = self.model, "large"
+        if decision.is_small:
+            model, tier = model_router.model_for(self.provider, decision), decision.tier
+            blocks, problem = self._request_blocks_with_model(user_prompt, model, tier)
+            if problem is None or not model_router.can_escalate(self.provider, decision):
+                return self._usable_blocks(blocks, problem, model)
+            model_router.record_escalation(decision, problem)
+            model, tier = self.model, "large"
+        blocks, problem = self._request_blocks_with_model(user_prompt, model, tier)
+        return self._usable_blocks(blocks, problem, model)
+    
+    def _usable_blocks(self, blocks: List[Dict[str, Any]], problem: Optional[str], model: str) -> List[Dict[str, Any]]:
+        """Blocos da resposta final; sem nenhum bloco e com problema, levanta invalid_response."""
+        if problem and not blocks:
+            raise LLMCallError(self.provider, "invalid_response", f"{model}: {problem}")
+        return blocks
+    
+    def _request_blocks_with_model(self, user_prompt: str, model: str, tier: str) -> Tuple[List[Dict[str, Any]], Optional[str]]:
+        """
+        Chamada (com cache em disco) a um model. Retorna (blocos, problema); problema None = resposta válida.
+        Falhas do provedor (timeout, circuito aberto, erro depois dos retries) sobem como LLMCallError.
+        """
+        system_prompt = self._build_system_prompt()
+        try:
+            client, model = llm_providers.get(self.provider, model)
+        except ValueError as e:
+            raise as_call_error(self.provider, e) from e
+        
+        # ⚡ Cache em disco: mesma requisição (provider, model, system, entrada) não vai ao provedor
+        cache_key = llm_cache.make_key(self.provider, model, system_prompt, user_prompt, max_tokens=4096)
+        response_text = llm_cache.get(cache_key)
+        from_cache = response_text is not None
+        
+        try:
+            if from_cache:
+                logger.info("⚡ [FlowAIAnalyzer] Resposta encontrada no cache de LLM")
+                llm_accounting.record(provider=self.provider, model=model, cache_hit=True, **self.tags)
+            else:
+                # Hedging: sem primeiro token no prazo, a mesma requisição vai para o outro provedor
+                result = llm_hedger.complete(self.provider, client, model, system_prompt, user_prompt,
+                                             max_tokens=4096, tags=self.tags, tier=tier)
+                response_text = result.text
+                if result.provider != self.provider:
+                    logger.info(f"🔀 [FlowAIAnalyzer] Resposta veio de {result.provider} ({result.model})")
             
             # Extrair JSON da resposta (pode ter markdown code blocks)
             json_text = response_text.strip()
@@ -609,45 +792,191 @@ Retorne APENAS o JSON válido com a estrutura de blocos especificada."""
             
             # Parse JSON
             result = json.loads(json_text)
-            blocks = result.get("blocks", [])
-            
-            logger.info(f"✅ [FlowAIAnalyzer] IA analisou prompt e encontrou {len(blocks)} blocos")
-            
-            # Log detalhado
-            for block in blocks:
-                block_key = block.get("block_key", "SEM_KEY")
-                block_type = block.get("block_type", "SEM_TIPO")
-                parent_router = block.get("parentRouterId")
-                route_id = block.get("routeId")
-                
-                if parent_router:
-                    logger.info(f"  📍 Bloco {block_key} ({block_type}) está DENTRO da rota {route_id} do bloco {parent_router}")
-                else:
-                    logger.info(f"  📍 Bloco {block_key} ({block_type}) está na sequência principal")
-            
-            return blocks
+            blocks = result.get("blocks", []) if isinstance(result, dict) else []
+            problem = validate_blocks(blocks) if isinstance(result, dict) else "JSON sem o objeto {\"blocks\": [...]}"
+            if problem:
+                logger.warning(f"⚠️ [FlowAIAnalyzer] Resposta de {model} fora do esquema: {problem}")
+            if not from_cache and (problem is None or tier == "large"):
+                # Só guarda JSON válido (e, no model small, só o que passou no esquema)
+                llm_cache.set(cache_key, response_text, provider=self.provider, model=model)
+            return blocks if isinstance(blocks, list) else [], problem
             
         except json.JSONDecodeError as e:
             logger.error(f"❌ [FlowAIAnalyzer] Erro ao fazer parse do JSON retornado pela IA: {e}")
             logger.error(f"Resposta da IA: {response_text[:500]}")
-            return []
+            return [], f"JSON inválido ({e})"
+        except LLMCallError as e:
+            logger.error(f"❌ [FlowAIAnalyzer] Erro ao analisar prompt com IA: {e}")
+            raise
         except Exception as e:
             logger.error(f"❌ [FlowAIAnalyzer] Erro ao analisar prompt com IA: {e}")
             import traceback
             logger.error(f"Traceback: {traceback.format_exc()}")
-            return []
+            raise as_call_error(self.provider, e) from e
+
+
+# Tipos de bloco aceitos no JSON da IA: os tipos 1 a 6 do prompt do sistema
+# (_build_system_prompt); ao mudar um, mudar o outro
+BLOCK_TYPES = ("primeira_mensagem", "mensagem", "aguardar", "caminhos", "encerrar", "ferramenta")
+
+
+def validate_blocks(blocks: Any) -> Optional[str]:
+    """
+    Validação de esquema da lista "blocks" devolvida pela IA. Retorna o primeiro
+    problema encontrado ou None. Usada para decidir a escalada small -> large.
+    """
+    if not isinstance(blocks, list):
+        return "\"blocks\" não é uma lista"
+    if not blocks:
+        return "nenhum bloco"
+    for index, block in enumerate(blocks):
+        if not isinstance(block, dict):
+            return f"bloco {index} não é um objeto"
+        if not _normalize_key(block.get("block_key")):
+            return f"bloco {index} sem block_key"
+        if block.get("block_type") not in BLOCK_TYPES:
+            return f"bloco {block.get('block_key')} com block_type inválido ({block.get('block_type')!r})"
+        if block["block_type"] == "caminhos":
+            routes = block.get("routes_data")
+            if not isinstance(routes, list) or not routes:
+                return f"caminhos {block.get('block_key')} sem routes_data"
+            if not all(isinstance(route, dict) for route in routes):
+                return f"caminhos {block.get('block_key')} com rota inválida"
+    return None
+
+
+# Cabeçalho de seção de bloco: exatamente "###" (os "####" das rotas ficam dentro da seção do CAMINHOS)
+SECTION_HEADER_RE = re.compile(r"^###(?!#)")
+# Blocos que não continuam a sequência principal sozinhos
+_TERMINAL_BLOCK_TYPES = ("encerrar", "caminhos")
+
+
+def split_prompt_sections(prompt: str) -> List[str]:
+    """
+    Divide o prompt nos cabeçalhos ### (cada seção começa na linha do cabeçalho).
+    Texto antes da primeira seção ### vira o primeiro elemento.
+    """
+    sections: List[str] = []
+    current: List[str] = []
+    for line in prompt.splitlines(keepends=True):
+        if SECTION_HEADER_RE.match(line) and current:
+            sections.append("".join(current))
+            current = []
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def _normalize_key(key: Any) -> Optional[str]:
+    if not key or not isinstance(key, str):
+        return None
+    return key.strip().strip("[]").strip().upper() or None
+
+
+def merge_chunk_blocks(partials: List[List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+    """
+    Une as listas de blocos de cada trecho em uma lista única e ordenada:
+    - remove block_key repetido (fica a primeira ocorrência) e renumera order_index (0, 10, 20...)
+    - next_block_key / destination_block_key / parentRouterId que apontam para blocos
+      inexistentes são normalizados ([msg001] -> MSG001) ou descartados
+    - o último bloco da sequência principal de um trecho sem next_block_key é ligado
+      ao primeiro bloco da sequência principal do trecho seguinte
+    - um bloco que continua (via next_block_key) uma rota iniciada em outro trecho herda
+      parentRouterId/routeId, a menos que seja o destino final da rota
+    """
+    merged: List[Dict[str, Any]] = []
+    chunk_of: Dict[str, int] = {}
+    for chunk_index, blocks in enumerate(partials):
+        ordered = sorted(blocks or [], key=lambda b: b.get("order_index") or 0)
+        for block in ordered:
+            key = _normalize_key(block.get("block_key"))
+            if not key or key in chunk_of:
+                continue
+            block = dict(block)
+            block["block_key"] = key
+            if block.get("routes_data"):
+                block["routes_data"] = [dict(route) for route in block["routes_data"]]
+            chunk_of[key] = chunk_index
+            merged.append(block)
+    
+    by_key = {b["block_key"]: b for b in merged}
+    
+    def resolve(ref: Any) -> Optional[str]:
+        key = _normalize_key(ref)
+        return key if key in by_key else None
+    
+    for block in merged:
+        if block.get("next_block_key"):
+            resolved = resolve(block["next_block_key"])
+            if not resolved:
+                logger.warning(f"⚠️ [FlowAIAnalyzer] merge: {block['block_key']} aponta para bloco inexistente {block['next_block_key']}")
+            block["next_block_key"] = resolved
+        parent = block.get("parentRouterId")
+        if parent:
+            resolved_parent = resolve(parent)
+            if not resolved_parent or by_key[resolved_parent].get("block_type") != "caminhos":
+                resolved_parent = None
+            block["parentRouterId"] = resolved_parent
+            if not resolved_parent:
+                block["routeId"] = None
+        for route in block.get("routes_data") or []:
+            if route.get("destination_block_key"):
+                route["destination_block_key"] = resolve(route["destination_block_key"]) or route["destination_block_key"]
+    
+    # Destinos finais das rotas ficam FORA da rota
+    route_destinations = {
+        (b["block_key"], route.get("route_key")): route.get("destination_block_key")
+        for b in merged if b.get("block_type") == "caminhos"
+        for route in b.get("routes_data") or []
+    }
+    
+    # Ligar sequência principal entre trechos
+    for chunk_index in range(len(partials) - 1):
+        main_current = [b for b in merged if chunk_of[b["block_key"]] == chunk_index and not b.get("parentRouterId")]
+        main_next = [b for b in merged if chunk_of[b["block_key"]] == chunk_index + 1 and not b.get("parentRouterId")]
+        if not main_current or not main_next:
+            continue
+        last = main_current[-1]
+        if not last.get("next_block_key") and last.get("block_type") not in _TERMINAL_BLOCK_TYPES:
+            last["next_block_key"] = main_next[0]["block_key"]
+    
+    # Rotas que atravessam trechos: propagar parentRouterId pela cadeia de next_block_key
+    changed = True
+    while changed:
+        changed = False
+        for block in merged:
+            parent = block.get("parentRouterId")
+            next_key = block.get("next_block_key")
+            if not parent or not next_key:
+                continue
+            target = by_key[next_key]
+            if target.get("parentRouterId") or chunk_of[next_key] == chunk_of[block["block_key"]]:
+                continue
+            if route_destinations.get((parent, block.get("routeId"))) == next_key:
+                continue
+            target["parentRouterId"] = parent
+            target["routeId"] = block.get("routeId")
+            changed = True
+    
+    for index, block in enumerate(merged):
+        block["order_index"] = index * 10
+    return merged
 
 
-def analyze_prompt_with_ai(prompt: str, provider: str = "openai") -> List[Dict[str, Any]]:
+def analyze_prompt_with_ai(prompt: str, provider: str = "openai", mode: str = "auto",
+                           tenant_id: Optional[str] = None, flow_id: Optional[str] = None) -> List[Dict[str, Any]]:
     """
     Função helper para analisar prompt usando IA
     
     Args:
         prompt: Prompt completo do assistente
         provider: "anthropic" (Claude) ou "openai" (GPT)
+        mode: "auto", "full" ou "sections" (ver FlowAIAnalyzer.analyze_prompt_to_blocks)
+        tenant_id / flow_id: para quem a análise é feita (llm_accounting)
         
     Returns:
         Lista de blocos estruturados
     """
-    analyzer = FlowAIAnalyzer(provider=provider)
-    return analyzer.analyze_prompt_to_blocks(prompt)
+    analyzer = FlowAIAnalyzer(provider=provider, tenant_id=tenant_id, flow_id=flow_id)
+    return analyzer.analyze_prompt_to_blocks(prompt, mode=mode)
@@ -0,0 +1,162 @@
+"""
+Cache em memória (LRU) de snapshots de flow.
+
+Flows são lidos muito mais do que escritos (o editor recarrega, e cada chamada
+roda prompt_builder.get_prompt_for_flow). As entradas são chaveadas por
+(flow_id, version) e o cache guarda apenas a versão mais recente de cada flow.
+
+- Toda escrita (save_flow, update_single_block, update_flow, clear_flow_blocks)
+  chama invalidate(flow_id), que marca o flow com um relógio lógico. Quem carrega
+  lê generation(flow_id) antes de ir ao banco e passa para put(): se uma escrita
+  invalidou o flow no meio da leitura, o snapshot (talvez antigo) é descartado.
+  Só as últimas max_entries marcas ficam guardadas; as mais antigas viram um piso
+  comum (no pior caso um put é descartado sem necessidade, nunca aceito errado).
+- get(flow_id, version, updated_at) só devolve a entrada se version/updated_at
+  baterem com os informados (FLOW_CACHE_VALIDATE, desligado por padrão); para
+  escritas feitas por outros processos, o TTL é a rede de segurança.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from saas_tools.config import settings
+from saas_tools.models.schemas import FlowSnapshot
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, int]
+
+
+class FlowSnapshotCache:
+    """LRU thread-safe de FlowSnapshot com contadores de hit/miss."""
+
+    def __init__(self, max_entries: int = 256, ttl_seconds: float = 0.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._entries: "OrderedDict[CacheKey, Tuple[float, FlowSnapshot]]" = OrderedDict()
+        self._latest: Dict[str, int] = {}
+        # Relógio lógico: cada invalidate avança; _invalidated_at guarda a marca do último
+        # invalidate de cada flow (no máximo max_entries, as podadas sobem _floor)
+        self._clock = 0
+        self._floor = 0
+        self._invalidated_at: "OrderedDict[str, int]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def generation(self, flow_id: str) -> int:
+        """Marca da leitura (relógio lógico atual). Ler antes de buscar no banco e passar para put()."""
+        with self._lock:
+            return self._clock
+
+    def get(
+        self,
+        flow_id: str,
+        version: Optional[int] = None,
+        updated_at: Optional[str] = None,
+    ) -> Optional[FlowSnapshot]:
+        """
+        Retorna uma cópia do snapshot em cache (ou None).
+        Se version/updated_at forem informados e não baterem com os guardados, o flow
+        mudou no banco: a entrada é descartada e conta como miss.
+        """
+        with self._lock:
+            cached_version = self._latest.get(flow_id)
+            if cached_version is None:
+                self.misses += 1
+                return None
+            key = (flow_id, cached_version)
+            stored_at, snapshot = self._entries[key]
+            stale = (version is not None and version != cached_version) or (
+                updated_at is not None and updated_at != snapshot.updated_at
+            )
+            if stale or (self.ttl_seconds and time.monotonic() - stored_at > self.ttl_seconds):
+                self._drop(flow_id)
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+        # Cópia: quem chama pode alterar flow/blocos sem sujar o cache
+        return snapshot.model_copy(deep=True)
+
+    def put(self, snapshot: FlowSnapshot, generation: Optional[int] = None) -> None:
+        """
+        Guarda o snapshot. generation é o valor de generation(flow_id) lido antes da
+        busca no banco: se o flow foi invalidado desde então, a escrita é descartada.
+        """
+        flow_id = snapshot.flow_id
+        if not flow_id:
+            return
+        key = (flow_id, snapshot.version)
+        with self._lock:
+            if generation is not None and self._invalidated_at.get(flow_id, self._floor) > generation:
+                # Uma escrita invalidou o flow durante a leitura: o snapshot pode ser anterior a ela
+                logger.debug("FlowSnapshotCache: snapshot do flow %s descartado (invalidado durante a leitura)", flow_id)
+                return
+            cached_version = self._latest.get(flow_id)
+            if cached_version is not None and cached_version > snapshot.version:
+                # Leitura atrasada de uma versão antiga: não sobrescrever
+                return
+            self._drop(flow_id)
+            self._entries[key] = (time.monotonic(), snapshot.model_copy(deep=True))
+            self._latest[flow_id] = snapshot.version
+            while len(self._entries) > self.max_entries:
+                (old_flow_id, _), _ = self._entries.popitem(last=False)
+                self._latest.pop(old_flow_id, None)
+                self.evictions += 1
+
+    def invalidate(self, flow_id: str) -> None:
+        """Remove o flow do cache (todas as versões). Chamar depois de qualquer escrita."""
+        if not flow_id:
+            return
+        with self._lock:
+            self._clock += 1
+            self._invalidated_at[flow_id] = self._clock
+            self._invalidated_at.move_to_end(flow_id)
+            while len(self._invalidated_at) > self.max_entries:
+                _, stamp = self._invalidated_at.popitem(last=False)
+                self._floor = max(self._floor, stamp)
+            if self._drop(flow_id):
+                self.invalidations += 1
+                logger.debug("FlowSnapshotCache: flow %s invalidado", flow_id)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._latest.clear()
+            # Leituras em andamento de qualquer flow ficam abaixo do piso e são descartadas
+            self._clock += 1
+            self._floor = self._clock
+            self._invalidated_at.clear()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+    def _drop(self, flow_id: str) -> bool:
+        """Remove a entrada do flow (chamar com o lock). Retorna True se existia."""
+        version = self._latest.pop(flow_id, None)
+        if version is None:
+            return False
+        self._entries.pop((flow_id, version), None)
+        return True
+
+
+flow_snapshot_cache = FlowSnapshotCache(
+    max_entries=settings.FLOW_CACHE_MAX_ENTRIES,
+    ttl_seconds=settings.FLOW_CACHE_TTL_SECONDS,
+)
@@ -2,16 +2,54 @@
 Flow Service: CRUD operations for flows, blocks, and routes.
 Includes automatic block generation from prompt_base when flow is empty.
 """
+import hashlib
+import json
 import logging
 import re
-from typing import Dict, Any, List, Optional
+import time
+from typing import Callable, Dict, Any, List, Optional, Tuple
 
+from saas_tools.config import settings
+from saas_tools.models.schemas import FlowSnapshot
+from saas_tools.services.ai_jobs import ai_job_queue
+from saas_tools.services.assistant_schema import assistant_schema
+from saas_tools.services.flow_cache import flow_snapshot_cache
 from saas_tools.services.supabase_service import supabase_service
 from saas_tools.services.prompt_parser import parse_prompt_base_to_blocks
-from saas_tools.services.flow_ai_analyzer import analyze_prompt_with_ai
+from saas_tools.services.single_flight import SingleFlight
+from saas_tools.services.hybrid_flow_analyzer import analyze_prompt_hybrid
 
 logger = logging.getLogger(__name__)
 
+# Vira False quando a RPC get_flow_snapshot não existe no banco (erro de função inexistente;
+# timeout/5xx só caem para o SELECT naquela chamada)
+_snapshot_rpc_available = True
+# Códigos do PostgREST/Postgres para função inexistente
+MISSING_FUNCTION_CODES = ("PGRST202", "42883")
+# Vira False se flow_blocks ainda não tem a coluna content_hash (ADICIONAR_CONTENT_HASH_FLOW_BLOCKS.sql)
+_content_hash_available = True
+# Códigos do Postgres/PostgREST para coluna inexistente
+MISSING_COLUMN_CODES = ("42703", "PGRST204")
+
+# Uma análise de IA por (flow_id, hash do prompt): chamadas concorrentes compartilham o resultado
+ai_analysis_flight = SingleFlight("ai_analysis")
+
+# Campos que entram no content_hash de um bloco (os de FlowBlockUpsert + routes_data)
+HASHED_BLOCK_FIELDS = (
+    "block_key", "block_type", "content", "variable_name", "timeout_seconds",
+    "analyze_variable", "tool_type", "tool_config", "end_type", "end_metadata",
+    "next_block_key", "order_index", "position_x", "position_y", "routes_data",
+)
+
+
+def _is_error_code(error: Exception, codes: Tuple[str, ...]) -> bool:
+    """O erro do Supabase (APIError do postgrest) tem um destes códigos? Sem .code, procura na mensagem."""
+    code = getattr(error, "code", None)
+    if code:
+        return str(code) in codes
+    message = str(error)
+    return any(candidate in message for candidate in codes)
+
 
 def get_flow(flow_id: str) -> Optional[Dict[str, Any]]:
     """Get flow by ID."""
@@ -45,127 +83,153 @@ def get_flow_by_assistant(assistente_id: str) -> Optional[Dict[str, Any]]:
         return None
 
 
+def _normalize_blocks(blocks: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Garante que blocos de caminhos sempre tenham routes_data (mesmo que vazio)."""
+    for block in blocks:
+        if block.get("block_type") == "caminhos" and block.get("routes_data") is None:
+            block["routes_data"] = []
+    return blocks
+
+
 def get_flow_blocks(flow_id: str) -> List[Dict[str, Any]]:
     """Get all blocks for a flow."""
     try:
         client = supabase_service._require_client()
-        # ⭐ IMPORTANTE: Incluir routes_data (JSONB) nos blocos de caminhos
-        # ⚠️ EXPLICITAMENTE selecionar routes_data para garantir que vem
-        try:
-            # ⭐ EXPLICITAMENTE incluir routes_data no SELECT para garantir que vem
-            resp = (
-                client.table("flow_blocks")
-                .select("*, routes_data")  # ⭐ EXPLICITAMENTE incluir routes_data
-                .eq("flow_id", flow_id)
-                .order("order_index")
-                .execute()
-            )
-            blocks = resp.data or []
-            logger.info("get_flow_blocks: ✅ Query executada, retornados %d blocos", len(blocks))
-            
-            # 🔍 DEBUG: Verificar se routes_data está presente nos blocos retornados
-            if blocks:
-                sample_block = blocks[0]
-                logger.info("get_flow_blocks: 🔍 Exemplo de bloco retornado - propriedades: %s", list(sample_block.keys()))
-                if "routes_data" in sample_block:
-                    logger.info("get_flow_blocks: ✅ routes_data está presente nos blocos retornados")
-                else:
-                    logger.warning("get_flow_blocks: ⚠️ routes_data NÃO está presente nos blocos retornados!")
-        except Exception as e:
-            logger.error("get_flow_blocks: ❌ Erro ao buscar blocos: %s", str(e))
-            import traceback
-            logger.error("get_flow_blocks: Traceback: %s", traceback.format_exc())
-            return []
-        
-        # 🔍 DEBUG: Log detalhado do que veio do banco ANTES de processar
-        logger.info("get_flow_blocks: Retornados %d blocos do banco", len(blocks))
-        caminhos_blocks = [b for b in blocks if b.get("block_type") == "caminhos"]
-        if caminhos_blocks:
-            logger.info("get_flow_blocks: 🔍 Encontrados %d blocos de caminhos", len(caminhos_blocks))
-            for block in caminhos_blocks:
-                block_key = block.get("block_key", "SEM_KEY")
-                has_routes_data = "routes_data" in block
-                routes_data_value = block.get("routes_data")
-                routes_data_type = type(routes_data_value).__name__ if routes_data_value is not None else "None"
-                routes_data_length = len(routes_data_value) if isinstance(routes_data_value, list) else "N/A"
-                
-                logger.info("get_flow_blocks: 🔍 Bloco %s:", block_key)
-                logger.info("  - routes_data presente: %s", has_routes_data)
-                logger.info("  - routes_data tipo: %s", routes_data_type)
-                logger.info("  - routes_data length: %s", routes_data_length)
-                logger.info("  - routes_data valor: %s", str(routes_data_value)[:200] if routes_data_value else "None")
-                logger.info("  - TODAS propriedades do bloco: %s", list(block.keys()))
-                
-                # Se não tem routes_data mas deveria ter, tentar buscar diretamente
-                if not has_routes_data:
-                    logger.warning("get_flow_blocks: ⚠️ Bloco %s não tem routes_data! Tentando buscar diretamente...", block_key)
-                    try:
-                        block_id = block.get("id")
-                        if block_id:
-                            direct_resp = client.table("flow_blocks").select("routes_data").eq("id", block_id).single().execute()
-                            if direct_resp.data and "routes_data" in direct_resp.data:
-                                block["routes_data"] = direct_resp.data["routes_data"]
-                                logger.info("get_flow_blocks: ✅ routes_data recuperado diretamente para bloco %s: %s", 
-                                          block_key, str(block["routes_data"])[:100])
-                            else:
-                                logger.warning("get_flow_blocks: ⚠️ Busca direta também não retornou routes_data para bloco %s", block_key)
-                    except Exception as e2:
-                        logger.error("get_flow_blocks: ❌ Erro ao buscar routes_data diretamente: %s", str(e2))
-        
-        # ⭐ GARANTIR que blocos de caminhos sempre tenham routes_data (mesmo que vazio)
-        for block in blocks:
-            if block.get("block_type") == "caminhos":
-                # Se routes_data não existe ou é None, definir como array vazio
-                if "routes_data" not in block or block.get("routes_data") is None:
-                    block["routes_data"] = []
-                    logger.info("get_flow_blocks: Bloco %s não tinha routes_data, definido como []", block.get("block_key"))
-        
-        # 🔍 DEBUG: Verificar se routes_data está presente ANTES de retornar
-        caminhos_blocks = [b for b in blocks if b.get("block_type") == "caminhos"]
-        if caminhos_blocks:
-            logger.info("get_flow_blocks: ✅ Encontrados %d blocos de caminhos", len(caminhos_blocks))
-            for block in caminhos_blocks:
-                block_key = block.get("block_key", "SEM_KEY")
-                has_routes_data = "routes_data" in block
-                routes_data_value = block.get("routes_data")
-                routes_data_type = type(routes_data_value).__name__ if routes_data_value is not None else "None"
-                routes_data_count = len(routes_data_value) if isinstance(routes_data_value, list) else 0
-                
-                logger.info("get_flow_blocks: 🔍 Bloco %s ANTES DE RETORNAR:", block_key)
-                logger.info("  - has_routes_data: %s", has_routes_data)
-                logger.info("  - routes_data_type: %s", routes_data_type)
-                logger.info("  - routes_data_count: %d", routes_data_count)
-                logger.info("  - routes_data_value: %s", str(routes_data_value)[:300] if routes_data_value else "None")
-                logger.info("  - TODAS propriedades: %s", list(block.keys()))
-                
-                # ⚠️ VERIFICAÇÃO CRÍTICA: Se routes_data não está presente, tentar buscar novamente
-                if not has_routes_data or routes_data_value is None:
-                    logger.warning("get_flow_blocks: ⚠️ Bloco %s SEM routes_data antes de retornar! Tentando buscar novamente...", block_key)
-                    try:
-                        block_id = block.get("id")
-                        if block_id:
-                            direct_resp = client.table("flow_blocks").select("routes_data").eq("id", block_id).single().execute()
-                            if direct_resp.data and "routes_data" in direct_resp.data:
-                                block["routes_data"] = direct_resp.data["routes_data"]
-                                logger.info("get_flow_blocks: ✅ routes_data recuperado para bloco %s: %d routes", 
-                                          block_key, len(block["routes_data"]) if isinstance(block["routes_data"], list) else 0)
-                    except Exception as e3:
-                        logger.error("get_flow_blocks: ❌ Erro ao buscar routes_data novamente: %s", str(e3))
-        
-        # 🔍 DEBUG FINAL: Verificar CAM001 especificamente
-        cam001_block = next((b for b in blocks if b.get("block_key") == "CAM001"), None)
-        if cam001_block:
-            logger.info("get_flow_blocks: 🔍 CAM001 FINAL:")
-            logger.info("  - has_routes_data: %s", "routes_data" in cam001_block)
-            logger.info("  - routes_data: %s", str(cam001_block.get("routes_data"))[:500])
-            logger.info("  - routes_data_length: %s", len(cam001_block.get("routes_data", [])) if isinstance(cam001_block.get("routes_data"), list) else "N/A")
-        
+        # ⭐ routes_data (JSONB) vem explicitamente no SELECT, sem buscas extras por bloco
+        resp = (
+            client.table("flow_blocks")
+            .select("*, routes_data")
+            .eq("flow_id", flow_id)
+            .order("order_index")
+            .execute()
+        )
+        blocks = _normalize_blocks(resp.data or [])
+        logger.info("get_flow_blocks: ✅ %d blocos retornados para flow %s", len(blocks), flow_id)
         return blocks
     except Exception as e:
         logger.error("get_flow_blocks: Erro ao buscar blocos para flow %s: %s", flow_id, e)
         return []
 
 
+def load_flow_snapshot(flow_id: str, use_cache: bool = True) -> Optional[FlowSnapshot]:
+    """
+    Snapshot do flow via cache LRU (flow_cache); no miss, lê do banco e guarda.
+    Com FLOW_CACHE_VALIDATE, a entrada só vale se flows.version/updated_at no banco
+    ainda forem os do snapshot (um SELECT de duas colunas no lugar da leitura completa).
+    """
+    generation = flow_snapshot_cache.generation(flow_id)
+    if use_cache:
+        version = updated_at = None
+        if settings.FLOW_CACHE_VALIDATE:
+            stamp = _fetch_flow_stamp(flow_id)
+            if stamp is not None:
+                version, updated_at = stamp
+        if not settings.FLOW_CACHE_VALIDATE or version is not None:
+            cached = flow_snapshot_cache.get(flow_id, version=version, updated_at=updated_at)
+            if cached is not None:
+                return cached
+    snapshot = _fetch_flow_snapshot(flow_id)
+    if snapshot is not None:
+        flow_snapshot_cache.put(snapshot, generation=generation)
+    return snapshot
+
+
+def _fetch_flow_stamp(flow_id: str) -> Optional[Tuple[int, str]]:
+    """(version, updated_at) do flow no banco, ou None se não deu para ler."""
+    try:
+        client = supabase_service._require_client()
+        resp = client.table("flows").select("version, updated_at").eq("id", flow_id).limit(1).execute()
+        if not resp.data:
+            return None
+        row = resp.data[0]
+        return int(row.get("version") or 0), str(row.get("updated_at") or "")
+    except Exception as e:
+        logger.warning("load_flow_snapshot: não foi possível conferir a versão do flow %s: %s", flow_id, e)
+        return None
+
+
+def bump_flow_version(flow_id: str) -> Optional[int]:
+    """
+    Avança flows.version depois de uma escrita em flow_blocks fora do save_flow
+    (update_single_block, geração de blocos): o UPDATE também move flows.updated_at
+    pelo trigger, e o cache de outros processos para de servir o snapshot antigo.
+    """
+    try:
+        client = supabase_service._require_client()
+        resp = client.table("flows").select("version").eq("id", flow_id).limit(1).execute()
+        if not resp.data:
+            return None
+        new_version = int(resp.data[0].get("version") or 0) + 1
+        client.table("flows").update({"version": new_version}).eq("id", flow_id).execute()
+        return new_version
+    except Exception as e:
+        logger.warning("bump_flow_version: não foi possível avançar a versão do flow %s: %s", flow_id, e)
+        return None
+    finally:
+        flow_snapshot_cache.invalidate(flow_id)
+
+
+def _fetch_flow_snapshot(flow_id: str) -> Optional[FlowSnapshot]:
+    """
+    Carrega flow + blocos (com routes_data) + prompt_voz do assistente em UMA ida ao banco.
+    Usa a RPC get_flow_snapshot (supabase/CRIAR_FUNCAO_FLOW_SNAPSHOT.sql) com a tabela de
+    assistentes resolvida por assistant_schema; se a função ainda não existir, cai para um
+    SELECT com flow_blocks embutido + uma leitura do prompt_voz.
+    """
+    global _snapshot_rpc_available
+    client = supabase_service._require_client()
+    if _snapshot_rpc_available:
+        try:
+            params = {"p_flow_id": flow_id, "p_assistant_table": assistant_schema.table or "assistentes"}
+            resp = client.rpc("get_flow_snapshot", params).execute()
+            data = resp.data[0] if isinstance(resp.data, list) and resp.data else resp.data
+            if not data or not data.get("flow"):
+                return None
+            return FlowSnapshot(
+                flow=data["flow"],
+                blocks=_normalize_blocks(data.get("blocks") or []),
+                prompt_voz=data.get("prompt_voz"),
+            )
+        except Exception as e:
+            if _is_error_code(e, MISSING_FUNCTION_CODES):
+                _snapshot_rpc_available = False
+                logger.warning("load_flow_snapshot: RPC get_flow_snapshot não existe (%s). Usando SELECT embutido...", str(e)[:200])
+            else:
+                # Erro transitório (timeout, 5xx): só esta leitura usa o SELECT, a RPC continua ativa
+                logger.warning("load_flow_snapshot: RPC get_flow_snapshot falhou (%s). Usando SELECT embutido nesta leitura...", str(e)[:200])
+
+    try:
+        resp = (
+            client.table("flows")
+            .select("*, flow_blocks(*)")
+            .eq("id", flow_id)
+            .order("order_index", foreign_table="flow_blocks")
+            .limit(1)
+            .execute()
+        )
+        if not resp.data:
+            return None
+        flow = dict(resp.data[0])
+        blocks = flow.pop("flow_blocks", None) or []
+        prompt_voz = assistant_schema.get_prompt_voz(flow.get("assistente_id")) if flow.get("assistente_id") else None
+        return FlowSnapshot(flow=flow, blocks=_normalize_blocks(blocks), prompt_voz=prompt_voz)
+    except Exception as e:
+        logger.error("load_flow_snapshot: Erro ao carregar flow %s: %s", flow_id, e)
+        return None
+
+
+def refresh_schema() -> Dict[str, Any]:
+    """
+    Hook explícito para refazer a descoberta de schema: tabela/colunas de assistentes
+    e disponibilidade da RPC get_flow_snapshot (ex.: depois de aplicar uma migração).
+    """
+    global _snapshot_rpc_available
+    _snapshot_rpc_available = True
+    flow_snapshot_cache.clear()
+    table = assistant_schema.refresh()
+    return {"assistant_table": table, "assistant_columns": sorted(assistant_schema.columns)}
+
+
 def get_flow_routes(flow_id: str) -> List[Dict[str, Any]]:
     """
     ⚠️ DEPRECATED: Routes agora estão em routes_data (JSONB) dentro de flow_blocks.
@@ -180,13 +244,19 @@ def get_flow_routes(flow_id: str) -> List[Dict[str, Any]]:
 def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
     """
     Get flow with blocks and routes.
-    If flow has no blocks but prompt_base has block structure, automatically generate blocks.
+    If flow has no blocks (or is missing route blocks), enqueue a background job that
+    generates them (generate_blocks_for_flow) and return the current blocks with
+    generation_pending=True.
     """
-    flow = get_flow(flow_id)
-    if not flow:
+    # ⭐ Uma única ida ao banco: flow + blocos + prompt_voz do assistente
+    snapshot = load_flow_snapshot(flow_id)
+    if not snapshot:
         return None
     
-    blocks = get_flow_blocks(flow_id)
+    # Se este método escrever blocos/routes no banco, o snapshot em cache fica velho
+    blocks_written = False
+    flow = snapshot.flow
+    blocks = snapshot.blocks
     # ⚠️ DEPRECATED: routes agora estão em routes_data (JSONB) dentro de flow_blocks
     routes = []  # Não buscar mais de flow_routes separada
     
@@ -200,26 +270,8 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
             assistente_id = flow.get("assistente_id")
             tenant_id = flow.get("tenant_id")
             
-            # Buscar prompt_voz do assistente
-            prompt_to_parse = ""
-            if assistente_id:
-                try:
-                    client = supabase_service._require_client()
-                    table_names = ["assistentes", "assistents", "assistants"]
-                    for table_name in table_names:
-                        try:
-                            resp = client.table(table_name).select("prompt_voz").eq("id", assistente_id).limit(1).execute()
-                            if resp.data and resp.data[0].get("prompt_voz"):
-                                prompt_to_parse = resp.data[0].get("prompt_voz") or ""
-                                break
-                        except Exception:
-                            continue
-                except Exception as e:
-                    logger.warning("get_flow_complete: Erro ao buscar prompt_voz para gerar routes: %s", e)
-            
-            # Se não encontrou prompt_voz, usar prompt_base do flow
-            if not prompt_to_parse:
-                prompt_to_parse = flow.get("prompt_base") or ""
+            # prompt_voz do assistente (já veio no snapshot); fallback: prompt_base do flow
+            prompt_to_parse = snapshot.prompt_to_parse
             
             # Parsear apenas as routes do prompt
             if prompt_to_parse:
@@ -269,6 +321,7 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
                                         routes_by_block_key[block_key].append(route_data)
                                 
                                 # Atualizar routes_data em cada bloco
+                                blocks_written = True
                                 for block_key, routes_data in routes_by_block_key.items():
                                     client.table("flow_blocks").update({
                                         "routes_data": routes_data
@@ -283,56 +336,65 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
                 except Exception as e:
                     logger.error("get_flow_complete: Erro ao parsear prompt para gerar routes: %s", e)
     
-    # ⭐ VERIFICAR SE PRECISA USAR IA PARA ANALISAR PROMPT
-    # Usar IA se:
-    # 1. Não tem blocos OU
-    # 2. Tem blocos mas faltam blocos dentro de rotas OU  
-    # 3. Tem blocos de caminhos mas não têm routes_data completo
-    assistente_id = flow.get("assistente_id")
-    tenant_id = flow.get("tenant_id")
+    # prompt_voz do assistente (já veio no snapshot); fallback: prompt_base do flow
+    prompt_to_parse = snapshot.prompt_to_parse
     
-    # Buscar prompt_voz do assistente
-    prompt_to_parse = ""
-    if assistente_id:
+    # ⭐ VERIFICAR SE PRECISA USAR IA PARA ANALISAR PROMPT (ver _needs_ai_analysis)
+    # A análise pela IA roda como job em background (ai_jobs): o GET responde na hora
+    # com os blocos atuais e generation_pending=True enquanto o job não termina
+    generation_job = None
+    if prompt_to_parse and prompt_to_parse.strip() and _needs_ai_analysis(blocks, prompt_to_parse):
         try:
-            client = supabase_service._require_client()
-            table_names = ["assistentes", "assistents", "assistants", "assistente", "assistant"]
-            for table_name in table_names:
-                try:
-                    resp = client.table(table_name).select("prompt_voz").eq("id", assistente_id).limit(1).execute()
-                    if resp.data and len(resp.data) > 0 and resp.data[0].get("prompt_voz"):
-                        prompt_to_parse = resp.data[0].get("prompt_voz") or ""
-                        logger.info("get_flow_complete: ✅ Buscado prompt_voz do assistente %s (tabela: %s), length: %d", 
-                                   assistente_id, table_name, len(prompt_to_parse))
-                        break
-                except Exception:
-                    continue
-        except Exception as e:
-            logger.warning("get_flow_complete: Erro ao buscar prompt_voz: %s", e)
+            generation_job = ai_job_queue.submit(
+                flow_id, "generate_blocks", generate_blocks_for_flow, flow_id,
+                dedup_key=analysis_key(flow_id, prompt_to_parse),
+            )
+        except RuntimeError as e:
+            logger.warning("get_flow_complete: ⚠️ Não foi possível enfileirar geração de blocos: %s", e)
+    elif not blocks and not prompt_to_parse:
+        logger.warning("get_flow_complete: Flow %s não tem prompt_base nem prompt_voz para gerar blocos", flow_id)
     
-    # Se não encontrou prompt_voz, usar prompt_base do flow como fallback
-    if not prompt_to_parse or not prompt_to_parse.strip():
-        prompt_to_parse = flow.get("prompt_base") or ""
-        if prompt_to_parse:
-            logger.info("get_flow_complete: Usando prompt_base do flow como fallback, length: %d", len(prompt_to_parse))
+    if blocks_written:
+        bump_flow_version(flow_id)
     
-    # ⭐ SEMPRE USAR IA SE NÃO HÁ BLOCOS (primeira vez)
-    # Depois, usar ordem salva do banco
+    # ⭐ NOVO: Routes agora estão em routes_data (JSONB) dentro de flow_blocks
+    return {
+        "flow": flow,
+        "blocks": blocks,  # Já contém routes_data para blocos de caminhos
+        "routes": [],  # ⚠️ DEPRECATED: routes agora em routes_data dos blocos
+        "generation_pending": generation_job is not None,
+        "generation_job_id": generation_job.id if generation_job else None,
+    }
+
+
+def _needs_ai_analysis(blocks: List[Dict[str, Any]], prompt_to_parse: str) -> bool:
+    """
+    Usar IA se:
+    1. Não tem blocos (primeira vez) OU
+    2. Uma rota aponta para um bloco que não existe (blocos dentro de rotas faltando) OU
+    3. Tem blocos de caminhos mas não têm routes_data completo
+    parentRouterId não é gravado em flow_blocks, então não serve para detectar (2):
+    com ele, todo flow com CAMINHOS e "Depois:" era reanalisado a cada abertura.
+    """
     needs_ai_analysis = False
     if not blocks:
         needs_ai_analysis = True
         logger.info("get_flow_complete: ⚠️ Não há blocos. Usando IA para analisar prompt e gerar blocos automaticamente...")
     else:
-        # Verificar se há blocos dentro de rotas faltando
-        blocks_with_parent = [b for b in blocks if b.get("parentRouterId") or b.get("parent_router_id")]
         caminhos_blocks = [b for b in blocks if b.get("block_type") == "caminhos"]
+        block_keys = {b.get("block_key") for b in blocks}
         
-        # Se tem blocos de caminhos mas não tem blocos dentro de rotas, pode estar faltando
-        if caminhos_blocks and len(blocks_with_parent) == 0:
-            # Verificar no prompt se há blocos dentro de rotas
-            if prompt_to_parse and ("Depois:" in prompt_to_parse or "Va para" in prompt_to_parse):
-                needs_ai_analysis = True
-                logger.info("get_flow_complete: ⚠️ Blocos de caminhos existem mas não há blocos dentro de rotas. Usando IA para analisar...")
+        # Destinos de rotas que não existem como bloco: faltam blocos dentro de rotas
+        missing = sorted({
+            route.get("destination_block_key")
+            for caminhos_block in caminhos_blocks
+            for route in (caminhos_block.get("routes_data") or [])
+            if isinstance(route, dict) and route.get("destination_block_key")
+            and route.get("destination_block_key") not in block_keys
+        })
+        if missing:
+            needs_ai_analysis = True
+            logger.info("get_flow_complete: ⚠️ Rotas apontam para blocos inexistentes (%s). Usando IA para analisar...", ", ".join(missing))
         
         # Verificar se routes_data está completo
         for caminhos_block in caminhos_blocks:
@@ -341,15 +403,93 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
                 needs_ai_analysis = True
                 logger.info("get_flow_complete: ⚠️ Bloco %s não tem routes_data completo. Usando IA para analisar...", caminhos_block.get("block_key"))
                 break
+    return needs_ai_analysis
+
+
+def analysis_key(flow_id: str, prompt: str) -> Tuple[str, str]:
+    """Chave de deduplicação de análises: (flow_id, sha256 do prompt)."""
+    return flow_id, hashlib.sha256((prompt or "").encode("utf-8")).hexdigest()
+
+
+def generate_blocks_for_flow(flow_id: str, report: Optional[Callable[[int, str], None]] = None) -> Dict[str, Any]:
+    """
+    Gera/atualiza os blocos do flow a partir do prompt: IA primeiro, parser como fallback.
+    Roda como job em background (ai_jobs), fora do GET; report(progresso, etapa) informa o andamento.
+    Chamadas concorrentes para o mesmo flow + prompt esperam a análise em andamento
+    (ai_analysis_flight) e recebem o mesmo resultado. Se flows.version mudar durante
+    a análise (save no editor), nada é gravado e o resultado vem com "skipped".
+    """
+    report = report or (lambda progress, stage: None)
+    snapshot = load_flow_snapshot(flow_id, use_cache=False)
+    if not snapshot:
+        raise ValueError(f"Flow {flow_id} não encontrado")
+    key = analysis_key(flow_id, snapshot.prompt_to_parse)
+    return ai_analysis_flight.do(key, _generate_blocks_from_snapshot, snapshot, report)
+
+
+def _flow_changed_since(snapshot: FlowSnapshot) -> bool:
+    """
+    flows.version mudou desde o snapshot? A análise leva segundos e roda em background:
+    se o editor salvou nesse meio-tempo, os blocos gerados não podem sobrescrever o que
+    foi salvo. Sem conseguir ler a versão, conta como mudado (não grava às cegas).
+    """
+    stamp = _fetch_flow_stamp(snapshot.flow_id)
+    return stamp is None or stamp[0] != snapshot.version
+
+
+def _stale_generation_result(snapshot: FlowSnapshot, analysis_stats: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    logger.warning(
+        "generate_blocks_for_flow: ⚠️ Flow %s mudou durante a análise (version %d no snapshot); blocos gerados descartados",
+        snapshot.flow_id, snapshot.version,
+    )
+    return {
+        "blocks": len(snapshot.blocks),
+        "source": None,
+        "analysis": analysis_stats,
+        "ai_error": (analysis_stats or {}).get("ai_error"),
+        "skipped": "flow alterado durante a análise",
+    }
+
+
+def _analysis_source(stats: Dict[str, Any]) -> str:
+    """
+    Quem de fato produziu os blocos da análise híbrida: "parser", "ai" ou "mixed"
+    (parte pelo parser, inclusive trechos em que a IA falhou e o parser assumiu).
+    """
+    ai_sections = stats.get("ai_sections", 0) - stats.get("ai_fallback_sections", 0)
+    parser_sections = stats.get("sections", 0) - ai_sections
+    if ai_sections <= 0:
+        return "parser"
+    return "mixed" if parser_sections > 0 else "ai"
+
+
+def _generate_blocks_from_snapshot(snapshot: FlowSnapshot, report: Callable[[int, str], None]) -> Dict[str, Any]:
+    flow_id = snapshot.flow_id
+    flow = snapshot.flow
+    blocks = snapshot.blocks
+    routes = []  # ⚠️ DEPRECATED: routes agora em routes_data
+    assistente_id = flow.get("assistente_id")
+    tenant_id = flow.get("tenant_id")
+    prompt_to_parse = snapshot.prompt_to_parse
+    blocks_written = False
+    source = None
     
-    # ⭐ USAR IA PARA ANALISAR PROMPT E CRIAR/ATUALIZAR BLOCOS
-    if needs_ai_analysis and prompt_to_parse and prompt_to_parse.strip():
+    analysis_stats = None
+    report(10, "analisando prompt (parser + IA)")
+    # ⭐ ANÁLISE HÍBRIDA: parser nas seções marcadas, IA só nas ambíguas (hybrid_flow_analyzer)
+    if prompt_to_parse and prompt_to_parse.strip():
         try:
-            logger.info("get_flow_complete: 🤖 Chamando IA para analisar prompt completo...")
-            ai_blocks = analyze_prompt_with_ai(prompt_to_parse, provider="openai")
+            logger.info("generate_blocks_for_flow: 🤖 Analisando prompt (parser primeiro, IA nas seções ambíguas)...")
+            ai_blocks, analysis_stats = analyze_prompt_hybrid(
+                prompt_to_parse, provider="openai", tenant_id=tenant_id, flow_id=flow_id
+            )
+            report(60, "gravando blocos gerados")
             
+            if ai_blocks and _flow_changed_since(snapshot):
+                return _stale_generation_result(snapshot, analysis_stats)
             if ai_blocks and len(ai_blocks) > 0:
-                logger.info("get_flow_complete: ✅ IA retornou %d blocos. Criando/atualizando no banco...", len(ai_blocks))
+                logger.info("generate_blocks_for_flow: ✅ Análise retornou %d blocos (%d seções pela IA). Criando/atualizando no banco...",
+                            len(ai_blocks), analysis_stats["ai_sections"])
                 
                 client = supabase_service._require_client()
                 
@@ -357,10 +497,11 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
                 existing_blocks_map = {b.get("block_key"): b for b in blocks if b.get("block_key")}
                 
                 # Processar blocos da IA
+                blocks_written = True
                 for ai_block in ai_blocks:
                     block_key = ai_block.get("block_key")
                     if not block_key:
-                        logger.warning("get_flow_complete: ⚠️ Bloco da IA sem block_key, pulando...")
+                        logger.warning("generate_blocks_for_flow: ⚠️ Bloco da IA sem block_key, pulando...")
                         continue
                     
                     # Preparar dados do bloco
@@ -395,19 +536,20 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
                     
                     if existing_block:
                         # Atualizar bloco existente
-                        logger.info("get_flow_complete: 📝 Atualizando bloco existente %s", block_key)
+                        logger.info("generate_blocks_for_flow: 📝 Atualizando bloco existente %s", block_key)
                         client.table("flow_blocks").update(block_data).eq("id", existing_block.get("id")).execute()
                     else:
                         # Criar novo bloco
-                        logger.info("get_flow_complete: ➕ Criando novo bloco %s", block_key)
+                        logger.info("generate_blocks_for_flow: ➕ Criando novo bloco %s", block_key)
                         client.table("flow_blocks").insert(block_data).execute()
                 
                 # Buscar blocos atualizados
+                source = _analysis_source(analysis_stats)
                 blocks = get_flow_blocks(flow_id)
-                logger.info("get_flow_complete: ✅ Blocos criados/atualizados pela IA. Total: %d", len(blocks))
+                logger.info("generate_blocks_for_flow: ✅ Blocos criados/atualizados pela IA. Total: %d", len(blocks))
                 
         except Exception as e:
-            logger.error("get_flow_complete: ❌ Erro ao usar IA para analisar prompt: %s", e)
+            logger.error("generate_blocks_for_flow: ❌ Erro ao usar IA para analisar prompt: %s", e)
             import traceback
             logger.error("Traceback: %s", traceback.format_exc())
             # Continuar com parser normal como fallback
@@ -420,31 +562,36 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
             re.search(r'(PM|AG|CAM|MSG|ENC|FER)\d+', prompt_to_parse, re.IGNORECASE)
         )
         
-        logger.info("get_flow_complete: Flow %s - prompt_to_parse length: %d, has_block_structure: %s", 
+        logger.info("generate_blocks_for_flow: Flow %s - prompt_to_parse length: %d, has_block_structure: %s", 
                    flow_id, len(prompt_to_parse), has_block_structure)
         
         if has_block_structure:
-            logger.info("get_flow_complete: Flow %s não tem blocos mas prompt tem estrutura. Gerando blocos automaticamente...", flow_id)
-            logger.info("get_flow_complete: Preview do prompt: %s", prompt_to_parse[:200] + "..." if len(prompt_to_parse) > 200 else prompt_to_parse)
+            report(70, "gerando blocos pelo parser")
+            source = "parser"
+            logger.info("generate_blocks_for_flow: Flow %s não tem blocos mas prompt tem estrutura. Gerando blocos automaticamente...", flow_id)
+            logger.info("generate_blocks_for_flow: Preview do prompt: %s", prompt_to_parse[:200] + "..." if len(prompt_to_parse) > 200 else prompt_to_parse)
             
             try:
                 # Parse do prompt para gerar blocos e rotas
-                logger.info("get_flow_complete: Chamando parse_prompt_base_to_blocks com prompt de %d caracteres", len(prompt_to_parse))
+                logger.info("generate_blocks_for_flow: Chamando parse_prompt_base_to_blocks com prompt de %d caracteres", len(prompt_to_parse))
                 parsed_blocks, parsed_routes = parse_prompt_base_to_blocks(
                     prompt_to_parse, flow_id, assistente_id, tenant_id
                 )
                 
-                logger.info("get_flow_complete: Parser retornou %d blocos e %d rotas", len(parsed_blocks), len(parsed_routes))
+                logger.info("generate_blocks_for_flow: Parser retornou %d blocos e %d rotas", len(parsed_blocks), len(parsed_routes))
                 
+                if parsed_blocks and _flow_changed_since(snapshot):
+                    return _stale_generation_result(snapshot, analysis_stats)
                 if parsed_blocks:
                     client = supabase_service._require_client()
+                    blocks_written = True
                     
                     # ⚠️ NOTA: Se der timeout, desabilite o trigger manualmente:
                     # ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change;
-                    logger.info("get_flow_complete: ⚠️ Se der timeout, execute no Supabase: ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change;")
+                    logger.info("generate_blocks_for_flow: ⚠️ Se der timeout, execute no Supabase: ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change;")
                     
                     # Inserir blocos em lotes menores para evitar timeout
-                    logger.info("get_flow_complete: Inserindo %d blocos em lotes de 3...", len(parsed_blocks))
+                    logger.info("generate_blocks_for_flow: Inserindo %d blocos em lotes de 3...", len(parsed_blocks))
                     block_key_to_id = {}
                     
                     # Simplificar blocos antes de inserir (remover campos que podem causar problema)
@@ -476,25 +623,25 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
                         batch = simplified_blocks[i:i + batch_size]
                         try:
                             result = client.table("flow_blocks").insert(batch).execute()
-                            logger.info("get_flow_complete: ✅ Lote %d-%d inserido (%d blocos)", i+1, min(i+batch_size, len(simplified_blocks)), len(batch))
+                            logger.info("generate_blocks_for_flow: ✅ Lote %d-%d inserido (%d blocos)", i+1, min(i+batch_size, len(simplified_blocks)), len(batch))
                         except Exception as e:
-                            logger.error("get_flow_complete: Erro ao inserir lote %d-%d: %s", i+1, min(i+batch_size, len(simplified_blocks)), str(e)[:200])
+                            logger.error("generate_blocks_for_flow: Erro ao inserir lote %d-%d: %s", i+1, min(i+batch_size, len(simplified_blocks)), str(e)[:200])
                             # Tentar inserir um por um neste lote
                             for single_block in batch:
                                 try:
                                     client.table("flow_blocks").insert([single_block]).execute()
-                                    logger.info("get_flow_complete: ✅ Bloco %s inserido individualmente", single_block.get("block_key"))
+                                    logger.info("generate_blocks_for_flow: ✅ Bloco %s inserido individualmente", single_block.get("block_key"))
                                 except Exception as e2:
-                                    logger.error("get_flow_complete: ❌ Erro ao inserir bloco %s: %s", single_block.get("block_key"), str(e2)[:200])
+                                    logger.error("generate_blocks_for_flow: ❌ Erro ao inserir bloco %s: %s", single_block.get("block_key"), str(e2)[:200])
                             continue
                     
                     # Buscar blocos inseridos para mapear block_key -> id
                     try:
                         resp = client.table("flow_blocks").select("id, block_key").eq("flow_id", flow_id).execute()
                         block_key_to_id = {row["block_key"]: row["id"] for row in (resp.data or [])}
-                        logger.info("get_flow_complete: ✅ %d blocos mapeados com sucesso", len(block_key_to_id))
+                        logger.info("generate_blocks_for_flow: ✅ %d blocos mapeados com sucesso", len(block_key_to_id))
                     except Exception as e:
-                        logger.error("get_flow_complete: Erro ao buscar blocos inseridos: %s", e)
+                        logger.error("generate_blocks_for_flow: Erro ao buscar blocos inseridos: %s", e)
                         block_key_to_id = {}
                     
                     # Atualizar rotas com block_id correto e inserir
@@ -542,46 +689,49 @@ def get_flow_complete(flow_id: str) -> Optional[Dict[str, Any]]:
                     routes = []  # ⚠️ DEPRECATED: routes agora em routes_data
                     
                     if blocks:
-                        logger.info("✅ get_flow_complete: Gerados %d blocos e %d rotas automaticamente", len(blocks), len(routes))
+                        logger.info("✅ generate_blocks_for_flow: Gerados %d blocos e %d rotas automaticamente", len(blocks), len(routes))
                     else:
-                        logger.warning("⚠️ get_flow_complete: Nenhum bloco foi inserido (pode ter dado timeout). Tentando inserir novamente em lotes menores...")
+                        logger.warning("⚠️ generate_blocks_for_flow: Nenhum bloco foi inserido (pode ter dado timeout). Tentando inserir novamente em lotes menores...")
                         # Tentar inserir um bloco por vez como último recurso
                         for block in parsed_blocks[:3]:  # Apenas os primeiros 3 para não travar
                             try:
                                 client.table("flow_blocks").insert([block]).execute()
-                                logger.info("get_flow_complete: ✅ Bloco %s inserido individualmente", block.get("block_key"))
+                                logger.info("generate_blocks_for_flow: ✅ Bloco %s inserido individualmente", block.get("block_key"))
                             except Exception as e:
-                                logger.error("get_flow_complete: Erro ao inserir bloco %s: %s", block.get("block_key"), e)
+                                logger.error("generate_blocks_for_flow: Erro ao inserir bloco %s: %s", block.get("block_key"), e)
                         
                         # Buscar novamente
                         blocks = get_flow_blocks(flow_id)
                         routes = get_flow_routes(flow_id)
                         if blocks:
-                            logger.info("✅ get_flow_complete: %d blocos inseridos após retry", len(blocks))
+                            logger.info("✅ generate_blocks_for_flow: %d blocos inseridos após retry", len(blocks))
             except Exception as e:
-                logger.error("get_flow_complete: Erro ao gerar blocos automaticamente: %s", e)
+                logger.error("generate_blocks_for_flow: Erro ao gerar blocos automaticamente: %s", e)
                 import traceback
                 logger.debug("Traceback: %s", traceback.format_exc())
                 # Buscar blocos mesmo se deu erro (pode ter inserido alguns)
                 blocks = get_flow_blocks(flow_id)
                 routes = []  # ⚠️ DEPRECATED: routes agora em routes_data
                 if blocks:
-                    logger.info("get_flow_complete: Encontrados %d blocos após erro (alguns podem ter sido inseridos)", len(blocks))
+                    logger.info("generate_blocks_for_flow: Encontrados %d blocos após erro (alguns podem ter sido inseridos)", len(blocks))
         elif prompt_to_parse and not has_block_structure:
-            logger.warning("get_flow_complete: Flow %s tem prompt (%d chars) mas NÃO tem estrutura de blocos detectada. Regex: %s", 
+            logger.warning("generate_blocks_for_flow: Flow %s tem prompt (%d chars) mas NÃO tem estrutura de blocos detectada. Regex: %s", 
                           flow_id, len(prompt_to_parse), r'\[(PM|AG|CAM|MSG|ENC|FER)\d+\]')
             # Tentar buscar blocos de outras formas (ex: ### ENCERRAR [ENC001])
             alt_pattern = re.search(r'(PM\d+|AG\d+|CAM\d+|MSG\d+|ENC\d+|FER\d+)', prompt_to_parse)
             if alt_pattern:
-                logger.info("get_flow_complete: Encontrado padrão alternativo: %s", alt_pattern.group())
+                logger.info("generate_blocks_for_flow: Encontrado padrão alternativo: %s", alt_pattern.group())
         elif not prompt_to_parse:
-            logger.warning("get_flow_complete: Flow %s não tem prompt_base nem prompt_voz para gerar blocos", flow_id)
+            logger.warning("generate_blocks_for_flow: Flow %s não tem prompt_base nem prompt_voz para gerar blocos", flow_id)
     
-    # ⭐ NOVO: Routes agora estão em routes_data (JSONB) dentro de flow_blocks
+    if blocks_written:
+        bump_flow_version(flow_id)
+    # ai_error: motivo da falha da IA (timeout, circuito aberto...) quando os blocos vieram só do parser
     return {
-        "flow": flow,
-        "blocks": blocks,  # Já contém routes_data para blocos de caminhos
-        "routes": [],  # ⚠️ DEPRECATED: routes agora em routes_data dos blocos
+        "blocks": len(blocks),
+        "source": source,
+        "analysis": analysis_stats,
+        "ai_error": (analysis_stats or {}).get("ai_error"),
     }
 
 
@@ -657,16 +807,111 @@ def update_flow(flow_id: str, data: Dict[str, Any]) -> bool:
     except Exception as e:
         logger.error("update_flow: Erro ao atualizar flow %s: %s", flow_id, e)
         return False
+    finally:
+        flow_snapshot_cache.invalidate(flow_id)
+
+
+def block_content_hash(block: Dict[str, Any]) -> str:
+    """
+    Hash estável (sha256) do conteúdo editável de um bloco.
+    Normaliza ausente/None/vazio e tipos numéricos para que o mesmo bloco sempre
+    gere o mesmo hash, venha ele do payload do editor ou de uma linha do banco.
+    """
+    normalized = {}
+    for field in HASHED_BLOCK_FIELDS:
+        value = block.get(field)
+        if field in ("tool_config", "end_metadata"):
+            value = value if isinstance(value, dict) else {}
+        elif field == "routes_data":
+            value = value if isinstance(value, list) else []
+        elif field == "order_index":
+            value = int(value or 0)
+        elif field in ("position_x", "position_y"):
+            value = float(value or 0)
+        elif field == "content":
+            value = value or ""
+        elif value == "":
+            value = None
+        normalized[field] = value
+    encoded = json.dumps(normalized, sort_keys=True, separators=(",", ":"), ensure_ascii=False, default=str)
+    return hashlib.sha256(encoded.encode("utf-8")).hexdigest()
+
+
+def _select_existing_blocks(client, flow_id: str) -> List[Dict[str, Any]]:
+    """id, block_key e (se a coluna existir) content_hash dos blocos salvos do flow."""
+    global _content_hash_available
+    if _content_hash_available:
+        try:
+            resp = client.table("flow_blocks").select("id, block_key, content_hash").eq("flow_id", flow_id).execute()
+            return resp.data or []
+        except Exception as e:
+            if _is_error_code(e, MISSING_COLUMN_CODES):
+                _content_hash_available = False
+                logger.warning("save_flow: coluna content_hash indisponível (%s). Salvando todos os blocos; "
+                               "execute supabase/ADICIONAR_CONTENT_HASH_FLOW_BLOCKS.sql", str(e)[:200])
+            else:
+                # Erro transitório: só este save grava todos os blocos, o content_hash continua ativo
+                logger.warning("save_flow: leitura do content_hash falhou (%s). Salvando todos os blocos neste save", str(e)[:200])
+    resp = client.table("flow_blocks").select("id, block_key").eq("flow_id", flow_id).execute()
+    return resp.data or []
+
+
+def _upsert_blocks_in_batches(
+    client, rows: List[Dict[str, Any]], batch_size: int
+) -> Tuple[Dict[str, str], List[Dict[str, Any]], List[str]]:
+    """
+    Upsert de flow_blocks em lotes com on_conflict=(flow_id, block_key).
+
+    Linhas só vão no mesmo lote se tiverem as mesmas colunas: num upsert em lote o
+    PostgREST gravaria NULL nas colunas ausentes, e uma linha sem routes_data apagaria
+    o routes_data salvo. Se um lote falhar (ex.: statement timeout), ele é dividido ao
+    meio até chegar a um bloco por vez.
+
+    Retorna (block_key -> id, tempo por lote, block_keys que não foram salvos).
+    """
+    groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+    for row in rows:
+        groups.setdefault(tuple(sorted(row)), []).append(row)
+
+    pending: List[List[Dict[str, Any]]] = []
+    for group_rows in groups.values():
+        for i in range(0, len(group_rows), batch_size):
+            pending.append(group_rows[i:i + batch_size])
+
+    saved: Dict[str, str] = {}
+    stats: List[Dict[str, Any]] = []
+    failed: List[str] = []
+    while pending:
+        batch = pending.pop(0)
+        t0 = time.perf_counter()
+        try:
+            resp = client.table("flow_blocks").upsert(batch, on_conflict="flow_id,block_key").execute()
+            elapsed_ms = round((time.perf_counter() - t0) * 1000, 1)
+            for saved_row in resp.data or []:
+                saved[saved_row["block_key"]] = saved_row["id"]
+            stats.append({"size": len(batch), "ms": elapsed_ms, "ok": True})
+            logger.info("save_flow: ✅ Lote %d (%d blocos) salvo em %.1f ms", len(stats), len(batch), elapsed_ms)
+        except Exception as e:
+            elapsed_ms = round((time.perf_counter() - t0) * 1000, 1)
+            stats.append({"size": len(batch), "ms": elapsed_ms, "ok": False})
+            logger.error("save_flow: ❌ Lote %d (%d blocos) falhou em %.1f ms: %s", len(stats), len(batch), elapsed_ms, str(e)[:200])
+            if len(batch) > 1:
+                half = len(batch) // 2
+                pending[:0] = [batch[:half], batch[half:]]
+            else:
+                failed.append(batch[0]["block_key"])
+    return saved, stats, failed
 
 
 def save_flow(payload) -> Dict[str, Any]:
     """
     Save flow blocks and routes.
     
-    ESTRATÉGIA SEGURA: INSERT primeiro, DELETE depois (evita perda de dados se inserção falhar).
-    - Insere blocos em lotes pequenos (2 por vez) para evitar timeout
-    - Só deleta blocos antigos após inserção bem-sucedida
-    - Incrementa version do flow
+    ESTRATÉGIA SEGURA: UPSERT primeiro, DELETE depois (evita perda de dados se a escrita falhar).
+    - Upsert em lotes (FLOW_SAVE_BATCH_SIZE) com on_conflict=(flow_id, block_key)
+    - Só deleta os block_keys removidos (uma chamada com in_) após o upsert
+    - Pula blocos cujo content_hash não mudou (devolve "written" e "skipped")
+    - Incrementa version do flow (se algo mudou) e devolve o tempo de cada lote em "batches"
     
     ⚠️ IMPORTANTE: Desabilite o trigger antes de salvar:
     ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change;
@@ -698,8 +943,8 @@ def save_flow(payload) -> Dict[str, Any]:
             return {"success": False, "version": current_version, "error": "Nenhum bloco recebido. Não foi possível salvar."}
         
         # Verificar quantos blocos existem atualmente no banco
-        existing_blocks_resp = client.table("flow_blocks").select("block_key").eq("flow_id", flow_id).execute()
-        existing_count = len(existing_blocks_resp.data or [])
+        existing_rows = _select_existing_blocks(client, flow_id)
+        existing_count = len(existing_rows)
         logger.info("save_flow: 📊 Blocos existentes no banco: %d | Blocos recebidos: %d", existing_count, len(blocks))
         
         # Se tinha blocos e recebeu menos, avisar mas continuar (pode ser edição parcial)
@@ -718,7 +963,7 @@ def save_flow(payload) -> Dict[str, Any]:
         
         # Listar block_keys recebidos vs existentes
         received_keys = {b.block_key for b in blocks}
-        existing_keys = {row["block_key"] for row in (existing_blocks_resp.data or [])}
+        existing_keys = {row["block_key"] for row in existing_rows}
         missing_keys = existing_keys - received_keys
         if missing_keys:
             logger.warning("save_flow: ⚠️ Blocos que existem mas NÃO foram recebidos: %s", list(missing_keys))
@@ -727,6 +972,10 @@ def save_flow(payload) -> Dict[str, Any]:
         # Isso evita perda de dados se a inserção falhar
         
         block_key_to_id: Dict[str, str] = {}
+        batch_stats: List[Dict[str, Any]] = []
+        written_count = 0
+        skipped_keys: List[str] = []
+        deleted_count = 0
         if blocks:
             # Log detalhado
             logger.info("save_flow: Recebidos %d blocos para salvar", len(blocks))
@@ -819,165 +1068,66 @@ def save_flow(payload) -> Dict[str, Any]:
                     logger.info("save_flow:   - assistente_id: %s", row.get("assistente_id"))
                     logger.info("save_flow:   - tenant_id: %s", row.get("tenant_id"))
             
-            # ⚡ MÉTODO SIMPLES E DIRETO: Usar UPSERT (UPDATE ou INSERT) para cada bloco
-            # Sem comparações complexas, sem verificação de mudanças - apenas salva o que recebeu
-            logger.info("save_flow: 📥 Salvando %d blocos usando método simples (UPSERT)...", len(rows))
-            
-            inserted_keys = set()
-            updated_keys = set()
-            
-            # Processar cada bloco individualmente - método simples e direto
             for row in rows:
-                block_key = row.get("block_key")
-                if not block_key:
-                    logger.error("save_flow: ❌ Bloco sem block_key! Pulando...")
-                    continue
-                
-                # Validar dados básicos
                 if "tool_config" in row and not isinstance(row["tool_config"], dict):
                     row["tool_config"] = {}
                 if "end_metadata" in row and not isinstance(row["end_metadata"], dict):
                     row["end_metadata"] = {}
-                
-                try:
-                    # Tentar UPDATE primeiro (se existe, atualiza; se não existe, falha silenciosamente)
-                    update_result = client.table("flow_blocks").update(row).eq("flow_id", flow_id).eq("block_key", block_key).execute()
-                    
-                    if update_result.data and len(update_result.data) > 0:
-                        # UPDATE funcionou - bloco existia
-                        updated_keys.add(block_key)
-                        block_key_to_id[block_key] = update_result.data[0]["id"]
-                        logger.info("save_flow: ✅ Bloco %s atualizado", block_key)
-                    else:
-                        # UPDATE não retornou dados - pode não existir, tentar INSERT
-                        logger.info("save_flow: ➕ Bloco %s não existe, inserindo...", block_key)
-                        insert_result = client.table("flow_blocks").insert([row]).execute()
-                        
-                        if insert_result.data and len(insert_result.data) > 0:
-                            inserted_keys.add(block_key)
-                            block_key_to_id[block_key] = insert_result.data[0]["id"]
-                            logger.info("save_flow: ✅ Bloco %s inserido", block_key)
-                        else:
-                            # Verificar se foi inserido mesmo sem retorno
-                            check_resp = client.table("flow_blocks").select("id").eq("flow_id", flow_id).eq("block_key", block_key).limit(1).execute()
-                            if check_resp.data:
-                                block_key_to_id[block_key] = check_resp.data[0]["id"]
-                                inserted_keys.add(block_key)
-                                logger.info("save_flow: ✅ Bloco %s confirmado no banco", block_key)
-                            else:
-                                logger.warning("save_flow: ⚠️ Bloco %s não foi inserido nem atualizado", block_key)
-                                
-                except Exception as e:
-                    error_str = str(e)
-                    logger.error("save_flow: ❌ Erro ao salvar bloco %s: %s", block_key, error_str[:200])
-                    
-                    # Se for erro de duplicata no INSERT, tentar UPDATE novamente
-                    if "duplicate" in error_str.lower() or "unique" in error_str.lower() or "23505" in error_str:
-                        try:
-                            update_retry = client.table("flow_blocks").update(row).eq("flow_id", flow_id).eq("block_key", block_key).execute()
-                            if update_retry.data:
-                                updated_keys.add(block_key)
-                                block_key_to_id[block_key] = update_retry.data[0]["id"]
-                                logger.info("save_flow: ✅ Bloco %s atualizado após erro de duplicata", block_key)
-                        except Exception as e2:
-                            logger.error("save_flow: ❌ Erro ao fazer UPDATE após duplicata: %s", str(e2)[:200])
             
-            # Resumo do que foi salvo
-            total_saved = len(inserted_keys) + len(updated_keys)
-            logger.info("save_flow: 📊 Resumo: %d blocos inseridos, %d blocos atualizados, total processado: %d", 
-                       len(inserted_keys), len(updated_keys), total_saved)
+            # 🔍 DETECÇÃO DE MUDANÇAS: só escreve blocos cujo content_hash mudou
+            rows_to_write = rows
+            if _content_hash_available:
+                stored = {r["block_key"]: r for r in existing_rows}
+                rows_to_write = []
+                for row in rows:
+                    row["content_hash"] = block_content_hash(row)
+                    stored_row = stored.get(row["block_key"])
+                    if stored_row and stored_row.get("content_hash") == row["content_hash"]:
+                        skipped_keys.append(row["block_key"])
+                        block_key_to_id[row["block_key"]] = stored_row["id"]
+                    else:
+                        rows_to_write.append(row)
+                logger.info("save_flow: 🔍 %d blocos alterados, %d sem mudança (pulados)", len(rows_to_write), len(skipped_keys))
             
-            if updated_keys:
-                logger.info("save_flow: ✅ Blocos atualizados: %s", list(updated_keys)[:10])
-            if inserted_keys:
-                logger.info("save_flow: ✅ Blocos inseridos: %s", list(inserted_keys)[:10])
+            # ⚡ UPSERT EM LOTES: on_conflict=(flow_id, block_key), poucas idas ao banco
+            batch_size = settings.FLOW_SAVE_BATCH_SIZE
+            failed_keys: List[str] = []
+            if rows_to_write:
+                logger.info("save_flow: 📥 Salvando %d blocos via upsert em lotes de até %d...", len(rows_to_write), batch_size)
+                saved_ids, batch_stats, failed_keys = _upsert_blocks_in_batches(client, rows_to_write, batch_size)
+                block_key_to_id.update(saved_ids)
+                written_count = len(saved_ids)
+                total_ms = sum(stat["ms"] for stat in batch_stats)
+                logger.info("save_flow: 📊 %d blocos salvos em %d lotes (%.1f ms no total)", written_count, len(batch_stats), total_ms)
             
-            # Verificar quantos blocos foram realmente salvos
-            if not block_key_to_id or len(block_key_to_id) == 0:
-                logger.error("save_flow: ❌ NENHUM bloco foi inserido após todas as tentativas!")
-                logger.error("save_flow: 📊 Resumo: Tentamos inserir %d blocos, mas nenhum foi inserido com sucesso.", len(blocks))
-                logger.error("save_flow: 🔍 Possíveis causas:")
-                logger.error("save_flow:   1. ⚠️ TRIGGER AINDA ESTÁ ATIVO!")
-                logger.error("save_flow:      Execute no Supabase: ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change;")
-                logger.error("save_flow:   2. Erro de constraint (UNIQUE ou FOREIGN KEY)")
-                logger.error("save_flow:   3. Campos obrigatórios faltando (content, block_key, block_type)")
-                logger.error("save_flow:   4. Timeout do banco de dados")
-                logger.error("save_flow: 💡 Verifique os logs acima para ver os erros específicos de cada tentativa de inserção.")
-                logger.error("save_flow: 📋 Execute o script: supabase/CORRIGIR_AGORA.sql")
+            if not block_key_to_id:
+                logger.error("save_flow: ❌ NENHUM bloco foi salvo! Blocos com falha: %s", failed_keys[:10])
+                logger.error("save_flow: 💡 Se for statement timeout, execute no Supabase: ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change;")
                 return {
                     "success": False, 
                     "version": current_version, 
-                    "error": "Erro ao inserir blocos. Nenhum bloco foi salvo. Os blocos antigos foram preservados. ⚠️ IMPORTANTE: Execute no Supabase SQL Editor: ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change; Verifique os logs do servidor para detalhes."
+                    "error": "Erro ao salvar blocos. Nenhum bloco foi salvo. Os blocos antigos foram preservados. ⚠️ IMPORTANTE: Execute no Supabase SQL Editor: ALTER TABLE flow_blocks DISABLE TRIGGER trigger_sync_prompt_voz_on_block_change; Verifique os logs do servidor para detalhes.",
+                    "batches": batch_stats,
                 }
             
-            if len(block_key_to_id) < len(blocks):
-                missing = [b.block_key for b in blocks if b.block_key not in block_key_to_id]
-                logger.warning("save_flow: ⚠️ Apenas %d de %d blocos foram inseridos. Blocos faltando: %s", 
-                             len(block_key_to_id), len(blocks), missing)
-                # Continuar mesmo assim, mas avisar
-            
-            logger.info("save_flow: ✅ %d blocos inseridos com sucesso. Agora deletando blocos antigos que não estão na lista nova...", len(block_key_to_id))
-            
-            # Agora que inserimos com sucesso, limpar duplicatas e deletar blocos antigos que não estão na lista nova
-            new_block_keys = {b.block_key for b in blocks}
-            try:
-                # Buscar todos os blocos do flow (pode haver duplicatas temporárias)
-                all_blocks_resp = client.table("flow_blocks").select("id, block_key, created_at").eq("flow_id", flow_id).order("created_at", desc=True).execute()
-                all_blocks = all_blocks_resp.data or []
-                
-                # Agrupar por block_key e manter apenas o mais recente (deletar duplicatas antigas)
-                seen_keys = {}
-                duplicate_ids_to_delete = []
-                for block in all_blocks:
-                    key = block["block_key"]
-                    if key in seen_keys:
-                        # Este é uma duplicata, marcar para deletar
-                        duplicate_ids_to_delete.append(block["id"])
-                    else:
-                        seen_keys[key] = block["id"]
-                
-                # Deletar duplicatas
-                if duplicate_ids_to_delete:
-                    logger.info("save_flow: 🗑️ Deletando %d blocos duplicados", len(duplicate_ids_to_delete))
-                    client.table("flow_blocks").delete().in_("id", duplicate_ids_to_delete).execute()
-                
-                # Identificar blocos que precisam ser deletados (estão no banco mas não na lista nova)
-                old_block_keys = set(seen_keys.keys())
-                keys_to_delete = old_block_keys - new_block_keys
-                
-                if keys_to_delete:
-                    ids_to_delete = [seen_keys[key] for key in keys_to_delete if key in seen_keys]
-                    if ids_to_delete:
-                        logger.info("save_flow: 🗑️ Deletando %d blocos antigos que não estão na lista nova: %s", len(keys_to_delete), list(keys_to_delete))
-                        client.table("flow_blocks").delete().in_("id", ids_to_delete).execute()
-                else:
-                    logger.info("save_flow: ✅ Nenhum bloco antigo precisa ser deletado (todos estão na lista nova)")
-            except Exception as e:
-                logger.warning("save_flow: ⚠️ Erro ao limpar blocos antigos (continuando): %s", str(e)[:200])
-            
-            # ⚠️ DEPRECATED: Routes agora estão em routes_data (JSONB) dentro de flow_blocks
-            # Não precisa deletar flow_routes separadamente
-            logger.info("save_flow: ⚠️ Pulando deleção de flow_routes (routes agora em routes_data)")
-            
-            # Buscar IDs finais dos blocos inseridos (caso algum não tenha sido mapeado)
-            try:
-                final_resp = client.table("flow_blocks").select("id, block_key").eq("flow_id", flow_id).execute()
-                for row in (final_resp.data or []):
-                    if row["block_key"] not in block_key_to_id:
-                        block_key_to_id[row["block_key"]] = row["id"]
-                logger.info("save_flow: ✅ Mapeamento final: %d blocos mapeados", len(block_key_to_id))
-            except Exception as e:
-                logger.warning("save_flow: ⚠️ Erro ao buscar IDs finais: %s", str(e)[:200])
-            
-            # Verificação final: garantir que temos pelo menos alguns blocos inseridos
-            if len(block_key_to_id) == 0:
-                logger.error("save_flow: ❌ CRÍTICO: Nenhum bloco foi inserido após todas as tentativas!")
-                return {"success": False, "version": current_version, "error": "Falha ao inserir blocos. Os blocos antigos foram preservados."}
+            if failed_keys:
+                logger.warning("save_flow: ⚠️ Apenas %d de %d blocos foram salvos. Blocos faltando: %s", 
+                             len(block_key_to_id), len(rows), failed_keys)
             
-            # ANTIGO CÓDIGO (removido - inserção em lote única que causava timeout):
-            # try:
-            #     insert_result = client.table("flow_blocks").insert(rows).execute()
-            #     logger.info("save_flow: ✅ Tentativa de inserir %d blocos", len(rows))
+            # Só depois de salvar: deletar (em uma chamada) os blocos que não estão na lista nova
+            # UNIQUE(flow_id, block_key) garante que o upsert não cria duplicatas
+            keys_to_delete = sorted(existing_keys - {k.strip() for k in received_keys if k})
+            if keys_to_delete:
+                try:
+                    t0 = time.perf_counter()
+                    client.table("flow_blocks").delete().eq("flow_id", flow_id).in_("block_key", keys_to_delete).execute()
+                    deleted_count = len(keys_to_delete)
+                    logger.info("save_flow: 🗑️ %d blocos antigos deletados em %.1f ms: %s", 
+                               deleted_count, (time.perf_counter() - t0) * 1000, keys_to_delete)
+                except Exception as e:
+                    logger.warning("save_flow: ⚠️ Erro ao deletar blocos antigos (continuando): %s", str(e)[:200])
+            else:
+                logger.info("save_flow: ✅ Nenhum bloco antigo precisa ser deletado (todos estão na lista nova)")
 
         # 4. ⚠️ DEPRECATED: Routes agora estão em routes_data (JSONB) dentro de flow_blocks
         # Não precisa deletar/inserir em flow_routes separadamente
@@ -995,11 +1145,22 @@ def save_flow(payload) -> Dict[str, Any]:
         # O prompt_voz não é mais sincronizado automaticamente
         logger.info("save_flow: ✅ Blocos salvos em flow_blocks. prompt_voz não é mais atualizado automaticamente.")
         
-        # 6. Incrementar version
-        new_version = current_version + 1
-        client.table("flows").update({"version": new_version}).eq("id", flow_id).execute()
+        # 6. Incrementar version (só se algo mudou de fato)
+        new_version = current_version
+        if written_count or deleted_count:
+            new_version = current_version + 1
+            client.table("flows").update({"version": new_version}).eq("id", flow_id).execute()
+        else:
+            logger.info("save_flow: ✅ Nenhum bloco mudou; version mantida em %d", current_version)
 
-        return {"success": True, "version": new_version}
+        return {
+            "success": True,
+            "version": new_version,
+            "written": written_count,
+            "skipped": len(skipped_keys),
+            "deleted": deleted_count,
+            "batches": batch_stats,
+        }
     except Exception as e:
         import traceback
         error_str = str(e)
@@ -1018,3 +1179,6 @@ def save_flow(payload) -> Dict[str, Any]:
             "version": current_version, 
             "error": f"Erro ao salvar flow: {error_str}. Verifique os logs do servidor para detalhes."
         }
+    finally:
+        # Sucesso ou falha parcial: o que está em cache pode não refletir mais o banco
+        flow_snapshot_cache.invalidate(flow_id)
@@ -0,0 +1,312 @@
+"""
+Análise híbrida do prompt: parser primeiro, IA só no que o parser não resolve.
+
+A maioria dos prompts já marca cada seção com [PM001], [AG001], [CAM001], [MSG001],
+[ENC001]; essas seções o parser (prompt_parser) extrai de forma determinística.
+Cada seção ### recebe uma nota de confiança (0-1). Seções com nota abaixo de
+HYBRID_MIN_CONFIDENCE (sem marcador, tipo ambíguo, CAMINHOS sem rotas
+reconhecíveis...) vão para a IA, agrupadas em trechos e analisadas em paralelo
+(FlowAIAnalyzer.analyze_chunks). O resultado é unido por merge_chunk_blocks na
+ordem do prompt. Prompts totalmente marcados não fazem nenhuma chamada ao LLM.
+Se um trecho falhar (provedor, JSON inválido), só as seções dele voltam para a
+extração de baixa confiança do parser; o erro fica em stats["ai_error"].
+"""
+import logging
+import re
+from typing import Any, Dict, List, Optional, Tuple
+
+from saas_tools.config import settings
+from saas_tools.services.flow_ai_analyzer import (
+    FlowAIAnalyzer,
+    merge_chunk_blocks,
+    split_prompt_sections,
+    SECTION_HEADER_RE,
+)
+from saas_tools.services.llm_resilience import as_call_error
+from saas_tools.services.prompt_compactor import compact_prompt, compact_text, count_tokens, group_by_tokens
+from saas_tools.services.prompt_parser import (
+    extract_block_content,
+    extract_next_block,
+    extract_routes_from_section,
+    extract_variable_name,
+)
+
+logger = logging.getLogger(__name__)
+
+KEY_MARKER_RE = re.compile(r"\[([A-Z]{2,3}\d+)\]")
+# Sinais de que uma seção sem [ID] ainda descreve um bloco
+BLOCK_CUES_RE = re.compile(r"fale|escute|analisando|\[[A-Z]{2,3}\d+\]", re.IGNORECASE)
+
+# Prefixo do block_key -> block_type
+PREFIX_TYPES = {
+    "PM": "primeira_mensagem",
+    "AG": "aguardar",
+    "CAM": "caminhos",
+    "MSG": "mensagem",
+    "ENC": "encerrar",
+}
+
+# Palavra no título da seção -> block_type (mesma prioridade do parser)
+TITLE_TYPES = [
+    ("ABERTURA", "primeira_mensagem"),
+    ("AGUARDAR", "aguardar"),
+    ("CAMINHOS", "caminhos"),
+    ("MENSAGEM", "mensagem"),
+    ("ENCERRAR", "encerrar"),
+]
+
+# Conteúdos de fallback do parser (não contam como conteúdo extraído)
+PLACEHOLDER_CONTENTS = ("", "Encerrar ligação", "Analisar resposta", "Escute a resposta do lead")
+
+
+class SectionAnalysis:
+    """Resultado do parser para uma seção ### e a confiança nele."""
+
+    def __init__(self, text: str):
+        self.text = text
+        self.block: Optional[Dict[str, Any]] = None
+        self.confidence = 0.0
+        self.reasons: List[str] = []
+        self.is_block = True
+
+    @property
+    def header(self) -> str:
+        return self.text.split("\n", 1)[0].strip()
+
+
+def _type_from_title(header: str) -> Optional[str]:
+    header_upper = header.upper()
+    for word, block_type in TITLE_TYPES:
+        if word in header_upper:
+            return block_type
+    return None
+
+
+def _type_from_key(block_key: str) -> Optional[str]:
+    prefix = re.match(r"[A-Z]+", block_key).group(0)
+    return PREFIX_TYPES.get(prefix)
+
+
+def _routes_data_from_parser(routes: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+    """Converte as rotas do parser (formato flow_routes) para o formato routes_data."""
+    return [
+        {
+            "route_key": route.get("route_key"),
+            "label": route.get("label"),
+            "ordem": route.get("ordem", 999),
+            "cor": route.get("cor", "#6b7280"),
+            "keywords": route.get("keywords", []),
+            "response": route.get("response", ""),
+            "destination_type": route.get("destination_type", "continuar"),
+            "destination_block_key": route.get("destination_block_key"),
+            "max_loop_attempts": route.get("max_loop_attempts", 2),
+            "is_fallback": route.get("is_fallback", False),
+        }
+        for route in routes
+    ]
+
+
+def score_section(text: str) -> SectionAnalysis:
+    """
+    Extrai o bloco da seção com as funções do parser e dá uma nota de confiança.
+    Começa em 1.0 e perde pontos por cada sinal de ambiguidade (ver reasons).
+    """
+    analysis = SectionAnalysis(text)
+    header = analysis.header
+    body = text.split("\n", 1)[1] if "\n" in text else ""
+    confidence = 1.0
+
+    # block_key: marcador no cabeçalho (referências no corpo são para outros blocos)
+    marker = KEY_MARKER_RE.search(header.upper())
+    title_type = _type_from_title(header)
+    if marker:
+        block_key = marker.group(1)
+        key_type = _type_from_key(block_key)
+    elif title_type == "primeira_mensagem":
+        # Mesma convenção do parser: ABERTURA é sempre PM001
+        block_key, key_type = "PM001", "primeira_mensagem"
+    elif not title_type and not BLOCK_CUES_RE.search(text):
+        # Seção de texto livre (regras, observações): não é bloco, nem vai para a IA
+        analysis.is_block = False
+        analysis.reasons.append("sem estrutura de bloco")
+        return analysis
+    else:
+        block_key, key_type = None, None
+        confidence -= 0.5
+        analysis.reasons.append("sem [ID] no cabeçalho")
+
+    block_type = key_type or title_type
+    if not block_key or not block_type:
+        analysis.confidence = 0.0
+        analysis.reasons.append("tipo/ID não identificados")
+        return analysis
+    if key_type and title_type and key_type != title_type:
+        confidence -= 0.3
+        analysis.reasons.append(f"título indica {title_type}, ID indica {key_type}")
+
+    content = extract_block_content(text, block_type)
+    if (content or "").strip() in PLACEHOLDER_CONTENTS:
+        if block_type in ("primeira_mensagem", "mensagem", "encerrar"):
+            confidence -= 0.3
+            analysis.reasons.append("fala não encontrada")
+        content = content or ""
+
+    block: Dict[str, Any] = {
+        "block_key": block_key,
+        "block_type": block_type,
+        "content": content or f"Bloco {block_key}",
+        "next_block_key": extract_next_block(body),
+    }
+
+    if block_type == "aguardar":
+        block["variable_name"] = extract_variable_name(text)
+        if not block["variable_name"]:
+            confidence -= 0.2
+            analysis.reasons.append("variável não encontrada")
+    elif block_type == "caminhos":
+        block["analyze_variable"] = extract_variable_name(text)
+        routes = extract_routes_from_section(text, block_key, "", None, None)
+        block["routes_data"] = _routes_data_from_parser(routes)
+        block["next_block_key"] = None
+        if not routes:
+            confidence -= 0.6
+            analysis.reasons.append("rotas não reconhecidas")
+        elif any(not r["destination_block_key"] for r in block["routes_data"] if not r["is_fallback"]):
+            confidence -= 0.3
+            analysis.reasons.append("rota sem destino")
+
+    if block_type in ("primeira_mensagem", "mensagem", "aguardar") and not block["next_block_key"]:
+        confidence -= 0.1
+        analysis.reasons.append("sem próximo bloco")
+
+    analysis.block = block
+    analysis.confidence = round(max(0.0, confidence), 2)
+    return analysis
+
+
+def _flow_sections(prompt: str) -> List[str]:
+    """Seções ### do fluxo (ignora o texto antes de "## FLUXO DA CONVERSA" e o que vem antes do 1º ###)."""
+    fluxo_start = prompt.find("## FLUXO DA CONVERSA")
+    if fluxo_start > 0:
+        prompt = prompt[fluxo_start:]
+    sections = []
+    for section in split_prompt_sections(prompt):
+        if not SECTION_HEADER_RE.match(section):
+            continue
+        upper = section.upper()
+        # Seções explicativas (ex: "FALAR = ...") não são blocos, igual ao parser
+        if "FALAR" in upper and "=" in section and "ABERTURA" not in upper and "AGUARDAR" not in upper:
+            continue
+        sections.append(section)
+    return sections
+
+
+def _chunk_groups(run: List[SectionAnalysis], texts: List[str], chunks: List[str]) -> List[List[SectionAnalysis]]:
+    """Seções de cada trecho (group_by_tokens junta textos consecutivos, então basta contar caracteres)."""
+    groups: List[List[SectionAnalysis]] = []
+    cursor = 0
+    for chunk in chunks:
+        group: List[SectionAnalysis] = []
+        length = 0
+        while cursor < len(run) and length < len(chunk):
+            group.append(run[cursor])
+            length += len(texts[cursor])
+            cursor += 1
+        groups.append(group)
+    return groups
+
+
+def analyze_prompt_hybrid(
+    prompt: str,
+    provider: str = "openai",
+    tenant_id: Optional[str] = None,
+    flow_id: Optional[str] = None,
+) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+    """
+    Parser nas seções confiáveis + IA nas ambíguas. Retorna (blocos, stats).
+    Blocos no mesmo formato de analyze_prompt_with_ai.
+    """
+    analyses = [a for a in map(score_section, _flow_sections(prompt)) if a.is_block]
+    threshold = settings.HYBRID_MIN_CONFIDENCE
+
+    # Sequências de seções consecutivas: ("parser", [análises]) ou ("ai", [análises])
+    runs: List[Tuple[str, List[SectionAnalysis]]] = []
+    for analysis in analyses:
+        kind = "parser" if analysis.block and analysis.confidence >= threshold else "ai"
+        if runs and runs[-1][0] == kind:
+            runs[-1][1].append(analysis)
+        else:
+            runs.append((kind, [analysis]))
+        if kind == "ai":
+            logger.info("🧐 [Hybrid] Seção ambígua (%.2f): %s — %s", analysis.confidence, analysis.header[:80], ", ".join(analysis.reasons))
+
+    ai_sections = [a for kind, run in runs if kind == "ai" for a in run]
+    stats = {
+        "sections": len(analyses),
+        "parser_sections": len(analyses) - len(ai_sections),
+        "ai_sections": len(ai_sections),
+        "prompt_chars": len(prompt),
+        "ai_chars": sum(len(a.text) for a in ai_sections),
+        "llm_calls": 0,
+        "ai_error": None,
+    }
+
+    # Cada sequência de seções ambíguas (compactadas) vira um ou mais trechos para a IA;
+    # groups_per_run guarda as seções de cada trecho, para o fallback por trecho
+    groups_per_run: List[List[List[SectionAnalysis]]] = []
+    flat_chunks: List[str] = []
+    for kind, run in runs:
+        if kind != "ai":
+            groups_per_run.append([])
+            continue
+        texts = [compact_text(a.text) for a in run]
+        chunks = group_by_tokens(texts, settings.AI_ANALYSIS_CHUNK_TOKENS)
+        groups_per_run.append(_chunk_groups(run, texts, chunks))
+        flat_chunks.extend(chunks)
+    stats["ai_tokens"] = sum(count_tokens(chunk) for chunk in flat_chunks)
+    ai_results: List[List[Dict[str, Any]]] = [[] for _ in flat_chunks]
+    chunk_errors: Dict[int, Exception] = {}
+    if flat_chunks:
+        try:
+            analyzer = FlowAIAnalyzer(provider=provider, tenant_id=tenant_id, flow_id=flow_id)
+            # Índice de cabeçalhos só do fluxo (sem as seções de identidade/regras)
+            ai_results = analyzer.analyze_chunks(compact_prompt(prompt).text, flat_chunks, errors=chunk_errors)
+            stats["llm_calls"] = len(flat_chunks)
+        except Exception as e:
+            # Sem IA (chave não configurada): todos os trechos ficam com o parser
+            chunk_errors = dict.fromkeys(range(len(flat_chunks)), e)
+        if chunk_errors:
+            # Fica com o que o parser conseguiu nesses trechos, mas o motivo vai nas stats
+            # para quem chamou saber que a IA falhou
+            first_error = chunk_errors[min(chunk_errors)]
+            logger.error("❌ [Hybrid] IA falhou em %d de %d trechos: %s", len(chunk_errors), len(flat_chunks), first_error)
+            stats["ai_error"] = as_call_error(provider, first_error).to_dict()
+    stats["ai_failed_chunks"] = len(chunk_errors)
+    stats["ai_fallback_sections"] = 0
+
+    partials: List[List[Dict[str, Any]]] = []
+    chunk_cursor = 0
+    for (kind, run), groups in zip(runs, groups_per_run):
+        if kind == "parser":
+            partials.append([dict(a.block, order_index=i) for i, a in enumerate(run)])
+            continue
+        for group in groups:
+            result = ai_results[chunk_cursor]
+            chunk_cursor += 1
+            if result:
+                partials.append(result)
+                continue
+            # Trecho falhou ou a IA não devolveu nada: extração de baixa confiança do parser
+            fallback = [dict(a.block, order_index=i) for i, a in enumerate(group) if a.block]
+            stats["ai_fallback_sections"] += len(group)
+            if fallback:
+                partials.append(fallback)
+
+    blocks = merge_chunk_blocks(partials)
+    stats["blocks"] = len(blocks)
+    logger.info(
+        "✅ [Hybrid] %d seções: %d pelo parser, %d pela IA (%d de %d caracteres, %d chamadas) -> %d blocos",
+        stats["sections"], stats["parser_sections"], stats["ai_sections"],
+        stats["ai_chars"], stats["prompt_chars"], stats["llm_calls"], stats["blocks"],
+    )
+    return blocks, stats
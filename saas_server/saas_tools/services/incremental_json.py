@@ -0,0 +1,112 @@
+"""
+Parser incremental do JSON de blocos que os LLMs devolvem.
+
+A resposta tem o formato {"blocks": [{...}, {...}, ...]} (às vezes dentro de
+```json). Com streaming, o texto chega em pedaços; BlockStreamParser recebe os
+pedaços (feed) e devolve cada objeto do array "blocks" assim que ele fecha, sem
+esperar o fim da resposta. Cada caractere é visto uma vez só (o estado de
+string/escape/profundidade fica guardado entre os pedaços).
+"""
+import json
+import logging
+from typing import Any, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class BlockStreamParser:
+    """Extrai os objetos do array "blocks" à medida que o texto chega."""
+
+    def __init__(self, array_key: str = "blocks"):
+        self.array_key = array_key
+        self._buffer: List[str] = []   # texto desde o início do objeto atual
+        self._text: List[str] = []     # texto completo (para o cache/validação final)
+        self._key_marker = f'"{array_key}"'
+        self._tail = ""                # fim do texto ainda sem o array (procura da chave)
+        self._in_array = False
+        self._array_done = False
+        self._depth = 0                # profundidade dentro do objeto atual
+        self._in_string = False
+        self._escape = False
+        self.emitted = 0
+
+    def feed(self, chunk: str) -> List[Dict[str, Any]]:
+        """Consome um pedaço da resposta e retorna os blocos que ficaram completos nele."""
+        if not chunk:
+            return []
+        self._text.append(chunk)
+        if self._array_done:
+            return []
+
+        blocks: List[Dict[str, Any]] = []
+        start = 0
+        if not self._in_array:
+            # Procurar '"blocks"' seguido de ':' e '[' (pode vir partido entre pedaços)
+            self._tail += chunk
+            key_pos = self._tail.find(self._key_marker)
+            if key_pos == -1:
+                self._tail = self._tail[-len(self._key_marker):]
+                return []
+            bracket = self._tail.find("[", key_pos + len(self._key_marker))
+            if bracket == -1:
+                self._tail = self._tail[key_pos:]
+                return []
+            self._in_array = True
+            chunk = self._tail[bracket + 1:]
+            self._tail = ""
+
+        for index, char in enumerate(chunk):
+            if self._depth == 0:
+                if char == "{":
+                    self._depth = 1
+                    start = index
+                elif char == "]":
+                    self._array_done = True
+                    break
+                continue
+
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._buffer.append(chunk[start:index + 1])
+                    block = self._decode("".join(self._buffer))
+                    self._buffer = []
+                    if block is not None:
+                        blocks.append(block)
+
+        if self._depth > 0:
+            # Objeto continua no próximo pedaço
+            self._buffer.append(chunk[start:])
+        return blocks
+
+    def _decode(self, text: str) -> Optional[Dict[str, Any]]:
+        try:
+            value = json.loads(text)
+        except json.JSONDecodeError as e:
+            logger.warning("BlockStreamParser: objeto inválido ignorado (%s): %s", e, text[:200])
+            return None
+        if not isinstance(value, dict):
+            return None
+        self.emitted += 1
+        return value
+
+    @property
+    def text(self) -> str:
+        """Resposta completa recebida até agora."""
+        return "".join(self._text)
+
+    @property
+    def finished(self) -> bool:
+        """True quando o array "blocks" já fechou."""
+        return self._array_done
@@ -0,0 +1,164 @@
+"""
+Contabilidade das chamadas aos LLMs: tokens, latência e custo por tenant e por endpoint.
+
+Toda chamada ao provedor (e todo acerto do cache de LLM) vira um registro com
+endpoint (flow_ai_analyzer, ai_prompt_patcher, ...), provider, model, tokens de
+entrada/saída, tempo até o primeiro token, latência total, cache_hit, tenant e
+flow. Os registros ficam num ring buffer em memória (LLM_ACCOUNTING_CAPACITY);
+a cada LLM_ACCOUNTING_AGGREGATE_SECONDS os registros novos são somados nos
+acumulados por tenant e por endpoint, que não se perdem quando o ring gira.
+"""
+import logging
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from saas_tools.config import settings
+
+logger = logging.getLogger(__name__)
+
+# USD por 1M de tokens (entrada, saída); o primeiro prefixo que casar com o model vale
+MODEL_PRICES = [
+    ("gpt-4o-mini", (0.15, 0.60)),
+    ("gpt-4o", (2.50, 10.00)),
+    ("gpt-4.1-mini", (0.40, 1.60)),
+    ("gpt-4.1", (2.00, 8.00)),
+    ("claude-3-haiku", (0.25, 1.25)),
+    ("claude-3-5-haiku", (0.80, 4.00)),
+    ("claude-3-5-sonnet", (3.00, 15.00)),
+    ("claude-3-7-sonnet", (3.00, 15.00)),
+]
+
+
+def estimate_tokens(text: str) -> int:
+    """Estimativa quando o provedor não informa o uso (~4 caracteres por token)."""
+    return (len(text) + 3) // 4 if text else 0
+
+
+def estimate_cost(model: str, input_tokens: int, output_tokens: int) -> Optional[float]:
+    for prefix, (input_price, output_price) in MODEL_PRICES:
+        if model.startswith(prefix):
+            return round((input_tokens * input_price + output_tokens * output_price) / 1_000_000, 6)
+    return None
+
+
+def _empty_rollup() -> Dict[str, Any]:
+    return {
+        "calls": 0,
+        "cache_hits": 0,
+        "errors": 0,
+        "input_tokens": 0,
+        "output_tokens": 0,
+        "cost_usd": 0.0,
+        "total_ms": 0.0,
+        "max_ms": 0.0,
+    }
+
+
+class LLMAccounting:
+    """Ring buffer de chamadas + acumulados por tenant/endpoint (thread-safe)."""
+
+    def __init__(self, capacity: int = 2000, aggregate_seconds: float = 30.0):
+        self.capacity = max(1, capacity)
+        self.aggregate_seconds = aggregate_seconds
+        self._records: Deque[Dict[str, Any]] = deque(maxlen=self.capacity)
+        self._pending: List[Dict[str, Any]] = []
+        self._by_tenant: Dict[str, Dict[str, Any]] = {}
+        self._by_endpoint: Dict[str, Dict[str, Any]] = {}
+        self._totals = _empty_rollup()
+        self._last_aggregate = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(
+        self,
+        endpoint: str,
+        provider: str,
+        model: str,
+        input_tokens: int = 0,
+        output_tokens: int = 0,
+        first_token_ms: Optional[float] = None,
+        total_ms: float = 0.0,
+        cache_hit: bool = False,
+        outcome: str = "ok",
+        tokens_estimated: bool = False,
+        tenant_id: Optional[str] = None,
+        flow_id: Optional[str] = None,
+    ) -> None:
+        """outcome: ok, error ou cancelled (hedging). Acertos de cache não custam tokens."""
+        entry = {
+            "at": time.time(),
+            "endpoint": endpoint,
+            "provider": provider,
+            "model": model,
+            "tenant_id": tenant_id,
+            "flow_id": flow_id,
+            "input_tokens": 0 if cache_hit else input_tokens,
+            "output_tokens": 0 if cache_hit else output_tokens,
+            "tokens_estimated": tokens_estimated,
+            "cost_usd": 0.0 if cache_hit else estimate_cost(model, input_tokens, output_tokens),
+            "first_token_ms": round(first_token_ms, 1) if first_token_ms is not None else None,
+            "total_ms": round(total_ms, 1),
+            "cache_hit": cache_hit,
+            "outcome": outcome,
+        }
+        with self._lock:
+            self._records.append(entry)
+            self._pending.append(entry)
+            if time.monotonic() - self._last_aggregate >= self.aggregate_seconds:
+                self._aggregate()
+
+    def recent(self, limit: int = 100, tenant_id: Optional[str] = None) -> List[Dict[str, Any]]:
+        """Últimos registros do ring buffer (mais recentes primeiro)."""
+        with self._lock:
+            records = [r for r in reversed(self._records) if tenant_id is None or r["tenant_id"] == tenant_id]
+        return records[:limit]
+
+    def rollups(self) -> Dict[str, Any]:
+        """Acumulados desde o início do processo por tenant, por endpoint e no total."""
+        with self._lock:
+            self._aggregate()
+            return {
+                "totals": self._finish(self._totals),
+                "by_tenant": {key: self._finish(value) for key, value in self._by_tenant.items()},
+                "by_endpoint": {key: self._finish(value) for key, value in self._by_endpoint.items()},
+                "ring": {"size": len(self._records), "capacity": self.capacity},
+                "aggregate_seconds": self.aggregate_seconds,
+            }
+
+    def _aggregate(self) -> None:
+        """Soma os registros pendentes nos acumulados (chamar com o lock)."""
+        for entry in self._pending:
+            tenant = entry["tenant_id"] or "(sem tenant)"
+            for rollup in (
+                self._totals,
+                self._by_tenant.setdefault(tenant, _empty_rollup()),
+                self._by_endpoint.setdefault(entry["endpoint"], _empty_rollup()),
+            ):
+                rollup["calls"] += 1
+                rollup["cache_hits"] += 1 if entry["cache_hit"] else 0
+                rollup["errors"] += 1 if entry["outcome"] == "error" else 0
+                rollup["input_tokens"] += entry["input_tokens"]
+                rollup["output_tokens"] += entry["output_tokens"]
+                rollup["cost_usd"] += entry["cost_usd"] or 0.0
+                rollup["total_ms"] += entry["total_ms"]
+                rollup["max_ms"] = max(rollup["max_ms"], entry["total_ms"])
+        self._pending = []
+        self._last_aggregate = time.monotonic()
+
+    @staticmethod
+    def _finish(rollup: Dict[str, Any]) -> Dict[str, Any]:
+        calls = rollup["calls"]
+        return {
+            **rollup,
+            "cost_usd": round(rollup["cost_usd"], 6),
+            "total_ms": round(rollup["total_ms"], 1),
+            "avg_ms": round(rollup["total_ms"] / calls, 1) if calls else 0.0,
+            "cache_hit_ratio": round(rollup["cache_hits"] / calls, 4) if calls else 0.0,
+        }
+
+
+llm_accounting = LLMAccounting(
+    capacity=settings.LLM_ACCOUNTING_CAPACITY,
+    aggregate_seconds=settings.LLM_ACCOUNTING_AGGREGATE_SECONDS,
+)
@@ -0,0 +1,159 @@
+"""
+Cache persistente (disco local) das respostas dos LLMs.
+
+FlowAIAnalyzer e AIPromptPatcher mandam o mesmo system prompt enorme e, muitas
+vezes, o mesmo prompt do usuário de novo (flow limpo e regerado, undo no editor).
+A chave é endereçada por conteúdo: provider + model + hash do system prompt +
+hash da entrada (mensagem do usuário e parâmetros da chamada). Uma requisição
+idêntica volta em milissegundos e sem custo de tokens.
+
+Cada resposta é um arquivo JSON em LLM_CACHE_DIR; a leitura atualiza o mtime e,
+quando o total passa de LLM_CACHE_MAX_MB, os arquivos menos usados recentemente
+são removidos (LRU).
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from saas_tools.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+def _sha256(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+class LLMResponseCache:
+    """Cache LRU em disco, limitado por tamanho (thread-safe dentro do processo)."""
+
+    def __init__(self, directory: str, max_bytes: int, enabled: bool = True):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._sizes: Optional[Dict[str, int]] = None  # caminho -> bytes (carregado na 1ª vez)
+        self._total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(provider: str, model: str, system_prompt: str, user_input: str, **params: Any) -> str:
+        """Chave do cache: provider, model, hash do system prompt e hash da entrada (+ parâmetros)."""
+        input_hash = _sha256(json.dumps({"input": user_input, "params": params}, sort_keys=True, ensure_ascii=False))
+        return _sha256("\x00".join([provider, model, _sha256(system_prompt), input_hash]))
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        path = self._path(key)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                entry = json.load(f)
+            os.utime(path, None)  # marca como usado recentemente (LRU)
+        except (OSError, ValueError):
+            with self._lock:
+                self.misses += 1
+            return None
+        with self._lock:
+            self.hits += 1
+        return entry.get("response")
+
+    def set(self, key: str, response: str, provider: str = "", model: str = "") -> None:
+        if not self.enabled or not response:
+            return
+        path = self._path(key)
+        entry = {"provider": provider, "model": model, "created_at": time.time(), "response": response}
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f, ensure_ascii=False)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+        except OSError as e:
+            logger.warning("LLMResponseCache: não foi possível gravar %s: %s", key[:12], e)
+            return
+        with self._lock:
+            sizes = self._load_index()
+            self._total_bytes += size - sizes.get(path, 0)
+            sizes[path] = size
+            self.writes += 1
+            if self._total_bytes > self.max_bytes:
+                self._evict()
+
+    def clear(self) -> None:
+        with self._lock:
+            for path in list(self._load_index()):
+                self._remove(path)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            sizes = self._load_index()
+            lookups = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "directory": self.directory,
+                "entries": len(sizes),
+                "size_bytes": self._total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_ratio": round(self.hits / lookups, 4) if lookups else 0.0,
+                "writes": self.writes,
+                "evictions": self.evictions,
+            }
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], f"{key}.json")
+
+    def _load_index(self) -> Dict[str, int]:
+        """Varre o diretório uma vez para saber o tamanho atual (chamar com o lock)."""
+        if self._sizes is None:
+            self._sizes = {}
+            for root, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".json"):
+                        path = os.path.join(root, name)
+                        try:
+                            self._sizes[path] = os.path.getsize(path)
+                        except OSError:
+                            continue
+            self._total_bytes = sum(self._sizes.values())
+        return self._sizes
+
+    def _evict(self) -> None:
+        """Remove os arquivos com mtime mais antigo até caber em 90% do limite (chamar com o lock)."""
+        target = int(self.max_bytes * 0.9)
+        by_age = []
+        for path in self._sizes:
+            try:
+                by_age.append((os.path.getmtime(path), path))
+            except OSError:
+                by_age.append((0.0, path))
+        for _, path in sorted(by_age):
+            if self._total_bytes <= target:
+                break
+            self._remove(path)
+            self.evictions += 1
+        logger.info("LLMResponseCache: 🧹 eviction concluída (%d bytes em disco)", self._total_bytes)
+
+    def _remove(self, path: str) -> None:
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+        self._total_bytes -= self._sizes.pop(path, 0)
+
+
+llm_cache = LLMResponseCache(
+    directory=settings.LLM_CACHE_DIR,
+    max_bytes=settings.LLM_CACHE_MAX_MB * 1024 * 1024,
+    enabled=settings.LLM_CACHE_ENABLED,
+)
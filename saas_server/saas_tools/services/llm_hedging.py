@@ -0,0 +1,368 @@
+"""
+Requisições "hedged" aos LLMs: Anthropic e OpenAI como primário/secundário.
+
+Cada chamada sai pelo provedor primário em streaming. Se o primeiro token não
+chegar em LLM_HEDGE_DEADLINE_SECONDS (ou o primário falhar antes disso), a mesma
+requisição é disparada no secundário; vale a resposta que terminar primeiro com
+sucesso e a outra é cancelada (o stream é fechado no próximo pedaço recebido).
+
+Latências (tempo até o primeiro token e total) ficam numa janela por provedor
+(LLM_LATENCY_WINDOW); stats() mostra p50/p99 para calibrar o deadline.
+
+Prazo total, retries e circuit breaker vêm do llm_resilience: com o circuito do
+primário aberto a chamada sai direto pelo secundário; sem nenhum provedor
+disponível (ou depois dos retries) complete() levanta LLMCallError.
+"""
+import logging
+import math
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, Optional
+
+from saas_tools.config import settings
+from saas_tools.services.llm_accounting import estimate_tokens, llm_accounting
+from saas_tools.services.llm_providers import (
+    SECONDARY_PROVIDER,
+    default_model,
+    llm_providers,
+    stream_completion,
+)
+from saas_tools.services.llm_resilience import LLMCallError, llm_resilience
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(values: List[float], pct: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, math.ceil(pct / 100.0 * len(ordered)) - 1))
+    return round(ordered[index], 1)
+
+
+class LatencyTracker:
+    """Janela das últimas N latências por provedor (ms)."""
+
+    def __init__(self, window: int = 500):
+        self.window = max(1, window)
+        self._first_token: Dict[str, Deque[float]] = {}
+        self._total: Dict[str, Deque[float]] = {}
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, outcome: str, first_token_ms: Optional[float] = None, total_ms: Optional[float] = None) -> None:
+        """outcome: ok, error ou cancelled."""
+        with self._lock:
+            counts = self._counts.setdefault(provider, {"ok": 0, "error": 0, "cancelled": 0})
+            counts[outcome] = counts.get(outcome, 0) + 1
+            if first_token_ms is not None:
+                self._first_token.setdefault(provider, deque(maxlen=self.window)).append(first_token_ms)
+            if outcome == "ok" and total_ms is not None:
+                self._total.setdefault(provider, deque(maxlen=self.window)).append(total_ms)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            result = {}
+            for provider, counts in self._counts.items():
+                first_token = list(self._first_token.get(provider, ()))
+                total = list(self._total.get(provider, ()))
+                result[provider] = {
+                    **counts,
+                    "first_token_p50_ms": _percentile(first_token, 50),
+                    "first_token_p99_ms": _percentile(first_token, 99),
+                    "total_p50_ms": _percentile(total, 50),
+                    "total_p99_ms": _percentile(total, 99),
+                }
+            return result
+
+
+class HedgeResult:
+    """Resposta vencedora e de onde ela veio."""
+
+    def __init__(self, text: str, provider: str, model: str, hedged: bool, first_token_ms: Optional[float], total_ms: float):
+        self.text = text
+        self.provider = provider
+        self.model = model
+        self.hedged = hedged
+        self.first_token_ms = first_token_ms
+        self.total_ms = total_ms
+
+
+class _Attempt:
+    """Uma chamada em streaming a um provedor, rodando em thread própria."""
+
+    def __init__(self, provider: str, client: Any, model: str, changed: threading.Condition, tags: Dict[str, Any]):
+        self.provider = provider
+        self.client = client
+        self.model = model
+        self.tags = tags
+        self._changed = changed
+        self.cancel = threading.Event()
+        self.timed_out = False
+        # Vaga do LLM_MAX_CONCURRENCY conseguida: só daqui em diante conta o deadline do primeiro token
+        self.slotted = False
+        self.slotted_at: Optional[float] = None
+        # Requisição saiu para o provedor (cancelada ainda na fila local, não custa nada)
+        self.sent = False
+        # Resultado já entregue ao circuit breaker (uma vez por tentativa: allow() foi chamado uma vez)
+        self.breaker_reported = False
+        self.first_token = False
+        self.done = False
+        self.text: Optional[str] = None
+        self.error: Optional[BaseException] = None
+        self.first_token_ms: Optional[float] = None
+        self.total_ms: Optional[float] = None
+
+    @property
+    def succeeded(self) -> bool:
+        return self.done and self.error is None and self.text is not None
+
+    def start(self, *args) -> None:
+        threading.Thread(target=self._run, args=args, daemon=True, name=f"llm-{self.provider}").start()
+
+    def _run(self, system_prompt: str, user_prompt: str, max_tokens: int, temperature: Optional[float]) -> None:
+        started = time.monotonic()
+        parts: List[str] = []
+        usage: Dict[str, int] = {}
+        try:
+            with llm_providers.slot():
+                self._notify(slotted=True)
+                if self.cancel.is_set():
+                    # Hedge/prazo já resolvido enquanto esperava a vaga: não envia a requisição paga
+                    return
+                self.sent = True
+                stream = stream_completion(self.provider, self.client, self.model, system_prompt, user_prompt, max_tokens, temperature, usage=usage)
+                try:
+                    for text in stream:
+                        if self.cancel.is_set():
+                            break
+                        if not self.first_token:
+                            self.first_token_ms = (time.monotonic() - self.slotted_at) * 1000
+                            self._notify(first_token=True)
+                        parts.append(text)
+                finally:
+                    stream.close()
+            if not self.cancel.is_set():
+                self.text = "".join(parts)
+        except Exception as e:
+            self.error = e
+        finally:
+            self.total_ms = (time.monotonic() - started) * 1000
+            self._notify(done=True)
+            if not self.sent and self.error is None:
+                # Nunca saiu da fila local: só libera a chamada de teste do circuit breaker (half_open)
+                self.report_breaker(cancelled=True)
+                return
+            # Estouro do prazo já pode ter sido registrado por quem esperava (HedgedLLM)
+            self.report_breaker(self.error, cancelled=self.cancel.is_set() and self.error is None)
+            self._account(usage, system_prompt + user_prompt, "".join(parts))
+
+    def report_breaker(self, error: Optional[BaseException] = None, cancelled: bool = False) -> None:
+        """Resultado da tentativa para o circuit breaker; só o primeiro registro vale."""
+        with self._changed:
+            if self.breaker_reported:
+                return
+            self.breaker_reported = True
+        llm_resilience.record(self.provider, error, cancelled=cancelled)
+
+    def _account(self, usage: Dict[str, int], request_text: str, response_text: str) -> None:
+        """Registra a tentativa (inclusive a cancelada pelo hedging) em llm_accounting."""
+        if self.error is not None or self.timed_out:
+            outcome = "error"
+        elif self.cancel.is_set():
+            outcome = "cancelled"
+        else:
+            outcome = "ok"
+        llm_accounting.record(
+            provider=self.provider,
+            model=self.model,
+            input_tokens=usage.get("input_tokens", estimate_tokens(request_text)),
+            output_tokens=usage.get("output_tokens", estimate_tokens(response_text)),
+            first_token_ms=self.first_token_ms,
+            total_ms=self.total_ms,
+            outcome=outcome,
+            tokens_estimated=not usage,
+            **self.tags,
+        )
+
+    def _notify(self, first_token: bool = False, done: bool = False, slotted: bool = False) -> None:
+        with self._changed:
+            if slotted and not self.slotted:
+                self.slotted = True
+                self.slotted_at = time.monotonic()
+            self.first_token = self.first_token or first_token
+            self.done = self.done or done
+            self._changed.notify_all()
+
+
+class HedgedLLM:
+    """Política de hedging primário -> secundário com deadline de primeiro token."""
+
+    def __init__(self, enabled: bool = True, deadline_seconds: float = 5.0, window: int = 500):
+        self.enabled = enabled
+        self.deadline_seconds = deadline_seconds
+        self.latency = LatencyTracker(window)
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.hedges_fired = 0
+        self.secondary_wins = 0
+
+    def complete(
+        self,
+        provider: str,
+        client: Any,
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        temperature: Optional[float] = 0.1,
+        tags: Optional[Dict[str, Any]] = None,
+        tier: str = "large",
+    ) -> HedgeResult:
+        """
+        Texto completo da resposta (do primário ou, se demorar/falhar, do secundário).
+        tags (endpoint, tenant_id, flow_id) vão para o registro de cada tentativa em llm_accounting.
+        tier (small/large, ver llm_routing) escolhe o model do secundário.
+        Erros transitórios são repetidos com backoff; a falha final é LLMCallError.
+        """
+        tags = {"endpoint": "llm", **(tags or {})}
+        with self._lock:
+            self.calls += 1
+        return llm_resilience.call(
+            provider,
+            lambda timeout: self._complete_once(provider, client, model, system_prompt, user_prompt,
+                                                max_tokens, temperature, tags, tier, timeout),
+        )
+
+    def _complete_once(
+        self,
+        provider: str,
+        client: Any,
+        model: str,
+        system_prompt: str,
+        user_prompt: str,
+        max_tokens: int,
+        temperature: Optional[float],
+        tags: Dict[str, Any],
+        tier: str,
+        timeout: float,
+    ) -> HedgeResult:
+        """Uma tentativa hedged com prazo total de timeout segundos."""
+        changed = threading.Condition()
+        args = (system_prompt, user_prompt, max_tokens, temperature)
+        started = time.monotonic()
+        deadline = started + timeout
+
+        if llm_resilience.breaker(provider).allow():
+            primary = _Attempt(provider, client, model, changed, tags)
+        else:
+            # Circuito aberto: nem tenta o primário, vai direto para o secundário
+            primary = self._secondary_attempt(provider, changed, tags, tier) if self.enabled else None
+            if primary is None:
+                raise LLMCallError(provider, "circuit_open", "provedor degradado e sem secundário disponível")
+            logger.warning("HedgedLLM: 🔌 circuito de %s aberto, usando %s", provider, primary.provider)
+        attempts = [primary]
+        primary.start(*args)
+
+        with changed:
+            # Tempo na fila local (semáforo) não conta: o deadline começa quando o primário ganha a vaga.
+            # Ainda na fila ao fim do prazo total, não há hedge (ele esperaria no mesmo semáforo).
+            changed.wait_for(lambda: primary.slotted or primary.done, timeout=max(0.0, deadline - time.monotonic()))
+            if primary.slotted and not primary.done:
+                first_token_deadline = min(primary.slotted_at + self.deadline_seconds, deadline)
+                changed.wait_for(lambda: primary.first_token or primary.done,
+                                 timeout=max(0.0, first_token_deadline - time.monotonic()))
+            needs_hedge = primary.slotted and not primary.first_token and (not primary.done or primary.error is not None)
+
+        if needs_hedge and self.enabled and primary.provider == provider:
+            secondary = self._secondary_attempt(provider, changed, tags, tier)
+            if secondary:
+                reason = f"falhou ({primary.error})" if primary.error else f"sem primeiro token em {self.deadline_seconds}s"
+                logger.warning("HedgedLLM: ⏱️ %s %s, disparando %s", provider, reason, secondary.provider)
+                with self._lock:
+                    self.hedges_fired += 1
+                attempts.append(secondary)
+                secondary.start(*args)
+
+        with changed:
+            finished = changed.wait_for(
+                lambda: any(a.succeeded for a in attempts) or all(a.done for a in attempts),
+                timeout=max(0.0, deadline - time.monotonic()),
+            )
+            winner = next((a for a in attempts if a.succeeded), None)
+
+        if not finished:
+            # Prazo estourado: a conexão travada é abandonada (o timeout do SDK encerra a thread)
+            for attempt in attempts:
+                if not attempt.done:
+                    attempt.timed_out = True
+                    if attempt.slotted:
+                        attempt.report_breaker(TimeoutError())
+                    else:
+                        # Preso na fila local não é falha do provedor: só libera a chamada de teste
+                        attempt.report_breaker(cancelled=True)
+        for attempt in attempts:
+            if attempt is not winner:
+                attempt.cancel.set()
+        self._record(attempts, winner)
+
+        if winner is None:
+            if not finished:
+                raise LLMCallError(provider, "timeout", f"sem resposta em {timeout:.0f}s", retryable=True)
+            raise primary.error or RuntimeError(f"Nenhum provedor respondeu ({provider})")
+        if winner.provider != provider:
+            with self._lock:
+                self.secondary_wins += 1
+            logger.info("HedgedLLM: ✅ resposta veio do secundário %s", winner.provider)
+        return HedgeResult(
+            text=winner.text,
+            provider=winner.provider,
+            model=winner.model,
+            hedged=len(attempts) > 1,
+            first_token_ms=winner.first_token_ms,
+            total_ms=(time.monotonic() - started) * 1000,
+        )
+
+    def _secondary_attempt(self, provider: str, changed: threading.Condition, tags: Dict[str, Any],
+                           tier: str = "large") -> Optional[_Attempt]:
+        secondary = SECONDARY_PROVIDER.get(provider)
+        if not secondary or not llm_resilience.breaker(secondary).allow():
+            return None
+        try:
+            client, model = llm_providers.get(secondary, default_model(secondary, tier))
+        except ValueError as e:
+            logger.info("HedgedLLM: secundário %s indisponível: %s", secondary, e)
+            return None
+        return _Attempt(secondary, client, model, changed, tags)
+
+    def _record(self, attempts: List[_Attempt], winner: Optional[_Attempt]) -> None:
+        for attempt in attempts:
+            if attempt is winner:
+                outcome = "ok"
+            elif attempt.error is not None or attempt.timed_out:
+                outcome = "error"
+            elif attempt.succeeded:
+                # Terminou junto, mas a outra resposta já tinha sido escolhida
+                outcome = "ok"
+            else:
+                outcome = "cancelled"
+            self.latency.record(attempt.provider, outcome, attempt.first_token_ms, attempt.total_ms if attempt.done else None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counters = {
+                "enabled": self.enabled,
+                "deadline_seconds": self.deadline_seconds,
+                "calls": self.calls,
+                "hedges_fired": self.hedges_fired,
+                "secondary_wins": self.secondary_wins,
+            }
+        return {**counters, "providers": self.latency.stats()}
+
+
+llm_hedger = HedgedLLM(
+    enabled=settings.LLM_HEDGE_ENABLED,
+    deadline_seconds=settings.LLM_HEDGE_DEADLINE_SECONDS,
+    window=settings.LLM_LATENCY_WINDOW,
+)
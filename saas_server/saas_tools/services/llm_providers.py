@@ -0,0 +1,196 @@
+"""
+Registro de clientes dos provedores de LLM (um por processo).
+
+Antes, cada chamada de analyze_prompt_with_ai / patch_prompt_with_ai criava um
+FlowAIAnalyzer / AIPromptPatcher novo e, com ele, um openai.OpenAI ou Anthropic
+novo (pool de conexões próprio, handshake TLS a cada chamada). Aqui fica um
+cliente por (provider, model), reaproveitado entre chamadas e threads, e um
+semáforo que limita quantas requisições ao LLM rodam ao mesmo tempo no processo
+(LLM_MAX_CONCURRENCY): rajadas esperam na fila em vez de tomar 429 do provedor.
+"""
+import logging
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, Optional, Tuple
+
+from saas_tools.config import settings
+
+logger = logging.getLogger(__name__)
+
+try:
+    from anthropic import Anthropic
+    ANTHROPIC_AVAILABLE = True
+except ImportError:
+    ANTHROPIC_AVAILABLE = False
+    logger.warning("Anthropic SDK não disponível. Instale com: pip install anthropic")
+
+try:
+    import openai
+    OPENAI_AVAILABLE = True
+except ImportError:
+    OPENAI_AVAILABLE = False
+    logger.warning("OpenAI SDK não disponível. Instale com: pip install openai")
+
+DEFAULT_MODELS = {
+    "anthropic": ("ANTHROPIC_MODEL", "claude-3-haiku-20240307"),
+    "openai": ("OPENAI_MODEL", "gpt-4o-mini"),
+}
+# Tier "small" (rápido/barato) usado pelo llm_routing em pedidos pequenos e simples.
+# Sem padrão: os models large de fábrica já são os baratos, então sem
+# ANTHROPIC_SMALL_MODEL/OPENAI_SMALL_MODEL o small é o próprio large e o
+# roteamento fica desligado para o provedor (ver small_model_configured)
+SMALL_MODELS = {
+    "anthropic": ("ANTHROPIC_SMALL_MODEL", ""),
+    "openai": ("OPENAI_SMALL_MODEL", ""),
+}
+
+# Provedor alternativo de cada um (hedging / failover)
+SECONDARY_PROVIDER = {"anthropic": "openai", "openai": "anthropic"}
+
+
+def default_model(provider: str, tier: str = "large") -> str:
+    """Model do provedor por tier: "large" (ANTHROPIC_MODEL/OPENAI_MODEL) ou "small" (cai no large se não configurado)."""
+    models = SMALL_MODELS if tier == "small" else DEFAULT_MODELS
+    env_name, fallback = models.get(provider, ("", ""))
+    model = os.getenv(env_name, fallback) if env_name else fallback
+    if not model and tier == "small":
+        return default_model(provider, "large")
+    return model
+
+
+def small_model_configured(provider: str) -> bool:
+    """True se o tier small do provedor é um model diferente do large."""
+    return default_model(provider, "small") != default_model(provider, "large")
+
+
+class LLMProviderRegistry:
+    """Um cliente por (provider, model) + limite de concorrência do processo."""
+
+    def __init__(self, max_concurrency: int = 4):
+        self.max_concurrency = max(1, max_concurrency)
+        self._clients: Dict[Tuple[str, str], Any] = {}
+        self._lock = threading.Lock()
+        self._semaphore = threading.BoundedSemaphore(self.max_concurrency)
+        self._in_flight = 0
+        self._waiting = 0
+
+    def get(self, provider: str, model: str = "") -> Tuple[Any, str]:
+        """Retorna (client, model). Cria o cliente na primeira vez; ValueError se não configurado."""
+        model = model or default_model(provider)
+        key = (provider, model)
+        client = self._clients.get(key)
+        if client is not None:
+            return client, model
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                client = self._create_client(provider)
+                self._clients[key] = client
+                logger.info("LLMProviderRegistry: cliente criado para %s/%s", provider, model)
+        return client, model
+
+    @staticmethod
+    def _create_client(provider: str) -> Any:
+        # Base URL (ex: fake_llm_server.py para benchmarks offline); local não exige chave de verdade
+        if provider == "anthropic" and ANTHROPIC_AVAILABLE:
+            base_url = settings.ANTHROPIC_BASE_URL or None
+            api_key = os.getenv("ANTHROPIC_API_KEY") or ("local" if base_url else None)
+            if not api_key:
+                raise ValueError("ANTHROPIC_API_KEY não configurada")
+            # Prazo por requisição no próprio SDK; retries ficam com o llm_resilience
+            return Anthropic(api_key=api_key, base_url=base_url, timeout=settings.LLM_TIMEOUT_SECONDS, max_retries=0)
+        if provider == "openai" and OPENAI_AVAILABLE:
+            base_url = settings.OPENAI_BASE_URL or None
+            api_key = os.getenv("OPENAI_API_KEY") or ("local" if base_url else None)
+            if not api_key:
+                raise ValueError("OPENAI_API_KEY não configurada")
+            return openai.OpenAI(api_key=api_key, base_url=base_url, timeout=settings.LLM_TIMEOUT_SECONDS, max_retries=0)
+        raise ValueError(f"Provedor {provider} não disponível ou não configurado")
+
+    @contextmanager
+    def slot(self) -> Iterator[None]:
+        """Reserva uma das LLM_MAX_CONCURRENCY vagas enquanto a requisição ao LLM roda."""
+        with self._lock:
+            self._waiting += 1
+        self._semaphore.acquire()
+        with self._lock:
+            self._waiting -= 1
+            self._in_flight += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._in_flight -= 1
+            self._semaphore.release()
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "clients": sorted(f"{provider}/{model}" for provider, model in self._clients),
+                "base_urls": {"openai": settings.OPENAI_BASE_URL or None, "anthropic": settings.ANTHROPIC_BASE_URL or None},
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "waiting": self._waiting,
+            }
+
+
+def stream_completion(
+    provider: str,
+    client: Any,
+    model: str,
+    system_prompt: str,
+    user_prompt: str,
+    max_tokens: int,
+    temperature: Optional[float] = 0.1,
+    usage: Optional[Dict[str, int]] = None,
+) -> Iterator[str]:
+    """
+    Pedaços de texto da resposta via API de streaming do provedor.
+    Fechar o gerador (close) encerra a conexão do stream. Se usage for passado,
+    recebe input_tokens/output_tokens informados pelo provedor no fim do stream.
+    """
+    if provider == "anthropic":
+        with client.messages.stream(
+            model=model,
+            max_tokens=max_tokens,
+            system=system_prompt,
+            messages=[{"role": "user", "content": user_prompt}],
+        ) as stream:
+            yield from stream.text_stream
+            if usage is not None:
+                final_usage = stream.get_final_message().usage
+                usage["input_tokens"] = final_usage.input_tokens
+                usage["output_tokens"] = final_usage.output_tokens
+    elif provider == "openai":
+        params: Dict[str, Any] = {}
+        if temperature is not None:
+            params["temperature"] = temperature
+        if usage is not None:
+            # Último chunk do stream traz o uso de tokens (choices vazio)
+            params["stream_options"] = {"include_usage": True}
+        stream = client.chat.completions.create(
+            model=model,
+            messages=[
+                {"role": "system", "content": system_prompt},
+                {"role": "user", "content": user_prompt},
+            ],
+            max_tokens=max_tokens,
+            stream=True,
+            **params,
+        )
+        try:
+            for chunk in stream:
+                if chunk.choices and chunk.choices[0].delta.content:
+                    yield chunk.choices[0].delta.content
+                if usage is not None and getattr(chunk, "usage", None):
+                    usage["input_tokens"] = chunk.usage.prompt_tokens
+                    usage["output_tokens"] = chunk.usage.completion_tokens
+        finally:
+            close = getattr(stream, "close", None)
+            if close:
+                close()
+    else:
+        raise ValueError(f"Provedor {provider} não suportado")
+
+llm_providers = LLMProviderRegistry(max_concurrency=settings.LLM_MAX_CONCURRENCY)
@@ -0,0 +1,256 @@
+"""
+Resiliência das chamadas aos LLMs: prazo por chamada, retries com backoff e circuit breaker.
+
+- Prazo: cada tentativa tem LLM_TIMEOUT_SECONDS para terminar (o cliente do SDK
+  também recebe esse timeout, então uma conexão travada não prende a thread).
+- Retries: erros transitórios (timeout, conexão, 429, 5xx) são repetidos até
+  LLM_MAX_RETRIES vezes com backoff exponencial e jitter ("full jitter": espera
+  aleatória entre 0 e min(LLM_BACKOFF_MAX_SECONDS, base * 2^tentativa)).
+- Circuit breaker por provedor: LLM_BREAKER_FAILURES falhas transitórias seguidas
+  abrem o circuito; enquanto aberto as chamadas falham na hora (LLMCallError
+  "circuit_open") e o hedging usa o outro provedor. Depois de
+  LLM_BREAKER_RESET_SECONDS uma chamada de teste (half-open) decide se fecha.
+
+Toda falha sai como LLMCallError (kind + reason), que a API devolve ao cliente
+em vez de cair num fallback silencioso.
+"""
+import logging
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from saas_tools.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Tipos de falha que contam para o circuit breaker (o provedor está degradado)
+BREAKER_KINDS = ("timeout", "connection", "rate_limited", "provider_error")
+
+
+class LLMCallError(RuntimeError):
+    """
+    Falha de uma chamada ao LLM depois dos retries.
+    kind: timeout, connection, rate_limited, provider_error, request_error,
+    not_configured, circuit_open ou invalid_response (resposta sem JSON utilizável).
+    """
+
+    def __init__(self, provider: str, kind: str, reason: str, retryable: bool = False, attempts: int = 1):
+        super().__init__(f"{provider}: {kind} ({reason})")
+        self.provider = provider
+        self.kind = kind
+        self.reason = reason
+        self.retryable = retryable
+        self.attempts = attempts
+
+    @property
+    def http_status(self) -> int:
+        """Status HTTP para devolver ao cliente da API."""
+        return 504 if self.kind == "timeout" else 503 if self.kind in BREAKER_KINDS + ("circuit_open", "not_configured") else 502
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "provider": self.provider,
+            "kind": self.kind,
+            "reason": self.reason,
+            "attempts": self.attempts,
+        }
+
+
+def classify_error(error: BaseException) -> Tuple[str, bool]:
+    """(kind, retryable) de uma exceção do SDK do provedor (sem importar o SDK)."""
+    if isinstance(error, LLMCallError):
+        return error.kind, error.retryable
+    name = type(error).__name__
+    if isinstance(error, TimeoutError) or "Timeout" in name:
+        return "timeout", True
+    status = getattr(error, "status_code", None)
+    if status == 429 or "RateLimit" in name:
+        return "rate_limited", True
+    if isinstance(status, int) and status >= 500 or "InternalServer" in name or "Overloaded" in name:
+        return "provider_error", True
+    if "Connection" in name or isinstance(error, ConnectionError):
+        return "connection", True
+    if isinstance(status, int):
+        return "request_error", False
+    if isinstance(error, ValueError):
+        # llm_providers: chave de API ausente / SDK não instalado
+        return "not_configured", False
+    return "provider_error", False
+
+
+def as_call_error(provider: str, error: BaseException, attempts: int = 1) -> LLMCallError:
+    if isinstance(error, LLMCallError):
+        error.attempts = max(error.attempts, attempts)
+        return error
+    kind, retryable = classify_error(error)
+    return LLMCallError(provider, kind, str(error)[:300] or type(error).__name__, retryable, attempts)
+
+
+class CircuitBreaker:
+    """Estados closed -> open (falha rápido) -> half_open (uma chamada de teste) -> closed."""
+
+    def __init__(self, failure_threshold: int = 5, reset_seconds: float = 30.0):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = "closed"
+        self.consecutive_failures = 0
+        self.opened = 0
+        self.rejected = 0
+        self._opened_at = 0.0
+        self._probe_in_flight = False
+        self._probe_started_at = 0.0
+        self._lock = threading.Lock()
+
+    def allow(self) -> bool:
+        with self._lock:
+            if self.state == "closed":
+                return True
+            now = time.monotonic()
+            if self.state == "open" and now - self._opened_at >= self.reset_seconds:
+                self.state = "half_open"
+                self._probe_in_flight = False
+            if self.state == "half_open" and self._probe_in_flight and now - self._probe_started_at >= self.reset_seconds:
+                # Chamada de teste sem resultado há reset_seconds (perdida): libera outra
+                self._probe_in_flight = False
+            if self.state == "half_open" and not self._probe_in_flight:
+                self._probe_in_flight = True
+                self._probe_started_at = now
+                return True
+            self.rejected += 1
+            return False
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.state = "closed"
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+
+    def release(self) -> None:
+        """Chamada de teste cancelada (o hedging escolheu outra resposta): libera para a próxima."""
+        with self._lock:
+            self._probe_in_flight = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.consecutive_failures += 1
+            if self.state == "half_open" or self.consecutive_failures >= self.failure_threshold:
+                if self.state != "open":
+                    self.opened += 1
+                self.state = "open"
+                self._opened_at = time.monotonic()
+                self._probe_in_flight = False
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "state": self.state,
+                "consecutive_failures": self.consecutive_failures,
+                "opened": self.opened,
+                "rejected": self.rejected,
+            }
+
+
+class LLMResilience:
+    """Prazo + retries com backoff + um circuit breaker por provedor."""
+
+    def __init__(
+        self,
+        timeout_seconds: float = 60.0,
+        max_retries: int = 2,
+        backoff_base_seconds: float = 0.5,
+        backoff_max_seconds: float = 8.0,
+        breaker_failures: int = 5,
+        breaker_reset_seconds: float = 30.0,
+    ):
+        self.timeout_seconds = timeout_seconds
+        self.max_retries = max(0, max_retries)
+        self.backoff_base_seconds = backoff_base_seconds
+        self.backoff_max_seconds = backoff_max_seconds
+        self.breaker_failures = breaker_failures
+        self.breaker_reset_seconds = breaker_reset_seconds
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._counts = {"calls": 0, "retries": 0, "failures": 0, "timeouts": 0}
+        self._lock = threading.Lock()
+
+    def breaker(self, provider: str) -> CircuitBreaker:
+        with self._lock:
+            breaker = self._breakers.get(provider)
+            if breaker is None:
+                breaker = CircuitBreaker(self.breaker_failures, self.breaker_reset_seconds)
+                self._breakers[provider] = breaker
+            return breaker
+
+    def acquire(self, provider: str) -> None:
+        """Falha rápido (LLMCallError circuit_open) se o circuito do provedor estiver aberto."""
+        if not self.breaker(provider).allow():
+            raise LLMCallError(provider, "circuit_open", f"provedor degradado, nova tentativa em até {self.breaker_reset_seconds:.0f}s")
+
+    def record(self, provider: str, error: Optional[BaseException] = None, cancelled: bool = False) -> None:
+        """Resultado de uma chamada ao provedor para o circuit breaker."""
+        breaker = self.breaker(provider)
+        if cancelled:
+            breaker.release()
+            return
+        if error is None:
+            breaker.record_success()
+            return
+        kind, _ = classify_error(error)
+        if kind in BREAKER_KINDS:
+            breaker.record_failure()
+            if breaker.state == "open":
+                logger.warning("LLMResilience: 🔌 circuito de %s aberto (%s)", provider, kind)
+        else:
+            # Erro do pedido (400, chave ausente) não diz nada sobre a saúde do provedor
+            breaker.record_success()
+
+    def backoff(self, attempt: int) -> float:
+        """Espera antes da tentativa attempt+1 (full jitter)."""
+        return random.uniform(0, min(self.backoff_max_seconds, self.backoff_base_seconds * (2 ** attempt)))
+
+    def call(self, provider: str, fn: Callable[[float], Any]) -> Any:
+        """
+        Executa fn(timeout_seconds) com retries nos erros transitórios.
+        Levanta LLMCallError com o motivo da última falha.
+        """
+        with self._lock:
+            self._counts["calls"] += 1
+        attempt = 0
+        while True:
+            try:
+                return fn(self.timeout_seconds)
+            except Exception as e:
+                error = as_call_error(provider, e, attempts=attempt + 1)
+                if not error.retryable or attempt >= self.max_retries:
+                    with self._lock:
+                        self._counts["failures"] += 1
+                        self._counts["timeouts"] += 1 if error.kind == "timeout" else 0
+                    logger.error("LLMResilience: ❌ %s falhou após %d tentativa(s): %s", provider, attempt + 1, error)
+                    raise error from e
+                delay = self.backoff(attempt)
+                attempt += 1
+                with self._lock:
+                    self._counts["retries"] += 1
+                logger.warning("LLMResilience: 🔁 %s %s, tentativa %d em %.2fs", provider, error.kind, attempt + 1, delay)
+                time.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            counts = dict(self._counts)
+            breakers = dict(self._breakers)
+        return {
+            **counts,
+            "timeout_seconds": self.timeout_seconds,
+            "max_retries": self.max_retries,
+            "breakers": {provider: breaker.stats() for provider, breaker in breakers.items()},
+        }
+
+
+llm_resilience = LLMResilience(
+    timeout_seconds=settings.LLM_TIMEOUT_SECONDS,
+    max_retries=settings.LLM_MAX_RETRIES,
+    backoff_base_seconds=settings.LLM_BACKOFF_BASE_SECONDS,
+    backoff_max_seconds=settings.LLM_BACKOFF_MAX_SECONDS,
+    breaker_failures=settings.LLM_BREAKER_FAILURES,
+    breaker_reset_seconds=settings.LLM_BREAKER_RESET_SECONDS,
+)
@@ -0,0 +1,143 @@
+"""
+Roteamento por tamanho entre dois tiers de model: "small" (rápido/barato) e "large".
+
+Antes de cada chamada de análise ou patch, o ModelRouter estima o tamanho e a
+complexidade da entrada: caracteres, quantidade de seções ### (blocos) e se há
+CAMINHOS (rotas são onde os models pequenos mais erram). Entradas pequenas e
+sem CAMINHOS vão para o model small (OPENAI_SMALL_MODEL / ANTHROPIC_SMALL_MODEL);
+o resto vai direto para o large (OPENAI_MODEL / ANTHROPIC_MODEL). Sem um model
+small configurado diferente do large, tudo vai para o large: os defaults de fábrica
+já são os models baratos, então o roteamento só tem efeito depois de configurado.
+
+Quem chama valida a resposta do small (JSON de blocos, seção única no patch) e,
+se ela não passar, repete no large e registra a escalada. stats() mostra a taxa
+de escalada por tarefa para calibrar LLM_ROUTING_SMALL_MAX_CHARS/_MAX_BLOCKS.
+"""
+import logging
+import re
+import threading
+from typing import Any, Dict, Optional
+
+from saas_tools.config import settings
+from saas_tools.services.llm_providers import default_model, small_model_configured
+
+logger = logging.getLogger(__name__)
+
+BLOCK_HEADER_RE = re.compile(r"^###(?!#)", re.MULTILINE)
+CAMINHOS_RE = re.compile(r"CAMINHOS|\[CAM\d+\]", re.IGNORECASE)
+
+
+def estimate_complexity(text: str) -> Dict[str, Any]:
+    """Tamanho da entrada, quantidade de blocos (seções ###) e presença de CAMINHOS."""
+    text = text or ""
+    return {
+        "chars": len(text),
+        "blocks": len(BLOCK_HEADER_RE.findall(text)),
+        "has_caminhos": bool(CAMINHOS_RE.search(text)),
+    }
+
+
+class RouteDecision:
+    """Tier escolhido para uma chamada e o motivo (para log)."""
+
+    def __init__(self, task: str, tier: str, reason: str, complexity: Dict[str, Any]):
+        self.task = task
+        self.tier = tier
+        self.reason = reason
+        self.complexity = complexity
+
+    @property
+    def is_small(self) -> bool:
+        return self.tier == "small"
+
+
+class ModelRouter:
+    """Escolhe o tier por tarefa (analysis, patch) e conta escaladas small -> large."""
+
+    def __init__(self, enabled: bool = True, small_max_chars: int = 6000, small_max_blocks: int = 6):
+        self.enabled = enabled
+        self.small_max_chars = small_max_chars
+        self.small_max_blocks = small_max_blocks
+        self._counts: Dict[str, Dict[str, int]] = {}
+        self._lock = threading.Lock()
+
+    def choose(
+        self,
+        task: str,
+        text: str,
+        block_type: Optional[str] = None,
+        provider: Optional[str] = None,
+    ) -> RouteDecision:
+        """
+        Tier para a entrada text. block_type (patch) conta como CAMINHOS quando o
+        bloco editado é um caminhos, mesmo que a seção não tenha o título. Com
+        provider, o small só é escolhido se for um model diferente do large.
+        """
+        complexity = estimate_complexity(text)
+        if block_type == "caminhos":
+            complexity["has_caminhos"] = True
+
+        if not self.enabled:
+            tier, reason = "large", "roteamento desligado"
+        elif provider and not small_model_configured(provider):
+            tier, reason = "large", "model small não configurado (igual ao large)"
+        elif complexity["has_caminhos"]:
+            tier, reason = "large", "tem CAMINHOS"
+        elif complexity["chars"] > self.small_max_chars:
+            tier, reason = "large", f"{complexity['chars']} caracteres"
+        elif complexity["blocks"] > self.small_max_blocks:
+            tier, reason = "large", f"{complexity['blocks']} blocos"
+        else:
+            tier, reason = "small", f"{complexity['chars']} caracteres, {complexity['blocks']} blocos"
+
+        with self._lock:
+            counts = self._task_counts(task)
+            counts["requests"] += 1
+            counts[tier] += 1
+        logger.info("🧭 [ModelRouter] %s -> %s (%s)", task, tier, reason)
+        return RouteDecision(task, tier, reason, complexity)
+
+    def model_for(self, provider: str, decision: RouteDecision) -> str:
+        return default_model(provider, decision.tier)
+
+    def can_escalate(self, provider: str, decision: RouteDecision) -> bool:
+        """Só vale repetir no large se ele for outro model."""
+        return decision.is_small and default_model(provider, "large") != default_model(provider, "small")
+
+    def record_escalation(self, decision: RouteDecision, reason: str) -> None:
+        with self._lock:
+            self._task_counts(decision.task)["escalations"] += 1
+        logger.warning("⬆️ [ModelRouter] %s escalado para o model large: %s", decision.task, reason)
+
+    def _task_counts(self, task: str) -> Dict[str, int]:
+        return self._counts.setdefault(task, {"requests": 0, "small": 0, "large": 0, "escalations": 0})
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            tasks = {
+                task: {
+                    **counts,
+                    # Fração das chamadas no small que precisaram ser repetidas no large
+                    "escalation_rate": round(counts["escalations"] / counts["small"], 4) if counts["small"] else 0.0,
+                }
+                for task, counts in self._counts.items()
+            }
+        return {
+            "enabled": self.enabled,
+            # Provedores em que o small é outro model (nos demais o roteamento não tem efeito)
+            "small_models": {
+                provider: default_model(provider, "small")
+                for provider in ("anthropic", "openai")
+                if small_model_configured(provider)
+            },
+            "small_max_chars": self.small_max_chars,
+            "small_max_blocks": self.small_max_blocks,
+            "tasks": tasks,
+        }
+
+
+model_router = ModelRouter(
+    enabled=settings.LLM_ROUTING_ENABLED,
+    small_max_chars=settings.LLM_ROUTING_SMALL_MAX_CHARS,
+    small_max_blocks=settings.LLM_ROUTING_SMALL_MAX_BLOCKS,
+)
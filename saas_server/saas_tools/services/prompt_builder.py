@@ -2,6 +2,7 @@
 Monta o prompt final a partir de flow + flow_blocks + flow_routes.
 Usado pela IA de voz (VAPI) ao iniciar ligação.
 """
+import json
 from typing import Dict, Any, List, Optional
 
 from saas_tools.services import flow_service
@@ -16,19 +17,19 @@ def build_prompt_from_flow(
     Monta o texto final do prompt a partir dos dados do banco.
     Cabeçalho + prompt_base + seção FLUXO DA CONVERSA com blocos ordenados.
     """
-    prompt = ""
+    parts: List[str] = []
 
     # PARTE 1: Cabeçalho e Prompt Base
     name = (flow.get("name") or "Flow").upper()
-    prompt += f"# PROMPT - {name}\n\n"
+    parts.append(f"# PROMPT - {name}\n\n")
 
     prompt_base = flow.get("prompt_base") or ""
     if prompt_base:
-        prompt += prompt_base
-        prompt += "\n\n---\n\n"
+        parts.append(prompt_base)
+        parts.append("\n\n---\n\n")
 
     # PARTE 2: Fluxo da Conversa
-    prompt += "## FLUXO DA CONVERSA\n\n"
+    parts.append("## FLUXO DA CONVERSA\n\n")
 
     routes_by_block_id: Dict[str, List[Dict[str, Any]]] = {}
     for route in routes:
@@ -44,10 +45,10 @@ def build_prompt_from_flow(
     for block in sorted_blocks:
         block_id = block.get("id")
         block_routes = routes_by_block_id.get(str(block_id), []) if block_id else []
-        prompt += _format_block(block, block_routes)
-        prompt += "\n---\n\n"
+        parts.append(_format_block(block, block_routes))
+        parts.append("\n---\n\n")
 
-    return prompt
+    return "".join(parts)
 
 
 def _format_block(block: Dict[str, Any], routes: List[Dict[str, Any]]) -> str:
@@ -98,7 +99,6 @@ def _format_block(block: Dict[str, Any], routes: List[Dict[str, Any]]) -> str:
         output += f"**{block.get('content', '')}**\n\n"
         tool_config = block.get("tool_config") or {}
         if isinstance(tool_config, dict) and tool_config:
-            import json
             output += f"Configuracao: {json.dumps(tool_config)}\n\n"
         if next_block_key:
             output += f"**Depois:** Va para [{next_block_key}]\n"
@@ -109,7 +109,6 @@ def _format_block(block: Dict[str, Any], routes: List[Dict[str, Any]]) -> str:
         output += f'"{block.get("content", "")}"\n\n'
         end_meta = block.get("end_metadata") or {}
         if isinstance(end_meta, dict) and end_meta:
-            import json
             output += f"Acao: {block.get('end_type', '')}\n"
             output += f"Metadata: {json.dumps(end_meta)}\n"
 
@@ -0,0 +1,214 @@
+"""
+Compactação do prompt antes da análise pela IA, com orçamento de tokens.
+
+O parser já descarta tudo antes de "## FLUXO DA CONVERSA", mas a IA recebia o
+prompt_voz inteiro: identidade, pronúncia, regras... seções sem nenhum bloco.
+Aqui o prompt passa por:
+
+1. seções irrelevantes: fica só o fluxo (ou, sem "## FLUXO DA CONVERSA", só as
+   seções #/## que têm blocos: [PM001], ### AGUARDAR, ...);
+2. espaços: fim de linha, espaços repetidos, separadores --- e linhas em branco extras;
+3. boilerplate: parágrafos repetidos idênticos (sem ID, fala ou variável) ficam só na 1ª vez;
+4. contagem de tokens local (tiktoken se instalado; senão ~4 caracteres por token);
+5. se ainda passar de AI_ANALYSIS_TOKEN_BUDGET, divide nos cabeçalhos ### em trechos
+   de até AI_ANALYSIS_CHUNK_TOKENS (analisados em paralelo pelo FlowAIAnalyzer).
+"""
+import logging
+import re
+from typing import Any, List, Optional, Tuple
+
+from saas_tools.config import settings
+from saas_tools.services.llm_accounting import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+FLOW_MARKER = "## FLUXO DA CONVERSA"
+# Cabeçalhos de nível 1/2 (# Identidade, ## Regras...); ### são os blocos
+TOP_SECTION_RE = re.compile(r"^#{1,2}(?!#)", re.MULTILINE)
+BLOCK_SIGNAL_RE = re.compile(
+    r"\[(?:PM|AG|CAM|MSG|ENC|FER)\d+\]|^###\s*(?:ABERTURA|AGUARDAR|CAMINHOS|MENSAGEM|ENCERRAR)",
+    re.IGNORECASE | re.MULTILINE,
+)
+# Parágrafos com isso carregam informação do bloco e nunca são tratados como boilerplate
+INFORMATIVE_RE = re.compile(r"\[[A-Z]{2,3}\d+\]|\{\{|\"|^#", re.MULTILINE)
+SEPARATOR_RE = re.compile(r"^\s*-{3,}\s*$")
+INLINE_SPACES_RE = re.compile(r"[ \t]+")
+BLOCK_HEADER_RE = re.compile(r"^###(?!#)")
+
+
+_encoding: Any = None
+
+
+def _get_encoding() -> Any:
+    """Encoding do tiktoken carregado na primeira contagem (False se indisponível)."""
+    global _encoding
+    if _encoding is None:
+        try:
+            _encoding = tiktoken.get_encoding("o200k_base") if TIKTOKEN_AVAILABLE else False
+        except Exception as e:
+            # Sem o arquivo do encoding em cache (e sem rede): fica na estimativa
+            logger.warning("PromptCompactor: tiktoken indisponível (%s), usando estimativa", e)
+            _encoding = False
+    return _encoding
+
+
+def count_tokens(text: str) -> int:
+    """Tokens do texto (tiktoken quando disponível; senão a estimativa do llm_accounting)."""
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding:
+        return len(encoding.encode(text, disallowed_special=()))
+    return estimate_tokens(text)
+
+
+class CompactedPrompt:
+    """Texto compactado, trechos dentro do orçamento e quanto foi economizado."""
+
+    def __init__(self, text: str, sections: List[str], section_tokens: List[int],
+                 original_chars: int, original_tokens: int, removed: List[str], budget_tokens: int):
+        self.text = text
+        self.sections = sections
+        self.section_tokens = section_tokens
+        self.tokens = sum(section_tokens)
+        self.original_chars = original_chars
+        self.original_tokens = original_tokens
+        self.removed = removed
+        self.budget_tokens = budget_tokens
+
+    @property
+    def over_budget(self) -> bool:
+        return self.tokens > self.budget_tokens
+
+    def chunks(self, max_tokens: Optional[int] = None) -> List[str]:
+        """Seções ### agrupadas em trechos de até max_tokens (padrão AI_ANALYSIS_CHUNK_TOKENS)."""
+        return group_by_tokens(self.sections, max_tokens or settings.AI_ANALYSIS_CHUNK_TOKENS, self.section_tokens)
+
+    def stats(self) -> dict:
+        return {
+            "original_chars": self.original_chars,
+            "chars": len(self.text),
+            "original_tokens": self.original_tokens,
+            "tokens": self.tokens,
+            "budget_tokens": self.budget_tokens,
+            "removed_sections": self.removed,
+        }
+
+
+def _top_sections(prompt: str) -> List[str]:
+    """Divide nos cabeçalhos # / ## (texto antes do primeiro vira o primeiro elemento)."""
+    starts = [m.start() for m in TOP_SECTION_RE.finditer(prompt)]
+    if not starts or starts[0] != 0:
+        starts.insert(0, 0)
+    return [prompt[start:end] for start, end in zip(starts, starts[1:] + [len(prompt)])]
+
+
+def select_flow_text(prompt: str) -> Tuple[str, List[str]]:
+    """
+    Só o que tem blocos. Retorna (texto, títulos removidos). Sem nenhuma seção com
+    sinal de bloco (prompt livre), devolve o prompt inteiro: a IA é que vai achar os blocos.
+    """
+    removed: List[str] = []
+    flow_start = prompt.find(FLOW_MARKER)
+    if flow_start > 0:
+        removed.extend(s.split("\n", 1)[0].strip() for s in _top_sections(prompt[:flow_start]) if s.strip())
+        prompt = prompt[flow_start:]
+
+    kept: List[str] = []
+    for section in _top_sections(prompt):
+        if section.startswith(FLOW_MARKER) or BLOCK_SIGNAL_RE.search(section):
+            kept.append(section)
+        elif section.strip():
+            removed.append(section.split("\n", 1)[0].strip())
+    if not kept:
+        return prompt, []
+    return "".join(kept), [title for title in removed if title]
+
+
+def compact_text(text: str) -> str:
+    """Espaços, separadores --- e boilerplate repetido (ver docstring do módulo)."""
+    lines: List[str] = []
+    for raw in text.splitlines():
+        if SEPARATOR_RE.match(raw):
+            continue
+        line = INLINE_SPACES_RE.sub(" ", raw).strip()
+        if not line and (not lines or not lines[-1]):
+            continue
+        if line and lines and lines[-1] == line:
+            continue
+        lines.append(line)
+
+    seen = set()
+    paragraphs: List[str] = []
+    for paragraph in "\n".join(lines).split("\n\n"):
+        if not INFORMATIVE_RE.search(paragraph):
+            if paragraph in seen:
+                continue
+            seen.add(paragraph)
+        paragraphs.append(paragraph)
+    return "\n\n".join(paragraphs).strip() + "\n"
+
+
+def split_block_sections(text: str) -> List[str]:
+    """Divide nos cabeçalhos ### (o texto antes do primeiro vai junto com ele)."""
+    sections: List[str] = []
+    current: List[str] = []
+    has_header = False
+    for line in text.splitlines(keepends=True):
+        if BLOCK_HEADER_RE.match(line):
+            if has_header:
+                sections.append("".join(current))
+                current = []
+            has_header = True
+        current.append(line)
+    if current:
+        sections.append("".join(current))
+    return sections
+
+
+def group_by_tokens(sections: List[str], max_tokens: int, section_tokens: Optional[List[int]] = None) -> List[str]:
+    """Agrupa seções consecutivas em trechos de até max_tokens (uma seção maior vira um trecho sozinha)."""
+    if section_tokens is None:
+        section_tokens = [count_tokens(section) for section in sections]
+    chunks: List[str] = []
+    buffer: List[str] = []
+    buffer_tokens = 0
+    for section, tokens in zip(sections, section_tokens):
+        if buffer and buffer_tokens + tokens > max_tokens:
+            chunks.append("".join(buffer))
+            buffer, buffer_tokens = [], 0
+        buffer.append(section)
+        buffer_tokens += tokens
+    if buffer and "".join(buffer).strip():
+        chunks.append("".join(buffer))
+    return chunks
+
+
+def compact_prompt(prompt: str, budget_tokens: Optional[int] = None) -> CompactedPrompt:
+    """Compacta o prompt para a análise pela IA e conta os tokens (ver docstring do módulo)."""
+    budget_tokens = budget_tokens or settings.AI_ANALYSIS_TOKEN_BUDGET
+    flow_text, removed = select_flow_text(prompt or "")
+    text = compact_text(flow_text)
+    sections = split_block_sections(text)
+    section_tokens = [count_tokens(section) for section in sections]
+    compacted = CompactedPrompt(
+        text=text,
+        sections=sections,
+        section_tokens=section_tokens,
+        original_chars=len(prompt or ""),
+        original_tokens=count_tokens(prompt or ""),
+        removed=removed,
+        budget_tokens=budget_tokens,
+    )
+    logger.info(
+        "✂️ [PromptCompactor] %d -> %d tokens (%d -> %d caracteres, %d seções removidas%s)",
+        compacted.original_tokens, compacted.tokens, compacted.original_chars, len(text), len(removed),
+        ", acima do orçamento" if compacted.over_budget else "",
+    )
+    return compacted
@@ -0,0 +1,201 @@
+"""
+Sessões de parse incremental do prompt_base (POST /flows/parse-prompt).
+
+A tela de importação manda o prompt inteiro a cada edição. A sessão guarda o
+resultado do parser por seção ###, chaveado pelo hash do texto da seção. Na
+próxima chamada o prompt é tokenizado de novo (uma passada linear, barata) e só
+as seções com hash novo passam pelo parser (as regex de conteúdo/rotas, que são
+o custo real). A resposta traz o diff por bloco contra a chamada anterior:
+added, removed, changed e reordered.
+
+As sessões ficam em memória (LRU + TTL, PARSE_SESSION_MAX_ENTRIES /
+PARSE_SESSION_TTL_SECONDS); sessão expirada ou desconhecida vira uma nova com
+parse completo.
+"""
+import hashlib
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import Any, Dict, List, Optional, Tuple
+
+from saas_tools.config import settings
+from saas_tools.services.prompt_parser import ParsedSection, assemble_blocks, parse_section, tokenize_prompt_flow
+
+logger = logging.getLogger(__name__)
+
+# Campos que mudam só porque outro bloco entrou/saiu antes (contam como reordered)
+POSITION_FIELDS = ("order_index", "position_y")
+
+
+def section_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _comparable(block: Dict[str, Any], routes: List[Dict[str, Any]]) -> Tuple[Dict[str, Any], List[Dict[str, Any]]]:
+    return {k: v for k, v in block.items() if k not in POSITION_FIELDS}, routes
+
+
+def diff_blocks(
+    previous: Dict[str, Tuple[Dict[str, Any], List[Dict[str, Any]]]],
+    current: Dict[str, Tuple[Dict[str, Any], List[Dict[str, Any]]]],
+) -> Dict[str, Any]:
+    """Diff por block_key entre dois parses ({block_key: (bloco, rotas)})."""
+    added = [key for key in current if key not in previous]
+    removed = [key for key in previous if key not in current]
+    changed: List[str] = []
+    reordered: List[str] = []
+    unchanged = 0
+    for key, (block, routes) in current.items():
+        if key not in previous:
+            continue
+        old_block, old_routes = previous[key]
+        if block == old_block and routes == old_routes:
+            unchanged += 1
+        elif _comparable(block, routes) == _comparable(old_block, old_routes):
+            reordered.append(key)
+        else:
+            changed.append(key)
+    return {"added": added, "removed": removed, "changed": changed, "reordered": reordered, "unchanged": unchanged}
+
+
+class ParseSession:
+    """Resultado por seção (hash -> bloco/rotas) e o último parse de um prompt."""
+
+    def __init__(self, session_id: str, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str]):
+        self.id = session_id
+        self.flow_id = flow_id
+        self.assistente_id = assistente_id
+        self.tenant_id = tenant_id
+        self.version = 0
+        self._sections: Dict[str, Optional[ParsedSection]] = {}
+        self._blocks: Dict[str, Tuple[Dict[str, Any], List[Dict[str, Any]]]] = {}
+        self.lock = threading.Lock()
+
+    def reset(self, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str]) -> None:
+        """Os blocos/rotas carregam flow_id/assistente_id/tenant_id: mudou algum, nada é reaproveitado."""
+        self.flow_id, self.assistente_id, self.tenant_id = flow_id, assistente_id, tenant_id
+        self._sections = {}
+
+    def parse(self, prompt_base: str) -> Dict[str, Any]:
+        """Parse incremental; chamar com self.lock."""
+        started = time.perf_counter()
+        # Sem classificar: block_key/block_type só das seções que mudaram (parse_section)
+        tokens = tokenize_prompt_flow(prompt_base, classify=False)
+        sections: Dict[str, Optional[ParsedSection]] = {}
+        parsed: List[Optional[ParsedSection]] = []
+        reparsed = 0
+        for token in tokens:
+            key = section_hash(prompt_base[token.start:token.end])
+            if key in sections:
+                result = sections[key]
+            elif key in self._sections:
+                result = self._sections[key]
+            else:
+                token.classify()
+                result = parse_section(token, self.flow_id, self.assistente_id, self.tenant_id)
+                reparsed += 1
+            sections[key] = result
+            parsed.append(result)
+        # Só as seções do prompt atual: hashes de versões antigas não voltam a ser úteis
+        self._sections = sections
+
+        blocks, routes = assemble_blocks(parsed)
+        routes_by_block: Dict[str, List[Dict[str, Any]]] = {}
+        for route in routes:
+            routes_by_block.setdefault(route["block_key"], []).append(route)
+        current = {block["block_key"]: (block, routes_by_block.get(block["block_key"], [])) for block in blocks}
+        diff = diff_blocks(self._blocks, current)
+        self._blocks = current
+        self.version += 1
+
+        stats = {
+            "version": self.version,
+            "sections": len(tokens),
+            "reparsed_sections": reparsed,
+            "reused_sections": len(tokens) - reparsed,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+        logger.info(
+            "🧩 [ParseSession] %s v%d: %d/%d seções reparseadas, +%d -%d ~%d blocos (%.1fms)",
+            self.id, self.version, reparsed, len(tokens), len(diff["added"]), len(diff["removed"]),
+            len(diff["changed"]), stats["duration_ms"],
+        )
+        return {"blocks": blocks, "routes": routes, "diff": diff, "stats": stats}
+
+
+class ParseSessionStore:
+    """LRU thread-safe de ParseSession com TTL por inatividade."""
+
+    def __init__(self, max_entries: int = 200, ttl_seconds: float = 1800.0):
+        self.max_entries = max(1, max_entries)
+        self.ttl_seconds = ttl_seconds
+        self._sessions: "OrderedDict[str, Tuple[float, ParseSession]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.created = 0
+        self.resumed = 0
+        self.expired = 0
+        self.evictions = 0
+
+    def _get_or_create(self, session_id: Optional[str], flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str]) -> ParseSession:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._sessions.pop(session_id, None) if session_id else None
+            if entry and self.ttl_seconds and now - entry[0] > self.ttl_seconds:
+                self.expired += 1
+                entry = None
+            if entry:
+                session = entry[1]
+                self.resumed += 1
+            else:
+                session = ParseSession(uuid.uuid4().hex, flow_id, assistente_id, tenant_id)
+                self.created += 1
+            self._sessions[session.id] = (now, session)
+            while len(self._sessions) > self.max_entries:
+                self._sessions.popitem(last=False)
+                self.evictions += 1
+        return session
+
+    def parse(
+        self,
+        prompt_base: str,
+        flow_id: str,
+        assistente_id: Optional[str],
+        tenant_id: Optional[str],
+        session_id: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        """
+        Parse do prompt_base na sessão session_id (ou numa nova). Retorna blocks,
+        routes, diff (contra a chamada anterior da sessão), stats e session_id.
+        """
+        session = self._get_or_create(session_id, flow_id, assistente_id, tenant_id)
+        with session.lock:
+            if (session.flow_id, session.assistente_id, session.tenant_id) != (flow_id, assistente_id, tenant_id):
+                session.reset(flow_id, assistente_id, tenant_id)
+            result = session.parse(prompt_base)
+        result["session_id"] = session.id
+        result["stats"]["resumed"] = session.id == session_id
+        return result
+
+    def discard(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "size": len(self._sessions),
+                "max_entries": self.max_entries,
+                "ttl_seconds": self.ttl_seconds,
+                "created": self.created,
+                "resumed": self.resumed,
+                "expired": self.expired,
+                "evictions": self.evictions,
+            }
+
+
+parse_session_store = ParseSessionStore(
+    max_entries=settings.PARSE_SESSION_MAX_ENTRIES,
+    ttl_seconds=settings.PARSE_SESSION_TTL_SECONDS,
+)
@@ -1,11 +1,17 @@
 """
 Parser para extrair blocos e rotas do prompt_base estruturado.
 Analisa o prompt_base e gera blocos/rotas automaticamente.
+
+As seções vêm do prompt_tokenizer (uma passada, spans no texto original) e todos
+os padrões são compilados uma vez no carregamento do módulo.
 """
 import re
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterable, Optional, Tuple
 import logging
 
+from saas_tools.services.prompt_section_index import PromptSectionIndex
+from saas_tools.services.prompt_tokenizer import FLOW_MARKER, SectionToken, tokenize_prompt
+
 logger = logging.getLogger(__name__)
 
 # Padrões para identificar blocos no prompt
@@ -40,398 +46,372 @@ BLOCK_PATTERNS = {
     ],
 }
 
+PREFIX_MAP = {
+    'primeira_mensagem': 'PM',
+    'aguardar': 'AG',
+    'caminhos': 'CAM',
+    'mensagem': 'MSG',
+    'encerrar': 'ENC',
+}
+
+BLOCK_KEY_RE = re.compile(r'\[([A-Z]{2,3}\d+)\]')
+NUMBER_RE = re.compile(r'(\d+)')
+FLOW_BLOCK_MARKER_RE = re.compile(r'\[(PM|AG|CAM|MSG|ENC)\d+\]')
+
+# Fala da primeira_mensagem / mensagem (em ordem de prioridade)
+SPEECH_PATTERNS = [
+    re.compile(r'fale[:\s]*\n\s*"([^"]+)"', re.IGNORECASE | re.DOTALL | re.MULTILINE),  # Fale: seguido de quebra de linha e aspas duplas - PRIORIDADE
+    re.compile(r'(?:fale|Fale)[^\"]*"([^"]+)"', re.IGNORECASE | re.DOTALL | re.MULTILINE),  # Qualquer coisa entre "fale" e aspas (inclui quebras de linha)
+    re.compile(r'fale[:\s]+"([^"]+)"', re.IGNORECASE | re.DOTALL | re.MULTILINE),  # Fale: seguido diretamente de aspas duplas
+    re.compile(r'fale[:\s]+""([^"]+)""', re.IGNORECASE | re.DOTALL | re.MULTILINE),  # Aspas duplas duplas (markdown)
+    re.compile(r'fale[:\s]+\'([^\']+)\'', re.IGNORECASE | re.DOTALL | re.MULTILINE),  # Aspas simples
+]
+LISTEN_RE = re.compile(r'Escute[^\.]+\.', re.IGNORECASE)
+# Fala do encerrar
+CLOSING_PATTERNS = [
+    re.compile(r'fale.*encerrar[:\s]*\n\s*"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Fale antes de encerrar: seguido de quebra de linha e aspas
+    re.compile(r'(?:fale|Fale)[^\"]*"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Qualquer coisa entre "fale" e aspas (inclui quebras)
+    re.compile(r'fale.*encerrar[:\s]+"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Fale antes de encerrar: seguido diretamente de aspas
+    re.compile(r'fale:\s*"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Apenas "Fale:" com aspas duplas simples
+]
+ANALYSIS_RE = re.compile(r'Analisando[^\n]+|É [^\?]+\?', re.IGNORECASE)
+
+# Fallbacks quando extract_block_content não acha a fala
+FALLBACK_PATTERNS = {
+    'primeira_mensagem': [
+        re.compile(r'fale[:\s]+["\']([^"\']+)["\']', re.IGNORECASE | re.DOTALL),  # Aspas simples ou duplas
+        re.compile(r'fale[:\s]+""([^"]+)""', re.IGNORECASE | re.DOTALL),  # Aspas duplas duplas (markdown)
+        re.compile(r'fale[:\s]+"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Aspas duplas simples
+    ],
+    'mensagem': [
+        re.compile(r'Fale:\s*["\']([^"\']+)["\']', re.IGNORECASE | re.DOTALL),  # Aspas simples ou duplas
+        re.compile(r'Fale:\s*""([^"]+)""', re.IGNORECASE | re.DOTALL),  # Aspas duplas duplas
+        re.compile(r'Fale:\s*"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Aspas duplas simples
+        re.compile(r'Fale:\s*([^\n]+)', re.IGNORECASE | re.DOTALL),  # Qualquer coisa após "Fale:"
+    ],
+    'encerrar': [
+        re.compile(r'Fale.*encerrar[:\s]+["\']([^"\']+)["\']', re.IGNORECASE | re.DOTALL),  # Com "encerrar" no texto
+        re.compile(r'Fale:\s*["\']([^"\']+)["\']', re.IGNORECASE | re.DOTALL),  # Apenas "Fale:"
+        re.compile(r'Fale:\s*""([^"]+)""', re.IGNORECASE | re.DOTALL),  # Aspas duplas duplas
+        re.compile(r'Fale:\s*"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Aspas duplas simples
+    ],
+}
+LISTEN_OR_SAVE_RE = re.compile(r'(Escute[^\.]+|Salvar[^\.]+)', re.IGNORECASE)
+
+# Próximo bloco: "Va para [AG001]", "Continue para [MSG001]"... e por fim qualquer [ID].
+# Cada padrão vem com a palavra que ele exige: regex com IGNORECASE não usa a busca
+# rápida por literal, então um "in" no texto em minúsculas descarta antes.
+NEXT_BLOCK_PATTERNS = [
+    ('va para', re.compile(r'Va para\s+\[([A-Z]+\d+)\]', re.IGNORECASE)),
+    ('continue para', re.compile(r'Continue para\s+\[([A-Z]+\d+)\]', re.IGNORECASE)),
+    ('encerre em', re.compile(r'Encerre em\s+\[([A-Z]+\d+)\]', re.IGNORECASE)),
+    ('volte para', re.compile(r'Volte para\s+\[([A-Z]+\d+)\]', re.IGNORECASE)),
+    ('[', re.compile(r'\[([A-Z]+\d+)\]', re.IGNORECASE)),
+]
+VARIABLE_PATTERNS = [
+    re.compile(r'Salvar.*em:\s*\{\{([^}]+)\}\}'),
+    re.compile(r'\{\{([^}]+)\}\}'),
+]
+
+# Rotas dos CAMINHOS
+ROUTE_SPLIT_SYMBOL_RE = re.compile(r'\n(?=####+\s*[+\-x?])')
+ROUTE_SPLIT_HEADING_RE = re.compile(r'\n####+')
+ROUTE_LINE_RE = re.compile(r'^(?!-{3,}\s*$)[+\-x?]')  # separador --- não é rota
+ROUTE_SYMBOL_RE = re.compile(r'^####+\s*([+\-x?])')
+ROUTE_LABEL_PATTERNS = [
+    re.compile(r'^####+\s*[+\-x?]\s*([^:\n]+?)(?:\n|$)', re.MULTILINE),  # #### + Label
+    re.compile(r'^[+\-x?]\s*([^:\n]+?)(?:\n|$)', re.MULTILINE),  # + Label
+    re.compile(r'^[+\-x?✅❌]\s*([^:\n]+?)(?:\n|$)', re.MULTILINE),  # + Label (com emoji)
+]
+ROUTE_LABEL_PREFIX_RE = re.compile(r'^[+\-x?✅❌####\s]+')
+FIRST_LINE_RE = re.compile(r'^(.+?)(?:\n|$)')
+KEYWORDS_RE = re.compile(r'Quando.*disser[:\s]+([^\n]+)', re.IGNORECASE)
+KEYWORD_ITEM_RE = re.compile(r'`([^`]+)`|["\']([^"\']+)["\']')
+# Resposta da rota (suporta aspas duplas duplas "")
+ROUTE_RESPONSE_PATTERNS = [
+    re.compile(r'Fale:\s*""([^"]+)""', re.IGNORECASE | re.DOTALL),  # Aspas duplas duplas (markdown)
+    re.compile(r'Fale:\s*"([^"]+)"', re.IGNORECASE | re.DOTALL),  # Aspas duplas simples
+    re.compile(r'Fale:\s*\'([^\']+)\'', re.IGNORECASE | re.DOTALL),  # Aspas simples
+    re.compile(r'Fale:\s*([^\n]+)', re.IGNORECASE | re.DOTALL),  # Qualquer coisa após "Fale:"
+]
+
 
 def extract_block_key(text: str, block_type: str = '') -> Optional[str]:
     """Extrai o block_key (ex: PM001, AG001) do texto."""
     # Procurar por padrões como [PM001], [AG001], etc.
-    pattern = r'\[([A-Z]{2,3}\d+)\]'
-    matches = re.findall(pattern, text)
-    if matches:
-        return matches[0].upper()
-    
+    match = BLOCK_KEY_RE.search(text)
+    if match:
+        return match.group(1).upper()
+
     # Se não encontrar e temos um tipo, tentar gerar baseado no tipo
     if block_type:
-        prefix_map = {
-            'primeira_mensagem': 'PM',
-            'aguardar': 'AG',
-            'caminhos': 'CAM',
-            'mensagem': 'MSG',
-            'encerrar': 'ENC',
-        }
-        prefix = prefix_map.get(block_type, 'BLK')
+        prefix = PREFIX_MAP.get(block_type, 'BLK')
         # Tentar encontrar número no texto
-        num_match = re.search(r'(\d+)', text)
+        num_match = NUMBER_RE.search(text)
         if num_match:
             num = num_match.group(1)
             return f"{prefix}{num.zfill(3)}"
         # Se não encontrar número, usar 001 como padrão
         return f"{prefix}001"
-    
+
     return None
 
 
+def _first_group(patterns: List[re.Pattern], text: str) -> str:
+    """Primeiro grupo com mais de 5 caracteres (sem aspas) entre os padrões, em ordem."""
+    for pattern in patterns:
+        match = pattern.search(text)
+        if match:
+            content = match.group(1).strip().strip('"\'')
+            if content and len(content) > 5:  # Ignorar conteúdo muito curto
+                return content
+    return ''
+
+
 def extract_block_content(text: str, block_type: str) -> str:
     """Extrai o conteúdo do bloco do texto."""
     # Para primeira_mensagem e mensagem: procurar texto entre aspas após "Fale:"
     if block_type in ['primeira_mensagem', 'mensagem']:
-        # Primeiro, procurar por linhas que têm "Fale:" seguido de aspas na mesma linha ou próxima
         # Padrão: **Ao iniciar a ligacao, fale:**\n\n"texto aqui"
-        patterns = [
-            r'fale[:\s]*\n\s*"([^"]+)"',  # Fale: seguido de quebra de linha e aspas duplas - PRIORIDADE
-            r'(?:fale|Fale)[^\"]*"([^"]+)"',  # Qualquer coisa entre "fale" e aspas (inclui quebras de linha)
-            r'fale[:\s]+"([^"]+)"',  # Fale: seguido diretamente de aspas duplas
-            r'fale[:\s]+""([^"]+)""',  # Aspas duplas duplas (markdown)
-            r'fale[:\s]+\'([^\']+)\'',  # Aspas simples
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL | re.MULTILINE)
-            if match:
-                content = match.group(1).strip()
-                content = content.strip('"\'')  # Remover aspas se ainda tiver
-                if content and len(content) > 5:  # Ignorar conteúdo muito curto
-                    print(f"🔍 [PARSER] extract_block_content: Encontrado conteúdo com padrão: {content[:50]}")
-                    return content
-        print(f"⚠️ [PARSER] extract_block_content: Não encontrou conteúdo para {block_type}")
-    
+        content = _first_group(SPEECH_PATTERNS, text)
+        if not content:
+            logger.debug("⚠️ [PARSER] extract_block_content: Não encontrou conteúdo para %s", block_type)
+        return content
+
     # Para aguardar: procurar descrição após "Escute" ou "Salvar"
-    elif block_type == 'aguardar':
-        # Procurar por "Escute" seguido de descrição
-        match = re.search(r'Escute[^\.]+\.', text, re.IGNORECASE)
+    if block_type == 'aguardar':
+        match = LISTEN_RE.search(text)
         if match:
-            content = match.group(0).strip()
-            return content
+            return match.group(0).strip()
         # Fallback
         return "Escute a resposta do lead"
-    
+
     # Para encerrar: procurar mensagem após "Fale antes de encerrar" ou "Fale:"
-    elif block_type == 'encerrar':
-        patterns = [
-            r'fale.*encerrar[:\s]*\n\s*"([^"]+)"',  # Fale antes de encerrar: seguido de quebra de linha e aspas
-            r'(?:fale|Fale)[^\"]*"([^"]+)"',  # Qualquer coisa entre "fale" e aspas (inclui quebras)
-            r'fale.*encerrar[:\s]+"([^"]+)"',  # Fale antes de encerrar: seguido diretamente de aspas
-            r'fale:\s*"([^"]+)"',  # Apenas "Fale:" com aspas duplas simples
-        ]
-        for pattern in patterns:
-            match = re.search(pattern, text, re.IGNORECASE | re.DOTALL)
-            if match:
-                content = match.group(1).strip()
-                content = content.strip('"\'')
-                if content and len(content) > 5:
-                    print(f"🔍 [PARSER] extract_block_content (encerrar): Encontrado: {content[:50]}")
-                    return content
-        print(f"⚠️ [PARSER] extract_block_content (encerrar): Não encontrou conteúdo, usando fallback")
-        return "Encerrar ligação"
-    
+    if block_type == 'encerrar':
+        content = _first_group(CLOSING_PATTERNS, text)
+        if not content:
+            logger.debug("⚠️ [PARSER] extract_block_content (encerrar): Não encontrou conteúdo, usando fallback")
+        return content or "Encerrar ligação"
+
     # Para caminhos: retornar a pergunta ou análise
-    elif block_type == 'caminhos':
+    if block_type == 'caminhos':
         # Procurar por "Analisando:" ou pergunta após "É a pessoa certa?"
-        match = re.search(r'Analisando[^\n]+|É [^\?]+\?', text, re.IGNORECASE)
+        match = ANALYSIS_RE.search(text)
         if match:
             return match.group(0).strip()
         return "Analisar resposta"
-    
+
     return ''
 
 
-def extract_next_block(text: str) -> Optional[str]:
-    """Extrai o próximo bloco (ex: AG001) do texto."""
+def _search_from_cue(pattern: re.Pattern, text: str, lowered: str, cue: str) -> Optional[re.Match]:
+    """
+    pattern.search(text) para padrões que começam pela palavra cue (sem distinção de
+    caixa): a busca começa na primeira ocorrência dela em lowered (= text.lower()).
+    Padrão com IGNORECASE não usa a busca rápida por literal, então pular o trecho
+    antes da palavra é o que mais economiza nas rotas.
+    """
+    position = lowered.find(cue)
+    if position < 0:
+        return None
+    # lower() pode mudar o tamanho do texto (ex.: "İ"); aí as posições não batem
+    return pattern.search(text, position if len(lowered) == len(text) else 0)
+
+
+def extract_next_block(text: str, lowered: Optional[str] = None) -> Optional[str]:
+    """Extrai o próximo bloco (ex: AG001) do texto. lowered: text.lower(), se já calculado."""
     # Procurar por padrões como "Va para [AG001]", "Continue para [MSG001]", etc.
-    patterns = [
-        r'Va para\s+\[([A-Z]+\d+)\]',
-        r'Continue para\s+\[([A-Z]+\d+)\]',
-        r'Encerre em\s+\[([A-Z]+\d+)\]',
-        r'Volte para\s+\[([A-Z]+\d+)\]',
-        r'\[([A-Z]+\d+)\]',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text, re.IGNORECASE)
+    if lowered is None:
+        lowered = text.lower()
+    for cue, pattern in NEXT_BLOCK_PATTERNS:
+        match = _search_from_cue(pattern, text, lowered, cue)
         if match:
             return match.group(1).upper()
-    
+
     return None
 
 
 def extract_variable_name(text: str) -> Optional[str]:
     """Extrai o nome da variável (ex: confirmacao_nome) do texto."""
     # Procurar por padrões como {{variavel}} ou "Salvar em: {{variavel}}"
-    patterns = [
-        r'Salvar.*em:\s*\{\{([^}]+)\}\}',
-        r'\{\{([^}]+)\}\}',
-    ]
-    
-    for pattern in patterns:
-        match = re.search(pattern, text)
+    for pattern in VARIABLE_PATTERNS:
+        match = pattern.search(text)
         if match:
             var = match.group(1).strip()
             # Remover chaves se ainda tiver
             var = var.replace('{{', '').replace('}}', '').strip()
             return var if var else None
-    
+
     return None
 
 
-def parse_prompt_base_to_blocks(prompt_base: str, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str]) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+def _fallback_content(section: str, block_type: str) -> str:
+    """Conteúdo quando extract_block_content não achou nada (padrões mais permissivos)."""
+    if block_type == 'aguardar':
+        match = LISTEN_OR_SAVE_RE.search(section)
+        return match.group(1).strip() if match else "Escute a resposta do lead"
+
+    for pattern in FALLBACK_PATTERNS.get(block_type, []):
+        match = pattern.search(section)
+        if match:
+            content = match.group(1).strip()
+            if block_type != 'primeira_mensagem':
+                # Limpar aspas se ainda tiver
+                content = content.strip('"\'')
+            if content:
+                return content
+
+    return "Encerrar ligação" if block_type == 'encerrar' else ''
+
+
+def _is_intro_section(section: str) -> bool:
+    """Cabeçalho "FLUXO DA CONVERSA" sem blocos ou explicação do formato (FALAR = ...)."""
+    section_upper = section.upper()
+
+    # Pular seção "FLUXO DA CONVERSA" só se NÃO tiver conteúdo de bloco (só o título)
+    if 'FLUXO DA CONVERSA' in section_upper:
+        section_without_title = section.replace('FLUXO DA CONVERSA', '').replace('##', '').strip()
+        has_blocks = bool(FLOW_BLOCK_MARKER_RE.search(section))
+        has_sections = 'ABERTURA' in section_upper or 'AGUARDAR' in section_upper or 'CAMINHOS' in section_upper
+        if len(section_without_title) < 20 and not has_blocks and not has_sections:
+            return True
+
+    # Seções que contêm apenas texto introdutório (explicações sobre Falar, Aguardar, etc)
+    return 'FALAR' in section_upper and '=' in section and 'ABERTURA' not in section_upper and 'AGUARDAR' not in section_upper
+
+
+def block_from_token(token: SectionToken, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str], order_index: int) -> Optional[Dict[str, Any]]:
+    """Bloco (formato flow_blocks) de uma seção já tokenizada; None se não for bloco."""
+    if not token.block_key or not token.block_type:
+        return None
+
+    section = token.text
+    block_key, block_type = token.block_key, token.block_type
+    content = extract_block_content(section, block_type)
+    if not content or len(content.strip()) < 5:
+        content = _fallback_content(section, block_type)
+
+    block: Dict[str, Any] = {
+        "flow_id": flow_id,
+        "assistente_id": assistente_id,
+        "tenant_id": tenant_id,
+        "block_key": block_key,
+        "block_type": block_type,
+        "content": content or f"Bloco {block_key}",
+        # Só o corpo: o [ID] do cabeçalho é o próprio bloco, não o próximo
+        "next_block_key": extract_next_block(token.body),
+        "order_index": order_index,
+        "position_x": 100,
+        "position_y": order_index * 150,
+        "tool_config": {},
+        "end_metadata": {},
+    }
+
+    if block_type in ('aguardar', 'caminhos'):
+        variable = extract_variable_name(section)
+        if variable:
+            block["variable_name" if block_type == 'aguardar' else "analyze_variable"] = variable
+
+    return block
+
+
+ParsedSection = Tuple[Dict[str, Any], List[Dict[str, Any]]]
+
+
+def parse_section(token: SectionToken, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str]) -> Optional[ParsedSection]:
     """
-    Analisa o prompt_base e gera blocos e rotas automaticamente.
-    Retorna (blocks, routes) no formato para inserir no banco.
+    (bloco, rotas) de uma seção; None se ela não for bloco. Depende só do texto da
+    seção (order_index/position_y ficam para assemble_blocks, que conhece a posição).
     """
-    print(f"🔍 [PARSER] parse_prompt_base_to_blocks: Iniciando parse para flow_id={flow_id}")
-    print(f"🔍 [PARSER] prompt_base length: {len(prompt_base) if prompt_base else 0}")
-    
+    section = token.text
+    if not section or _is_intro_section(section):
+        return None
+
+    block = block_from_token(token, flow_id, assistente_id, tenant_id, 0)
+    if not block:
+        logger.debug("⚠️ [PARSER] Seção não reconhecida (sem block_key/block_type): %s", token.header[:100])
+        return None
+
+    routes: List[Dict[str, Any]] = []
+    # Para caminhos, extrair rotas (subcabeçalhos #### já vêm como spans do tokenizador)
+    if block["block_type"] == 'caminhos':
+        routes = extract_routes_from_section(
+            section, block["block_key"], flow_id, assistente_id, tenant_id,
+            route_texts=token.route_texts() if token.route_spans else None,
+        )
+    return block, routes
+
+
+def assemble_blocks(parsed_sections: Iterable[Optional[ParsedSection]]) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """Junta as seções em ordem: descarta duplicatas de block_key e numera order_index/position_y."""
     blocks: List[Dict[str, Any]] = []
     routes: List[Dict[str, Any]] = []
-    
-    if not prompt_base or not prompt_base.strip():
-        print(f"⚠️ [PARSER] prompt_base está vazio")
-        return blocks, routes
-    
-    # REMOVER texto introdutório antes de "## FLUXO DA CONVERSA"
-    # Tudo antes de "## FLUXO DA CONVERSA" é texto introdutório e deve ser ignorado
-    fluxo_start = prompt_base.find('## FLUXO DA CONVERSA')
-    if fluxo_start > 0:
-        prompt_base = prompt_base[fluxo_start:]
-        print(f"🔍 [PARSER] Removido {fluxo_start} caracteres de texto introdutório")
-    
-    # Dividir o prompt em seções principais (###)
-    # Usar apenas ### para dividir, não --- (que pode estar dentro das seções)
-    sections = re.split(r'\n###+', prompt_base)
-    print(f"🔍 [PARSER] Dividido em {len(sections)} seções após remover introdutório")
-    
-    # Mapear block_key para índice de ordem
-    block_order: Dict[str, int] = {}
-    current_order = 1
     seen_block_keys: set = set()  # Evitar blocos duplicados
-    
-    # Pular seções que são apenas texto introdutório (sem blocos estruturados)
-    for section in sections:
-        section = section.strip()
-        if not section:
-            continue
-        
-        # Pular seções que são apenas texto introdutório
-        section_upper = section.upper()
-        
-        # Pular seção "FLUXO DA CONVERSA" (é apenas um cabeçalho)
-        # Mas só pular se NÃO tiver conteúdo de bloco (só o título)
-        if 'FLUXO DA CONVERSA' in section_upper:
-            # Se tem apenas o título sem conteúdo de bloco, pular
-            section_without_title = section.replace('FLUXO DA CONVERSA', '').replace('##', '').strip()
-            # Verificar se tem blocos ou seções dentro
-            has_blocks = bool(re.search(r'\[(PM|AG|CAM|MSG|ENC)\d+\]', section))
-            has_sections = 'ABERTURA' in section_upper or 'AGUARDAR' in section_upper or 'CAMINHOS' in section_upper
-            if len(section_without_title) < 20 and not has_blocks and not has_sections:
-                print(f"🔍 [PARSER] Pulando cabeçalho 'FLUXO DA CONVERSA' (sem conteúdo)")
-                continue
-            else:
-                print(f"🔍 [PARSER] Seção 'FLUXO DA CONVERSA' tem conteúdo, processando...")
-        
-        # Pular seções que contêm apenas texto introdutório (explicações sobre Falar, Aguardar, etc)
-        if ('FALAR' in section_upper and '=' in section and 'ABERTURA' not in section_upper and 'AGUARDAR' not in section_upper):
-            print(f"🔍 [PARSER] Pulando seção introdutória: {section[:80]}")
-            continue
-        
-        # Detectar tipo de bloco pelo TÍTULO DA SEÇÃO primeiro (prioridade)
-        # IMPORTANTE: Verificar título ANTES de procurar block_key no texto
-        # porque o texto pode conter referências a outros blocos (ex: "Va para [AG001]")
-        block_key = None
-        block_type_from_title = None
-        
-        if 'ABERTURA' in section_upper or 'Ao iniciar a ligacao' in section_upper:
-            block_key = 'PM001'
-            block_type_from_title = 'primeira_mensagem'
-            print(f"🔍 [PARSER] ✅ Detectado primeira_mensagem (ABERTURA) pelo título, usando PM001")
-        elif 'AGUARDAR' in section_upper or '[AG' in section_upper:
-            block_key = extract_block_key(section, 'aguardar') or 'AG001'
-            block_type_from_title = 'aguardar'
-            print(f"🔍 [PARSER] Detectado aguardar pelo título, block_key={block_key}")
-        elif 'CAMINHOS' in section_upper or '[CAM' in section_upper:
-            block_key = extract_block_key(section, 'caminhos') or 'CAM001'
-            block_type_from_title = 'caminhos'
-            print(f"🔍 [PARSER] Detectado caminhos pelo título, block_key={block_key}")
-        elif 'MENSAGEM' in section_upper or '[MSG' in section_upper:
-            block_key = extract_block_key(section, 'mensagem') or 'MSG001'
-            block_type_from_title = 'mensagem'
-            print(f"🔍 [PARSER] Detectado mensagem pelo título, block_key={block_key}")
-        elif 'ENCERRAR' in section_upper or '[ENC' in section_upper:
-            block_key = extract_block_key(section, 'encerrar') or 'ENC001'
-            block_type_from_title = 'encerrar'
-            print(f"🔍 [PARSER] Detectado encerrar pelo título, block_key={block_key}")
-        else:
-            # Se não detectou pelo título, tentar extrair block_key do texto
-            block_key = extract_block_key(section, '')
-            print(f"🔍 [PARSER] Não detectado pelo título, block_key extraído do texto: {block_key}")
-        
-        if not block_key:
-            print(f"⚠️ [PARSER] Seção não reconhecida (sem block_key): {section[:100]}")
+    for parsed in parsed_sections:
+        if not parsed:
             continue
-        
-        # Determinar tipo baseado no título (se detectado) ou no block_key
-        if block_type_from_title:
-            block_type = block_type_from_title
-        else:
-            # Fallback: determinar pelo block_key
-            if block_key.startswith('PM'):
-                block_type = 'primeira_mensagem'
-            elif block_key.startswith('AG'):
-                block_type = 'aguardar'
-            elif block_key.startswith('CAM'):
-                block_type = 'caminhos'
-            elif block_key.startswith('MSG'):
-                block_type = 'mensagem'
-            elif block_key.startswith('ENC'):
-                block_type = 'encerrar'
-            else:
-                print(f"⚠️ [PARSER] Não foi possível determinar block_type para {block_key}")
-                continue
-        
-        # Evitar blocos duplicados
+        block, block_routes = parsed
+        block_key = block["block_key"]
         if block_key in seen_block_keys:
-            print(f"⚠️ [PARSER] Bloco {block_key} já foi processado, pulando duplicata")
+            logger.debug("⚠️ [PARSER] Bloco %s já foi processado, pulando duplicata", block_key)
             continue
         seen_block_keys.add(block_key)
-        
-        # Extrair conteúdo
-        content = extract_block_content(section, block_type)
-        next_block = extract_next_block(section)
-        variable_name = extract_variable_name(section) if block_type == 'aguardar' else None
-        analyze_variable = extract_variable_name(section) if block_type == 'caminhos' else None
-        
-        print(f"🔍 [PARSER] Bloco {block_key}: content extraído length={len(content) if content else 0}, next_block={next_block}")
-        
-        # Se não encontrou conteúdo, tentar extrair de forma mais simples
-        if not content or len(content.strip()) < 5:
-            # Para primeira_mensagem, procurar texto entre aspas após "fale:" ou "Ao iniciar"
-            if block_type == 'primeira_mensagem':
-                # Tentar padrões: "fale:" seguido de aspas duplas ou simples
-                patterns = [
-                    r'fale[:\s]+["\']([^"\']+)["\']',  # Aspas simples ou duplas
-                    r'fale[:\s]+""([^"]+)""',  # Aspas duplas duplas (markdown)
-                    r'fale[:\s]+"([^"]+)"',  # Aspas duplas simples
-                ]
-                for pattern in patterns:
-                    match = re.search(pattern, section, re.IGNORECASE | re.DOTALL)
-                    if match:
-                        content = match.group(1).strip()
-                        break
-            
-            # Para mensagem, procurar texto após "Fale:"
-            elif block_type == 'mensagem':
-                patterns = [
-                    r'Fale:\s*["\']([^"\']+)["\']',  # Aspas simples ou duplas
-                    r'Fale:\s*""([^"]+)""',  # Aspas duplas duplas
-                    r'Fale:\s*"([^"]+)"',  # Aspas duplas simples
-                    r'Fale:\s*([^\n]+)',  # Qualquer coisa após "Fale:"
-                ]
-                for pattern in patterns:
-                    match = re.search(pattern, section, re.IGNORECASE | re.DOTALL)
-                    if match:
-                        content = match.group(1).strip()
-                        # Limpar aspas se ainda tiver
-                        content = content.strip('"\'')
-                        if content:
-                            break
-            
-            # Para aguardar, usar descrição do texto
-            elif block_type == 'aguardar':
-                # Procurar por "Escute" ou "Salvar"
-                match = re.search(r'(Escute[^\.]+|Salvar[^\.]+)', section, re.IGNORECASE)
-                if match:
-                    content = match.group(1).strip()
-                else:
-                    content = "Escute a resposta do lead"
-            
-            # Para encerrar, procurar mensagem após "Fale antes de encerrar" ou "Fale:"
-            elif block_type == 'encerrar':
-                patterns = [
-                    r'Fale.*encerrar[:\s]+["\']([^"\']+)["\']',  # Com "encerrar" no texto
-                    r'Fale:\s*["\']([^"\']+)["\']',  # Apenas "Fale:"
-                    r'Fale:\s*""([^"]+)""',  # Aspas duplas duplas
-                    r'Fale:\s*"([^"]+)"',  # Aspas duplas simples
-                ]
-                for pattern in patterns:
-                    match = re.search(pattern, section, re.IGNORECASE | re.DOTALL)
-                    if match:
-                        content = match.group(1).strip()
-                        content = content.strip('"\'')
-                        if content:
-                            break
-                if not content:
-                    content = "Encerrar ligação"
-        
-        # Criar bloco
-        block: Dict[str, Any] = {
-            "flow_id": flow_id,
-            "assistente_id": assistente_id,
-            "tenant_id": tenant_id,
-            "block_key": block_key,
-            "block_type": block_type,
-            "content": content or f"Bloco {block_key}",
-            "next_block_key": next_block,
-            "order_index": current_order,
-            "position_x": 100,
-            "position_y": current_order * 150,
-            "tool_config": {},
-            "end_metadata": {},
-        }
-        
-        if variable_name:
-            block["variable_name"] = variable_name
-        
-        if analyze_variable:
-            block["analyze_variable"] = analyze_variable
-        
-        blocks.append(block)
-        block_order[block_key] = current_order
-        current_order += 1
-        print(f"✅ [PARSER] Bloco criado: {block_key} ({block_type}), content length: {len(content)}")
-        
-        # Para caminhos, extrair rotas
-        if block_type == 'caminhos':
-            parsed_routes = extract_routes_from_section(section, block_key, flow_id, assistente_id, tenant_id)
-            routes.extend(parsed_routes)
-            print(f"✅ [PARSER] {len(parsed_routes)} rotas extraídas para {block_key}")
-    
-    print(f"✅ [PARSER] Parse completo: {len(blocks)} blocos, {len(routes)} rotas")
+        # Cópias: as seções podem vir de um cache (prompt_parse_sessions)
+        order_index = len(blocks) + 1
+        blocks.append({**block, "order_index": order_index, "position_y": order_index * 150})
+        routes.extend(dict(route) for route in block_routes)
     return blocks, routes
 
 
-def extract_routes_from_section(section: str, block_key: str, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str]) -> List[Dict[str, Any]]:
-    """Extrai rotas de uma seção de caminhos."""
-    routes: List[Dict[str, Any]] = []
-    
-    print(f"🔍 [PARSER] extract_routes: Processando seção para {block_key}")
-    print(f"🔍 [PARSER] Seção completa (primeiros 500 chars):\n{section[:500]}")
-    
+def parse_prompt_base_to_blocks(
+    prompt_base: str,
+    flow_id: str,
+    assistente_id: Optional[str],
+    tenant_id: Optional[str],
+    index: Optional[PromptSectionIndex] = None,
+) -> tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+    """
+    Analisa o prompt_base e gera blocos e rotas automaticamente.
+    Retorna (blocks, routes) no formato para inserir no banco.
+    index: PromptSectionIndex de prompt_base já montado (ex.: pelo prompt_patcher);
+    as seções vêm dele em vez de tokenizar o prompt de novo.
+    """
+    if not prompt_base or not prompt_base.strip():
+        logger.warning("⚠️ [PARSER] prompt_base está vazio (flow_id=%s)", flow_id)
+        return [], []
+
+    if index is not None and index.text == prompt_base:
+        tokens = index.flow_tokens()
+    else:
+        tokens = tokenize_prompt_flow(prompt_base)
+    blocks, routes = assemble_blocks(parse_section(token, flow_id, assistente_id, tenant_id) for token in tokens)
+    logger.info("✅ [PARSER] Parse completo (flow_id=%s): %d blocos, %d rotas", flow_id, len(blocks), len(routes))
+    return blocks, routes
+
+
+def tokenize_prompt_flow(prompt_base: str, classify: bool = True) -> List[SectionToken]:
+    """Seções do fluxo: tudo antes de "## FLUXO DA CONVERSA" é texto introdutório e é ignorado."""
+    fluxo_start = max(prompt_base.find(FLOW_MARKER), 0)
+    return tokenize_prompt(prompt_base, fluxo_start, classify=classify)
+
+
+def split_route_sections(section: str) -> List[str]:
+    """Trechos de cada rota de uma seção de caminhos (sem o cabeçalho da seção)."""
     # Estratégia 1: Dividir por #### seguido de espaço e símbolo (+, x, ?)
-    # Padrão: #### + Confirmou que é ele
-    # Usar lookahead positivo para preservar o símbolo na seção
-    route_sections = re.split(r'\n(?=####+\s*[+\-x?])', section)
-    print(f"🔍 [PARSER] extract_routes: Dividido em {len(route_sections)} subseções por '#### +/x/?' (com lookahead)")
-    
-    # Se encontrou mais de 1 seção, a primeira é o cabeçalho (antes do primeiro ####)
-    # As outras são as rotas (já começam com #### +/x/?)
-    if len(route_sections) > 1:
-        # Manter apenas as rotas (pular cabeçalho)
-        route_sections = [''] + route_sections[1:]
-        print(f"🔍 [PARSER] extract_routes: {len(route_sections)-1} rotas encontradas com #### +/x/?")
-    
+    # Padrão: #### + Confirmou que é ele (lookahead preserva o símbolo na seção)
+    route_sections = ROUTE_SPLIT_SYMBOL_RE.split(section)
+
     # Estratégia 2: Se não encontrou, tentar dividir apenas por ####
     if len(route_sections) <= 1:
-        route_sections = re.split(r'\n####+', section)
-        print(f"🔍 [PARSER] extract_routes: Dividido em {len(route_sections)} subseções por '####' simples")
-    
+        route_sections = ROUTE_SPLIT_HEADING_RE.split(section)
+
     # Estratégia 3: Se ainda não encontrou, dividir por linhas que começam com +, x, ?
     if len(route_sections) <= 1:
-        # Procurar por linhas que começam com símbolos de rota (+, x, ?)
-        # Padrão: linha que começa com símbolo seguida de múltiplas linhas até encontrar outro símbolo ou fim
         route_lines = []
-        lines = section.split('\n')
-        current_route = []
-        for line in lines:
-            line_stripped = line.strip()
+        current_route: List[str] = []
+        for line in section.split('\n'):
             # Se a linha começa com símbolo de rota (pode ter espaços antes), iniciar nova rota
-            if re.match(r'^\s*[+\-x?]', line_stripped):
+            if ROUTE_LINE_RE.match(line.strip()):
                 if current_route:
                     route_lines.append('\n'.join(current_route))
                 current_route = [line]
@@ -439,142 +419,129 @@ def extract_routes_from_section(section: str, block_key: str, flow_id: str, assi
                 current_route.append(line)
         if current_route:
             route_lines.append('\n'.join(current_route))
-        
-        if route_lines:
-            print(f"🔍 [PARSER] extract_routes: Encontradas {len(route_lines)} rotas por símbolos (+, x, ?)")
-            route_sections = [''] + route_lines  # Adicionar cabeçalho vazio
-    
-    for idx, route_section in enumerate(route_sections[1:], 1):  # Pular o cabeçalho
-        route_section = route_section.strip()
-        if not route_section:
-            continue
-        
-        print(f"🔍 [PARSER] Processando rota {idx}: {route_section[:100]}")
-        
-        # Detectar tipo de rota baseado no símbolo inicial
-        # Pode começar com: +, x, X, ?, ou #### +, #### x, etc.
-        is_fallback = False
-        route_symbol = ''
-        route_section_clean = route_section.strip()
-        
-        # Verificar se começa com #### seguido de símbolo
-        symbol_match = re.match(r'^####+\s*([+\-x?])', route_section_clean)
-        if symbol_match:
-            route_symbol = symbol_match.group(1)
-        elif route_section_clean.startswith('?'):
-            route_symbol = '?'
-        elif route_section_clean.startswith('+'):
-            route_symbol = '+'
-        elif route_section_clean.startswith('x') or route_section_clean.startswith('X'):
-            route_symbol = 'x'
-        
-        if route_symbol == '?':
-            is_fallback = True
-        
-        # Verificar também por texto
-        if not is_fallback:
-            is_fallback = (
-                'fallback' in route_section.lower() or 
-                'não entendi' in route_section.lower() or 
-                'nao entendi' in route_section.lower() or
-                'Quando nenhuma' in route_section
-            )
-        
-        # Extrair label (primeira linha após símbolo)
-        # Padrão: #### + Confirmou que é ele
-        # Ou: + Confirmou que é ele
-        label_match = None
-        
-        # Tentar padrão: #### + Label ou + Label
-        label_patterns = [
-            r'^####+\s*[+\-x?]\s*([^:\n]+?)(?:\n|$)',  # #### + Label
-            r'^[+\-x?]\s*([^:\n]+?)(?:\n|$)',  # + Label
-            r'^[+\-x?✅❌]\s*([^:\n]+?)(?:\n|$)',  # + Label (com emoji)
-        ]
-        
-        for pattern in label_patterns:
-            label_match = re.search(pattern, route_section, re.MULTILINE)
-            if label_match:
-                break
-        
-        if not label_match:
-            # Tentar pegar primeira linha não vazia que não seja markdown
-            lines = route_section.split('\n')
-            for line in lines:
-                line = line.strip()
-                if line and not line.startswith('**') and not line.startswith('Quando') and not line.startswith('####'):
-                    # Remover símbolos do início
-                    line_clean = re.sub(r'^[+\-x?✅❌####\s]+', '', line)
-                    if line_clean:
-                        label_match = re.search(r'^(.+?)(?:\n|$)', line_clean)
-                        break
-        
-        label = label_match.group(1).strip() if label_match else f"Caminho {idx}"
-        # Limpar label de símbolos, markdown e espaços extras
-        label = re.sub(r'^[+\-x?✅❌####\s]+', '', label).strip()
-        label = re.sub(r'\*\*', '', label).strip()
-        label = label.strip('"\'')  # Remover aspas se houver
-        
-        # Extrair keywords
-        keywords_match = re.search(r'Quando.*disser[:\s]+([^\n]+)', route_section, re.IGNORECASE)
-        keywords = []
-        if keywords_match:
-            keywords_str = keywords_match.group(1)
-            # Extrair palavras entre backticks ou aspas simples
-            keyword_matches = re.findall(r'`([^`]+)`|["\']([^"\']+)["\']', keywords_str)
-            keywords = [k[0] or k[1] for k in keyword_matches if k[0] or k[1]]
-            # Se não encontrou entre aspas, tentar separar por vírgula
-            if not keywords:
-                keywords = [k.strip() for k in keywords_str.split(',') if k.strip()]
-        
-        # Extrair resposta (suporta aspas duplas duplas "")
-        response_patterns = [
-            r'Fale:\s*""([^"]+)""',  # Aspas duplas duplas (markdown)
-            r'Fale:\s*"([^"]+)"',  # Aspas duplas simples
-            r'Fale:\s*\'([^\']+)\'',  # Aspas simples
-            r'Fale:\s*([^\n]+)',  # Qualquer coisa após "Fale:"
-        ]
-        response = ''
-        for pattern in response_patterns:
-            response_match = re.search(pattern, route_section, re.IGNORECASE | re.DOTALL)
-            if response_match:
-                response = response_match.group(1).strip()
-                response = response.strip('"\'')  # Remover aspas se ainda tiver
-                if response:
+        return route_lines
+
+    # O primeiro trecho é o cabeçalho (antes do primeiro ####)
+    return route_sections[1:]
+
+
+def _parse_route(route_section: str, idx: int, block_key: str, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str]) -> Dict[str, Any]:
+    """Uma rota (formato flow_routes) a partir do trecho dela."""
+    route_lower = route_section.lower()
+
+    # Detectar tipo de rota baseado no símbolo inicial
+    # Pode começar com: +, x, X, ?, ou #### +, #### x, etc.
+    route_symbol = ''
+    symbol_match = ROUTE_SYMBOL_RE.match(route_section)
+    if symbol_match:
+        route_symbol = symbol_match.group(1)
+    elif route_section.startswith('?'):
+        route_symbol = '?'
+    elif route_section.startswith('+'):
+        route_symbol = '+'
+    elif route_section.startswith('x') or route_section.startswith('X'):
+        route_symbol = 'x'
+
+    # Verificar também por texto
+    is_fallback = route_symbol == '?' or (
+        'fallback' in route_lower or
+        'não entendi' in route_lower or
+        'nao entendi' in route_lower or
+        'Quando nenhuma' in route_section
+    )
+
+    # Extrair label (primeira linha após símbolo)
+    # Padrão: #### + Confirmou que é ele  /  + Confirmou que é ele
+    label_match = None
+    for pattern in ROUTE_LABEL_PATTERNS:
+        label_match = pattern.search(route_section)
+        if label_match:
+            break
+
+    if not label_match:
+        # Tentar pegar primeira linha não vazia que não seja markdown
+        for line in route_section.split('\n'):
+            line = line.strip()
+            if line and not line.startswith('**') and not line.startswith('Quando') and not line.startswith('####'):
+                # Remover símbolos do início
+                line_clean = ROUTE_LABEL_PREFIX_RE.sub('', line)
+                if line_clean:
+                    label_match = FIRST_LINE_RE.search(line_clean)
                     break
-        
-        # Extrair destino
-        destination_block = extract_next_block(route_section)
-        destination_type = 'continuar'
-        if 'encerrar' in route_section.lower() or 'Encerre' in route_section or 'Encerre em' in route_section:
-            destination_type = 'encerrar'
-        elif 'volte' in route_section.lower() or 'loop' in route_section.lower() or 'Volte para' in route_section:
-            destination_type = 'loop'
-        
-        # Cor baseada no tipo
-        color = '#6b7280'  # Cinza padrão
-        if '✅' in route_section or 'confirmou' in route_section.lower() or '+' in route_section[:5]:
-            color = '#22c55e'  # Verde
-        elif '❌' in route_section or ('não' in route_section.lower() and 'é' in route_section.lower()) or 'x' in route_section[:5]:
-            color = '#ef4444'  # Vermelho
-        
-        route: Dict[str, Any] = {
-            "flow_id": flow_id,
-            "assistente_id": assistente_id,
-            "tenant_id": tenant_id,
-            "block_key": block_key,  # Será convertido para block_id depois
-            "route_key": f"{block_key}_{'fallback' if is_fallback else f'route_{idx}'}",
-            "label": label,
-            "ordem": 999 if is_fallback else idx,
-            "cor": color,
-            "keywords": keywords,
-            "response": response,
-            "destination_type": destination_type,
-            "destination_block_key": destination_block,
-            "max_loop_attempts": 2,
-            "is_fallback": is_fallback,
-        }
-        
-        routes.append(route)
-    
+
+    label = label_match.group(1).strip() if label_match else f"Caminho {idx}"
+    # Limpar label de símbolos, markdown e espaços extras
+    label = ROUTE_LABEL_PREFIX_RE.sub('', label).strip()
+    label = label.replace('**', '').strip()
+    label = label.strip('"\'')  # Remover aspas se houver
+
+    # Extrair keywords
+    keywords_match = _search_from_cue(KEYWORDS_RE, route_section, route_lower, 'quando')
+    keywords: List[str] = []
+    if keywords_match:
+        keywords_str = keywords_match.group(1)
+        # Extrair palavras entre backticks ou aspas simples
+        keywords = [k[0] or k[1] for k in KEYWORD_ITEM_RE.findall(keywords_str) if k[0] or k[1]]
+        # Se não encontrou entre aspas, tentar separar por vírgula
+        if not keywords:
+            keywords = [k.strip() for k in keywords_str.split(',') if k.strip()]
+
+    # Extrair resposta
+    response = ''
+    for pattern in ROUTE_RESPONSE_PATTERNS if 'fale:' in route_lower else []:
+        response_match = _search_from_cue(pattern, route_section, route_lower, 'fale:')
+        if response_match:
+            response = response_match.group(1).strip().strip('"\'')  # Remover aspas se ainda tiver
+            if response:
+                break
+
+    # Extrair destino
+    destination_block = extract_next_block(route_section, route_lower)
+    destination_type = 'continuar'
+    if 'encerrar' in route_lower or 'Encerre' in route_section:
+        destination_type = 'encerrar'
+    elif 'volte' in route_lower or 'loop' in route_lower:
+        destination_type = 'loop'
+
+    # Cor baseada no tipo
+    color = '#6b7280'  # Cinza padrão
+    if '✅' in route_section or 'confirmou' in route_lower or '+' in route_section[:5]:
+        color = '#22c55e'  # Verde
+    elif '❌' in route_section or ('não' in route_lower and 'é' in route_lower) or 'x' in route_section[:5]:
+        color = '#ef4444'  # Vermelho
+
+    return {
+        "flow_id": flow_id,
+        "assistente_id": assistente_id,
+        "tenant_id": tenant_id,
+        "block_key": block_key,  # Será convertido para block_id depois
+        "route_key": f"{block_key}_{'fallback' if is_fallback else f'route_{idx}'}",
+        "label": label,
+        "ordem": 999 if is_fallback else idx,
+        "cor": color,
+        "keywords": keywords,
+        "response": response,
+        "destination_type": destination_type,
+        "destination_block_key": destination_block,
+        "max_loop_attempts": 2,
+        "is_fallback": is_fallback,
+    }
+
+
+def extract_routes_from_section(section: str, block_key: str, flow_id: str, assistente_id: Optional[str], tenant_id: Optional[str], route_texts: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+    """
+    Extrai rotas de uma seção de caminhos.
+    route_texts: trechos das rotas já separados (ex: SectionToken.route_texts());
+    sem eles a seção é dividida por split_route_sections.
+    """
+    if route_texts is None:
+        route_texts = split_route_sections(section)
+
+    routes: List[Dict[str, Any]] = []
+    for idx, route_section in enumerate(route_texts, 1):
+        route_section = route_section.strip()
+        if route_section:
+            routes.append(_parse_route(route_section, idx, block_key, flow_id, assistente_id, tenant_id))
+
+    logger.debug("🔍 [PARSER] %s: %d rotas extraídas", block_key, len(routes))
     return routes
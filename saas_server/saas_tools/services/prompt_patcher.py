@@ -4,16 +4,20 @@ Quando um bloco é modificado, atualiza apenas aquela seção no prompt original
 mantendo o resto do prompt intacto.
 """
 import re
-from typing import Dict, Any, Optional, List
+from typing import Dict, Any, Optional, List, Tuple
 import logging
 
+from saas_tools.services.prompt_section_index import PromptSectionIndex
+from saas_tools.services.prompt_tokenizer import FLOW_MARKER, SectionToken
+
 logger = logging.getLogger(__name__)
 
 
 def patch_prompt_block(
     original_prompt: str,
     block: Dict[str, Any],
-    routes: List[Dict[str, Any]] = None
+    routes: List[Dict[str, Any]] = None,
+    index: Optional[PromptSectionIndex] = None
 ) -> str:
     """
     Atualiza apenas a seção de um bloco específico no prompt original.
@@ -23,6 +27,8 @@ def patch_prompt_block(
         original_prompt: Prompt completo original do assistente
         block: Bloco modificado (com block_key, block_type, content, etc.)
         routes: Rotas do bloco (se for tipo 'caminhos')
+        index: PromptSectionIndex de original_prompt (opcional). Sai atualizado pelo
+            splice, pronto para o próximo patch no prompt devolvido
     
     Returns:
         Prompt atualizado com apenas a seção do bloco modificada
@@ -39,99 +45,126 @@ def patch_prompt_block(
         return original_prompt
     
     # Formatar a nova seção do bloco
-    # Importar função de formatação do rebuilder
-    try:
-        from saas_tools.services.prompt_rebuilder import _format_block_for_prompt
-        new_block_section = _format_block_for_prompt(block, routes or [])
-    except ImportError:
-        # Fallback: formatar manualmente se não conseguir importar
-        logger.warning("patch_prompt_block: Não foi possível importar _format_block_for_prompt, usando formatação manual")
-        new_block_section = _format_block_simple(block, routes or [])
+    new_block_section = _render_block_section(block, routes or [])
     
-    # Encontrar a seção do bloco no prompt original
-    # Padrões para encontrar a seção baseado no tipo de bloco
-    section_start = -1
-    section_end = -1
+    if index is None or index.text != original_prompt:
+        index = PromptSectionIndex(original_prompt)
     
-    # Padrões específicos por tipo de bloco
-    if block_type == "primeira_mensagem":
-        pattern = r'###+\s*ABERTURA DA LIGACAO'
-    elif block_type == "aguardar":
-        pattern = rf'###+\s*AGUARDAR\s*\[{re.escape(block_key)}\]'
-    elif block_type == "caminhos":
-        pattern = rf'###+\s*CAMINHOS\s*\[{re.escape(block_key)}\]'
-    elif block_type == "mensagem":
-        pattern = rf'###+\s*MENSAGEM\s*\[{re.escape(block_key)}\]'
-    elif block_type == "encerrar":
-        pattern = rf'###+\s*ENCERRAR\s*\[{re.escape(block_key)}\][^\n]*'
-    else:
-        pattern = rf'###+\s*.*\[{re.escape(block_key)}\]'
-    
-    match = re.search(pattern, original_prompt, re.IGNORECASE | re.MULTILINE)
-    if match:
-        section_start = match.start()
-        logger.info(f"patch_prompt_block: Seção do bloco {block_key} encontrada na posição {section_start}")
-    else:
-        logger.warning(f"patch_prompt_block: Seção do bloco {block_key} não encontrada com padrão: {pattern}")
-    
-    if section_start == -1:
+    # Encontrar a seção do bloco no prompt original (início no título, fim no próximo ### ou ---)
+    token = index.get(block_key, block_type)
+    if token is None:
         # Seção não encontrada, adicionar no final (antes do último --- se existir)
         logger.info(f"patch_prompt_block: Seção do bloco {block_key} não encontrada, adicionando no final")
-        return _append_block_to_prompt(original_prompt, new_block_section)
-    
-    # Encontrar o fim da seção (próximo ### ou --- ou fim do texto)
-    # Procurar pelo próximo ### ou --- após o início da seção
-    remaining_text = original_prompt[section_start:]
-    
-    # Procurar pelo próximo ### (início de outra seção) ou --- (separador)
-    # Começar a busca após os primeiros caracteres para evitar pegar o título atual
-    search_start = min(100, len(remaining_text) - 1)
-    next_section_match = re.search(r'\n###+', remaining_text[search_start:], re.MULTILINE)
-    next_separator_match = re.search(r'\n---\s*\n', remaining_text[search_start:], re.MULTILINE)
-    
-    # Determinar onde termina a seção atual
-    section_end = len(remaining_text)  # Default: até o fim do texto
-    
-    if next_section_match and next_separator_match:
-        # Pegar o que vier primeiro (mas incluir o --- se ele vier antes do próximo ###)
-        if next_separator_match.start() < next_section_match.start():
-            # O separador vem primeiro, então a seção termina antes do separador
-            section_end = section_start + search_start + next_separator_match.start()
-        else:
-            # O próximo ### vem primeiro, então a seção termina antes dele
-            section_end = section_start + search_start + next_section_match.start()
-    elif next_separator_match:
-        # Só encontrou separador, terminar antes dele
-        section_end = section_start + search_start + next_separator_match.start()
-    elif next_section_match:
-        # Só encontrou próximo ###, terminar antes dele
-        section_end = section_start + search_start + next_section_match.start()
-    
-    # Substituir a seção
-    before_section = original_prompt[:section_start].rstrip()
-    section_content = original_prompt[section_start:section_end].rstrip()
-    after_section = original_prompt[section_end:].lstrip()
+        return _append_block_to_prompt(original_prompt, new_block_section, index)
+    section_start, section_end = index.section_span(token)
+    
+    # Substituir a seção: os espaços em volta dela saem junto (como antes, com rstrip/lstrip)
+    splice_start = _skip_space_back(original_prompt, section_start)
+    splice_end = _skip_space(original_prompt, section_end)
     
     logger.debug(f"patch_prompt_block: section_start={section_start}, section_end={section_end}, section_length={section_end-section_start}")
-    logger.debug(f"patch_prompt_block: section_content preview: {section_content[:150]}...")
-    logger.debug(f"patch_prompt_block: after_section preview: {after_section[:50]}...")
+    logger.debug(f"patch_prompt_block: section_content preview: {original_prompt[section_start:section_start + 150]}...")
+    logger.debug(f"patch_prompt_block: after_section preview: {original_prompt[splice_end:splice_end + 50]}...")
     
     # Garantir que há separadores adequados
-    if before_section and not before_section.endswith('\n'):
-        before_section += '\n'
+    replacement = ('\n' if splice_start else '') + new_block_section
     
-    # Montar o prompt atualizado
-    updated_prompt = before_section + new_block_section
+    # Adicionar separador antes do conteúdo após (preservar o --- se existir)
+    replacement += _separator_after(original_prompt, splice_end)
     
-    # Adicionar separador e conteúdo após (preservar o --- se existir)
-    if after_section.strip():
-        # Se after_section começa com ---, manter; senão adicionar
-        if not after_section.startswith('---'):
-            updated_prompt += '\n---\n'
-        updated_prompt += after_section
+    index.splice(splice_start, splice_end, replacement)
+    logger.info(f"patch_prompt_block: Seção do bloco {block_key} atualizada no prompt (tamanho antes: {section_end - section_start}, depois: {len(new_block_section)})")
+    return index.text
+
+
+def _render_block_section(block: Dict[str, Any], routes: List[Dict[str, Any]]) -> str:
+    """Seção ### do bloco no formato do rebuilder (ou _format_block_simple se não der para importar)."""
+    try:
+        from saas_tools.services.prompt_rebuilder import _format_block_for_prompt
+        return _format_block_for_prompt(block, routes)
+    except ImportError:
+        # Fallback: formatar manualmente se não conseguir importar
+        logger.warning("patch_prompt_block: Não foi possível importar _format_block_for_prompt, usando formatação manual")
+        return _format_block_simple(block, routes)
+
+
+def _separator_after(text: str, position: int) -> str:
+    """
+    O que vem depois de uma seção trocada, quando text[position:] é o resto do prompt
+    (já sem espaços na frente): nada no fim do texto, só a quebra de linha se o resto
+    já começa com ---, senão um separador novo.
+    """
+    if position >= len(text):
+        return ''
+    return '\n' if text.startswith('---', position) else '\n---\n'
+
+
+def _skip_space_back(text: str, position: int) -> int:
+    """Posição de text[:position].rstrip() sem copiar o texto."""
+    while position > 0 and text[position - 1].isspace():
+        position -= 1
+    return position
+
+
+def _skip_space(text: str, position: int) -> int:
+    """Posição onde text[position:].lstrip() começa, sem copiar o texto."""
+    length = len(text)
+    while position < length and text[position].isspace():
+        position += 1
+    return position
+
+
+def block_header_pattern(block_key: str, block_type: str) -> str:
+    """Padrão do título da seção de um bloco no prompt, por tipo de bloco."""
+    if block_type == "primeira_mensagem":
+        return r'###+\s*ABERTURA DA LIGACAO'
+    elif block_type == "aguardar":
+        return rf'###+\s*AGUARDAR\s*\[{re.escape(block_key)}\]'
+    elif block_type == "caminhos":
+        return rf'###+\s*CAMINHOS\s*\[{re.escape(block_key)}\]'
+    elif block_type == "mensagem":
+        return rf'###+\s*MENSAGEM\s*\[{re.escape(block_key)}\]'
+    elif block_type == "encerrar":
+        return rf'###+\s*ENCERRAR\s*\[{re.escape(block_key)}\][^\n]*'
+    return rf'###+\s*.*\[{re.escape(block_key)}\]'
+
+
+def find_block_section(
+    prompt: str,
+    block_key: str,
+    block_type: str,
+    index: Optional[PromptSectionIndex] = None
+) -> Optional[Tuple[int, int]]:
+    """
+    Retorna (início, fim) da seção do bloco no prompt, ou None se não encontrar.
+    A seção começa no título e termina antes do próximo ### (não ####) ou separador ---
+    (o que vier primeiro depois da linha do título), ou no fim do texto.
+    A seção é achada pelo block_key no PromptSectionIndex (passe o índice para não
+    tokenizar o prompt de novo).
+    """
+    if index is None or index.text != prompt:
+        index = PromptSectionIndex(prompt)
+    token = index.get(block_key, block_type)
+    if token is None:
+        logger.warning(f"find_block_section: Seção do bloco {block_key} não encontrada no índice")
+        return None
     
-    logger.info(f"patch_prompt_block: Seção do bloco {block_key} atualizada no prompt (tamanho antes: {len(section_content)}, depois: {len(new_block_section)})")
-    return updated_prompt
+    section_start, section_end = index.section_span(token)
+    logger.info(f"find_block_section: Seção do bloco {block_key} encontrada na posição {section_start}-{section_end}")
+    return section_start, section_end
+
+
+def neighbour_sections(prompt: str, section_start: int, section_end: int) -> Tuple[int, int]:
+    """
+    Retorna (início, fim) do trecho que vai da seção ### anterior até o fim da
+    seção ### seguinte (contexto para patches que só enxergam parte do prompt).
+    """
+    headers = [m.start() for m in re.finditer(r'^###(?!#)', prompt, re.MULTILINE)]
+    previous = [h for h in headers if h < section_start]
+    following = [h for h in headers if h >= section_end]
+    context_start = previous[-1] if previous else section_start
+    context_end = following[1] if len(following) > 1 else len(prompt)
+    return context_start, context_end
 
 
 def _format_block_simple(block: Dict[str, Any], routes: List[Dict[str, Any]]) -> str:
@@ -154,22 +187,20 @@ def _format_block_simple(block: Dict[str, Any], routes: List[Dict[str, Any]]) ->
         return f"### [{block_key}]\n\n{content}"
 
 
-def _append_block_to_prompt(prompt: str, block_section: str) -> str:
-    """Adiciona um bloco no final do prompt."""
-    prompt = prompt.rstrip()
+def _append_block_to_prompt(prompt: str, block_section: str, index: Optional[PromptSectionIndex] = None) -> str:
+    """Adiciona um bloco no final do prompt (e no índice, se vier)."""
+    start = _skip_space_back(prompt, len(prompt))
     
     # Se não tem "## FLUXO DA CONVERSA", adicionar
-    if "## FLUXO DA CONVERSA" not in prompt:
-        prompt += "\n\n## FLUXO DA CONVERSA\n\n"
+    tail = "\n" if FLOW_MARKER in prompt else f"\n\n{FLOW_MARKER}\n\n"
     
     # Adicionar o bloco
-    if not prompt.endswith('\n'):
-        prompt += '\n'
-    
-    prompt += block_section
-    prompt += '\n---\n'
+    tail += block_section + '\n---\n'
     
-    return prompt
+    if index is None:
+        return prompt[:start] + tail
+    index.splice(start, len(prompt), tail)
+    return index.text
 
 
 def patch_multiple_blocks(
@@ -178,8 +209,7 @@ def patch_multiple_blocks(
     routes_by_block_key: Dict[str, List[Dict[str, Any]]]
 ) -> str:
     """
-    Atualiza múltiplas seções de blocos no prompt original.
-    Processa em ordem reversa para não afetar as posições dos outros blocos.
+    Atualiza múltiplas seções de blocos no prompt original (ver patch_blocks_batch).
     
     Args:
         original_prompt: Prompt completo original
@@ -189,15 +219,90 @@ def patch_multiple_blocks(
     Returns:
         Prompt atualizado
     """
-    updated_prompt = original_prompt
+    return patch_blocks_batch(original_prompt, blocks, routes_by_block_key)["prompt"]
+
+
+def patch_blocks_batch(
+    original_prompt: str,
+    blocks: List[Dict[str, Any]],
+    routes_by_block_key: Dict[str, List[Dict[str, Any]]],
+    index: Optional[PromptSectionIndex] = None
+) -> Dict[str, Any]:
+    """
+    Atualiza várias seções de uma vez, em tempo linear no tamanho do prompt.
+    
+    As seções de todos os blocos saem de um PromptSectionIndex só; o prompt novo é
+    montado com um único join dos trechos que não mudaram e das seções novas (em vez
+    de um prompt inteiro novo por bloco). Cada seção trocada segue a regra do
+    patch_prompt_block; blocos sem seção no prompt vão para o final, na ordem de
+    order_index. Bloco repetido: vale o último da lista.
+    
+    Args:
+        original_prompt: Prompt completo original
+        blocks: Lista de blocos modificados
+        routes_by_block_key: Mapa de rotas por block_key
+        index: PromptSectionIndex de original_prompt (opcional); sai reconstruído
+            para o prompt devolvido
+    
+    Returns:
+        {"prompt": prompt atualizado, "replaced": block_keys trocados (na ordem do
+        prompt), "appended": block_keys adicionados no final}
+    """
+    if not original_prompt or not blocks:
+        return {"prompt": original_prompt or "", "replaced": [], "appended": []}
+    
+    text = original_prompt
+    section_index = index if index is not None and index.text == text else PromptSectionIndex(text)
+    
+    # Um alvo por seção do prompt (dois blocos podem cair na mesma, ex.: primeira_mensagem -> PM001)
+    targets: Dict[int, Tuple[SectionToken, Dict[str, Any]]] = {}
+    missing: Dict[str, Dict[str, Any]] = {}
+    for block in blocks:
+        block_key = (block or {}).get("block_key")
+        if not block_key:
+            logger.warning("patch_blocks_batch: Bloco sem block_key ignorado")
+            continue
+        token = section_index.get(block_key, block.get("block_type", ""))
+        if token is None:
+            missing[block_key] = block
+        else:
+            targets[token.start] = (token, block)
+    
+    parts: List[str] = []
+    replaced: List[str] = []
+    cursor = 0
+    for start in sorted(targets):
+        token, block = targets[start]
+        section_start, section_end = section_index.section_span(token)
+        # Os espaços em volta da seção saem junto; seções coladas dividem os mesmos espaços
+        splice_start = max(_skip_space_back(text, section_start), cursor)
+        splice_end = _skip_space(text, section_end)
+        if splice_start > cursor:
+            parts.append(text[cursor:splice_start])
+        if parts and not parts[-1].endswith('\n'):
+            parts.append('\n')
+        parts.append(_render_block_section(block, routes_by_block_key.get(block["block_key"], [])))
+        parts.append(_separator_after(text, splice_end))
+        replaced.append(block["block_key"])
+        cursor = splice_end
     
-    # Processar em ordem reversa (do último para o primeiro)
-    # para não afetar as posições dos blocos anteriores
-    sorted_blocks = sorted(blocks, key=lambda b: b.get("order_index") or 0, reverse=True)
+    if cursor < len(text):
+        parts.append(text[cursor:] if not missing else text[cursor:_skip_space_back(text, len(text))])
     
-    for block in sorted_blocks:
-        block_key = block.get("block_key")
-        routes = routes_by_block_key.get(block_key, [])
-        updated_prompt = patch_prompt_block(updated_prompt, block, routes)
+    appended: List[str] = []
+    if missing:
+        # Mesmo formato do _append_block_to_prompt, um bloco depois do outro
+        parts.append("\n" if FLOW_MARKER in text else f"\n\n{FLOW_MARKER}\n\n")
+        for block in sorted(missing.values(), key=lambda b: b.get("order_index") or 0):
+            parts.append(_render_block_section(block, routes_by_block_key.get(block["block_key"], [])))
+            parts.append('\n---\n')
+            appended.append(block["block_key"])
     
-    return updated_prompt
+    updated_prompt = "".join(parts)
+    if index is not None:
+        index.rebuild(updated_prompt)
+    logger.info(
+        f"patch_blocks_batch: {len(replaced)} seções trocadas, {len(appended)} blocos adicionados no final "
+        f"(tamanho antes: {len(text)}, depois: {len(updated_prompt)})"
+    )
+    return {"prompt": updated_prompt, "replaced": replaced, "appended": appended}
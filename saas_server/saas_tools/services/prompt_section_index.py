@@ -0,0 +1,172 @@
+"""
+Índice das seções ### do prompt_voz por block_key.
+
+prompt_patcher, ai_prompt_patcher e prompt_parser procuravam as mesmas seções
+cada um do seu jeito (regex por tipo de bloco no prompt inteiro + duas buscas para
+achar o fim). O PromptSectionIndex tokeniza o prompt uma vez (prompt_tokenizer) e
+guarda, por block_key, o SectionToken da seção: cabeçalho, corpo, tipo e rotas.
+
+- get(block_key): lookup O(1) no dict;
+- section_span / neighbours: os mesmos trechos que find_block_section e
+  neighbour_sections devolviam, sem varrer o prompt de novo;
+- splice(start, end, texto): troca um trecho, re-tokeniza só as seções tocadas e
+  desloca os spans das seguintes (sem nova passada no texto), então vários patches
+  seguidos reaproveitam o mesmo índice;
+- flow_tokens(): as seções a partir de "## FLUXO DA CONVERSA", o que o
+  prompt_parser analisa.
+"""
+import logging
+import re
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional, Tuple
+
+from saas_tools.services.prompt_tokenizer import FLOW_MARKER, SectionToken, tokenize_prompt
+
+logger = logging.getLogger(__name__)
+
+# Separador entre seções; termina a seção do bloco para o patcher (o --- fica de fora)
+SEPARATOR_RE = re.compile(r"\n---\s*\n")
+
+
+class PromptSectionIndex:
+    """Seções ### de um prompt, por block_key, com spans atualizados a cada splice."""
+
+    def __init__(self, text: str):
+        self._build(text or "")
+
+    def _build(self, text: str) -> None:
+        self.text = text
+        self.tokens: List[SectionToken] = tokenize_prompt(text)
+        self._reindex()
+
+    def _reindex(self) -> None:
+        self._starts = [token.start for token in self.tokens]
+        self._ends = [token.end for token in self.tokens]
+        self._by_key: Dict[str, SectionToken] = {}
+        self._key_counts: Dict[str, int] = {}
+        self._add_keys(self.tokens)
+
+    def _add_keys(self, tokens: List[SectionToken]) -> None:
+        by_key = self._by_key
+        for token in tokens:
+            if token.kind != "section" or not token.block_key:
+                continue
+            self._key_counts[token.block_key] = self._key_counts.get(token.block_key, 0) + 1
+            # Primeira seção com a chave ganha; [KEY] no cabeçalho ganha de chave deduzida do título/corpo
+            current = by_key.get(token.block_key)
+            if (
+                current is None
+                or (token.key_in_header and not current.key_in_header)
+                or (token.key_in_header == current.key_in_header and token.start < current.start)
+            ):
+                by_key[token.block_key] = token
+
+    def _remove_keys(self, tokens: List[SectionToken]) -> bool:
+        """Tira as chaves das seções removidas; False se uma delas tinha outra seção com a mesma chave."""
+        for token in tokens:
+            if token.kind != "section" or not token.block_key:
+                continue
+            count = self._key_counts[token.block_key] - 1
+            if count:
+                return False
+            del self._key_counts[token.block_key]
+            del self._by_key[token.block_key]
+        return True
+
+    def rebuild(self, text: str) -> None:
+        """Reconstrói o índice para um texto novo (ex.: prompt inteiro devolvido pela IA)."""
+        self._build(text or "")
+
+    def __len__(self) -> int:
+        return len(self._by_key)
+
+    def __contains__(self, block_key: str) -> bool:
+        return (block_key or "").upper() in self._by_key
+
+    def keys(self) -> List[str]:
+        return list(self._by_key)
+
+    def get(self, block_key: str, block_type: Optional[str] = None) -> Optional[SectionToken]:
+        """Seção do bloco, ou None. primeira_mensagem cai na ABERTURA (sempre PM001 no tokenizador)."""
+        token = self._by_key.get((block_key or "").upper())
+        if token is None and block_type == "primeira_mensagem":
+            token = self._by_key.get("PM001")
+        return token
+
+    def position(self, token: SectionToken) -> int:
+        return bisect_left(self._starts, token.start)
+
+    def section_span(self, token: SectionToken) -> Tuple[int, int]:
+        """
+        (início, fim) da seção como o patcher troca: do título até antes do próximo
+        ### (não ####) ou separador ---, o que vier primeiro depois da linha do título.
+        """
+        text = self.text
+        header_end = token.header_span[1]
+        if header_end >= len(text):
+            return token.start, len(text)
+        # token.end é o início do próximo ###: a seção para no \n antes dele
+        section_end = token.end - 1 if token.end < len(text) else len(text)
+        separator = SEPARATOR_RE.search(text, header_end, token.end)
+        if separator:
+            section_end = min(section_end, separator.start())
+        return token.start, section_end
+
+    def neighbours(self, token: SectionToken) -> Tuple[int, int]:
+        """(início, fim) do trecho da seção ### anterior até o fim da seção ### seguinte."""
+        position = self.position(token)
+        previous = self.tokens[position - 1] if position > 0 else None
+        context_start = previous.start if previous is not None and previous.kind == "section" else token.start
+        context_end = self.tokens[position + 2].start if position + 2 < len(self.tokens) else len(self.text)
+        return context_start, context_end
+
+    def flow_tokens(self) -> List[SectionToken]:
+        """Seções a partir de "## FLUXO DA CONVERSA" (mesmo resultado de tokenize_prompt_flow)."""
+        flow_start = max(self.text.find(FLOW_MARKER), 0)
+        position = bisect_left(self._starts, flow_start)
+        sections = [token for token in self.tokens[position:] if token.kind == "section"]
+        first_section = sections[0].start if sections else len(self.text)
+        # Só o trecho entre o marcador e o primeiro ### é tokenizado de novo (o preamble do parser)
+        return tokenize_prompt(self.text, flow_start, end=first_section) + sections
+
+    def splice(self, start: int, end: int, replacement: str) -> None:
+        """
+        Troca text[start:end] por replacement. As seções que encostam no trecho são
+        re-tokenizadas (só elas); as seguintes só têm os spans deslocados.
+        """
+        old_text = self.text
+        text = old_text[:start] + replacement + old_text[end:]
+        delta = len(replacement) - (end - start)
+
+        # Seções [first, last) encostam no trecho (limites inclusivos: um cabeçalho colado
+        # no trecho pode deixar de ser início de linha). A seção anterior entra junto: se o
+        # trecho apagar o cabeçalho da primeira, o texto dela passa a ser da anterior
+        first = max(0, bisect_left(self._ends, start) - 1)
+        last = bisect_right(self._starts, end)
+        region_start = self.tokens[first].start if first > 0 else 0
+        region_end = self.tokens[last].start + delta if last < len(self.tokens) else len(text)
+
+        for token in self.tokens[:first]:
+            token.source = text
+        following = self.tokens[last:]
+        for token in following:
+            token.shift(delta, text)
+        removed = self.tokens[first:last]
+        added = tokenize_prompt(text, region_start, end=region_end)
+        self.text = text
+        self.tokens[first:last] = added
+        if self._remove_keys(removed):
+            self._add_keys(added)
+            self._starts[first:last] = [token.start for token in added]
+            self._ends[first:last] = [token.end for token in added]
+            if delta:
+                position = first + len(added)
+                self._starts[position:] = [start + delta for start in self._starts[position:]]
+                self._ends[position:] = [end + delta for end in self._ends[position:]]
+        else:
+            # Chave repetida no prompt: a seção que passa a valer pode ser qualquer uma
+            self._reindex()
+        logger.debug(
+            "PromptSectionIndex.splice: %d-%d (%+d chars), %d seções re-tokenizadas, %d deslocadas",
+            start, end, delta, max(0, last - first), len(following),
+        )
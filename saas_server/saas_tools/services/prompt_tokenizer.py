@@ -0,0 +1,182 @@
+"""
+Tokenizador do prompt_base: uma passada linear com os padrões compilados uma vez.
+
+Cada cabeçalho ### abre uma seção; o texto antes do primeiro vira a seção
+"preamble" (ex.: "## FLUXO DA CONVERSA"). Para cada seção sai um SectionToken com
+o cabeçalho, block_key/block_type, o span do corpo e os spans das rotas
+(subcabeçalhos #### + / x / ?). Os spans apontam para o prompt original (nada é
+copiado até alguém pedir .text/.body), então o prompt_parser consome os tokens
+sem dividir o texto de novo nem repetir regex por seção.
+"""
+import re
+from typing import List, Optional, Tuple
+
+FLOW_MARKER = "## FLUXO DA CONVERSA"
+
+# Cabeçalho de seção (###) ou de rota (####+), sempre no início da linha
+HEADING_RE = re.compile(r"^(#{3,})[ \t]*([^\n]*)", re.MULTILINE)
+KEY_MARKER_RE = re.compile(r"\[([A-Z]{2,3}\d+)\]")
+KEY_PREFIX_RE = re.compile(r"[A-Z]+")
+NUMBER_RE = re.compile(r"\d+")
+# Rota marcada pelo símbolo no subcabeçalho: #### + Confirmou, #### x Não é, #### ? Não entendi
+ROUTE_SYMBOL_RE = re.compile(r"[+\-x?]")
+
+# Prefixo do block_key -> block_type
+PREFIX_TYPES = {
+    "PM": "primeira_mensagem",
+    "AG": "aguardar",
+    "CAM": "caminhos",
+    "MSG": "mensagem",
+    "ENC": "encerrar",
+}
+TYPE_PREFIXES = {block_type: prefix for prefix, block_type in PREFIX_TYPES.items()}
+
+# Palavra no título da seção -> block_type (na ordem de prioridade do parser)
+TITLE_TYPES = [
+    ("ABERTURA", "primeira_mensagem"),
+    ("AGUARDAR", "aguardar"),
+    ("CAMINHOS", "caminhos"),
+    ("MENSAGEM", "mensagem"),
+    ("ENCERRAR", "encerrar"),
+]
+
+
+def type_from_key(block_key: str) -> Optional[str]:
+    prefix = KEY_PREFIX_RE.match(block_key)
+    return PREFIX_TYPES.get(prefix.group(0)) if prefix else None
+
+
+def type_from_title(header: str) -> Optional[str]:
+    header_upper = header.upper()
+    for word, block_type in TITLE_TYPES:
+        if word in header_upper:
+            return block_type
+    return None
+
+
+class SectionToken:
+    """Uma seção ### do prompt (ou o preamble antes do primeiro ###), por spans."""
+
+    def __init__(self, source: str, kind: str, start: int, title_start: int, header_end: int, end: int, header: str):
+        self.source = source
+        self.kind = kind
+        self.start = start
+        self.end = end
+        self.header = header
+        self.header_span = (start, header_end)
+        self.block_key: Optional[str] = None
+        self.block_type: Optional[str] = None
+        # block_key veio de um [KEY] no próprio cabeçalho (e não do título/corpo)
+        self.key_in_header = False
+        self.route_spans: List[Tuple[int, int]] = []
+        self._title_start = title_start
+        self._body_start = header_end + 1
+
+    @property
+    def body_span(self) -> Tuple[int, int]:
+        return (min(self._body_start, self.end), self.end)
+
+    @property
+    def text(self) -> str:
+        """Seção sem os ### do cabeçalho e sem espaços nas pontas (o que o parser analisa)."""
+        return self.source[self._title_start:self.end].strip()
+
+    @property
+    def body(self) -> str:
+        return self.source[self.body_span[0]:self.body_span[1]]
+
+    def route_texts(self) -> List[str]:
+        return [self.source[start:end] for start, end in self.route_spans]
+
+    def classify(self) -> None:
+        """block_key/block_type: marcador no cabeçalho, depois título, depois 1º marcador da seção."""
+        source = self.source
+        header_upper = self.header.upper()
+        marker = KEY_MARKER_RE.search(header_upper)
+        title_type = type_from_title(self.header) if self.kind == "section" else None
+
+        if marker:
+            self.block_key = marker.group(1)
+            self.key_in_header = True
+            self.block_type = title_type or type_from_key(self.block_key)
+        elif title_type:
+            prefix = TYPE_PREFIXES[title_type]
+            # Referências no corpo ("Va para [AG001]") apontam para outros blocos: só vale o mesmo prefixo
+            block_key = None
+            for body_marker in KEY_MARKER_RE.finditer(source, self.body_span[0], self.end):
+                if KEY_PREFIX_RE.match(body_marker.group(1)).group(0) == prefix:
+                    block_key = body_marker.group(1)
+                    break
+            if not block_key:
+                number = NUMBER_RE.search(self.header)
+                block_key = f"{prefix}{number.group(0).zfill(3) if number else '001'}"
+            if title_type == "primeira_mensagem":
+                # Convenção do parser: ABERTURA é sempre PM001
+                block_key = "PM001"
+            self.block_key = block_key
+            self.block_type = title_type
+        else:
+            body_marker = KEY_MARKER_RE.search(source, self.start, self.end)
+            if body_marker:
+                self.block_key = body_marker.group(1)
+                self.block_type = type_from_key(self.block_key)
+
+    def shift(self, delta: int, source: str) -> None:
+        """Move os spans delta posições (o texto antes da seção mudou de tamanho)."""
+        self.source = source
+        if not delta:
+            return
+        self.start += delta
+        self.end += delta
+        self.header_span = (self.start, self.header_span[1] + delta)
+        if self.route_spans:
+            self.route_spans = [(start + delta, end + delta) for start, end in self.route_spans]
+        self._title_start += delta
+        self._body_start += delta
+
+    def __repr__(self) -> str:
+        return f"SectionToken({self.kind}, {self.block_key}, {self.block_type}, {self.start}:{self.end}, rotas={len(self.route_spans)})"
+
+
+def _close(token: SectionToken, sub_headings: List[Tuple[int, str]], classify: bool) -> SectionToken:
+    if classify:
+        token.classify()
+    if sub_headings:
+        starts = [start for start, title in sub_headings if ROUTE_SYMBOL_RE.match(title)]
+        if not starts:
+            starts = [start for start, _ in sub_headings]
+        token.route_spans = list(zip(starts, starts[1:] + [token.end]))
+    return token
+
+
+def tokenize_prompt(prompt: str, start: int = 0, classify: bool = True, end: Optional[int] = None) -> List[SectionToken]:
+    """
+    Seções do prompt entre start e end (padrão: fim do texto), em ordem. Os spans
+    são posições em prompt (não em prompt[start:]), para quem precisa voltar ao
+    texto original. classify=False deixa block_key/block_type para token.classify()
+    (só spans). end, se passado, tem que ser o início de um cabeçalho ### (ou o fim).
+    """
+    tokens: List[SectionToken] = []
+    if not prompt:
+        return tokens
+    end = len(prompt) if end is None else end
+
+    first_line_end = prompt.find("\n", start, end)
+    first_line_end = end if first_line_end < 0 else first_line_end
+    current = SectionToken(prompt, "preamble", start, start, first_line_end, end, prompt[start:first_line_end].strip())
+    sub_headings: List[Tuple[int, str]] = []
+
+    for heading in HEADING_RE.finditer(prompt, start, end):
+        if len(heading.group(1)) > 3:
+            if current.kind == "section":
+                sub_headings.append((heading.start(), heading.group(2)))
+            continue
+        current.end = heading.start()
+        if current.kind == "section" or prompt[start:current.end].strip():
+            tokens.append(_close(current, sub_headings, classify))
+        current = SectionToken(prompt, "section", heading.start(), heading.end(1), heading.end(), end, heading.group(2).strip())
+        sub_headings = []
+
+    if current.kind == "section" or prompt[start:current.end].strip():
+        tokens.append(_close(current, sub_headings, classify))
+    return tokens
@@ -0,0 +1,46 @@
+-- ============================================================================
+-- ADICIONAR content_hash EM flow_blocks
+-- Hash (sha256) do conteúdo editável do bloco, calculado pelo servidor em
+-- flow_service.block_content_hash. O save_flow compara com o hash salvo e só
+-- reescreve os blocos que mudaram.
+-- ============================================================================
+
+-- 1. COLUNA
+ALTER TABLE flow_blocks
+ADD COLUMN IF NOT EXISTS content_hash TEXT;
+
+-- 2. TRIGGER LEVE: se alguém alterar o bloco sem recalcular o hash (RPC
+--    update_flow_block_simple, SQL manual, geração pela IA), zera o hash para
+--    que o próximo save_flow reescreva o bloco em vez de pulá-lo.
+CREATE OR REPLACE FUNCTION flow_blocks_clear_stale_content_hash()
+RETURNS TRIGGER
+LANGUAGE plpgsql
+AS $$
+BEGIN
+  IF NEW.content_hash IS NOT DISTINCT FROM OLD.content_hash
+     AND ROW(NEW.block_type, NEW.content, NEW.variable_name, NEW.timeout_seconds,
+             NEW.analyze_variable, NEW.tool_type, NEW.tool_config, NEW.end_type,
+             NEW.end_metadata, NEW.next_block_key, NEW.order_index,
+             NEW.position_x, NEW.position_y, NEW.routes_data)
+         IS DISTINCT FROM
+         ROW(OLD.block_type, OLD.content, OLD.variable_name, OLD.timeout_seconds,
+             OLD.analyze_variable, OLD.tool_type, OLD.tool_config, OLD.end_type,
+             OLD.end_metadata, OLD.next_block_key, OLD.order_index,
+             OLD.position_x, OLD.position_y, OLD.routes_data)
+  THEN
+    NEW.content_hash := NULL;
+  END IF;
+  RETURN NEW;
+END;
+$$;
+
+DROP TRIGGER IF EXISTS trigger_flow_blocks_clear_stale_content_hash ON flow_blocks;
+CREATE TRIGGER trigger_flow_blocks_clear_stale_content_hash
+BEFORE UPDATE ON flow_blocks
+FOR EACH ROW
+EXECUTE FUNCTION flow_blocks_clear_stale_content_hash();
+
+-- 3. VERIFICAR
+SELECT column_name, data_type
+FROM information_schema.columns
+WHERE table_name = 'flow_blocks' AND column_name = 'content_hash';
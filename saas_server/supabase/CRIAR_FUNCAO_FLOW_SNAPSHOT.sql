@@ -0,0 +1,54 @@
+-- ============================================================================
+-- CRIAR FUNÇÃO POSTGRESQL QUE RETORNA O FLOW COMPLETO EM UMA ÚNICA CHAMADA
+-- flow + flow_blocks (com routes_data, ordenados) + prompt_voz do assistente.
+-- Usada por flow_service.load_flow_snapshot (abrir o editor / iniciar ligação).
+-- ============================================================================
+
+CREATE OR REPLACE FUNCTION get_flow_snapshot(
+  p_flow_id UUID,
+  p_assistant_table TEXT DEFAULT 'assistentes'
+)
+RETURNS JSONB
+LANGUAGE plpgsql
+STABLE
+AS $$
+DECLARE
+  v_flow JSONB;
+  v_blocks JSONB;
+  v_prompt_voz TEXT;
+BEGIN
+  SELECT to_jsonb(f) INTO v_flow
+  FROM flows f
+  WHERE f.id = p_flow_id;
+
+  IF v_flow IS NULL THEN
+    RETURN NULL;
+  END IF;
+
+  SELECT COALESCE(jsonb_agg(to_jsonb(b) ORDER BY b.order_index), '[]'::jsonb)
+  INTO v_blocks
+  FROM flow_blocks b
+  WHERE b.flow_id = p_flow_id;
+
+  -- flows.assistente_id não tem FK, então o prompt_voz é buscado pelo nome da tabela
+  IF (v_flow->>'assistente_id') IS NOT NULL AND to_regclass(p_assistant_table) IS NOT NULL THEN
+    BEGIN
+      -- Cast no parâmetro (e não em id) para usar o índice da chave primária
+      EXECUTE format('SELECT prompt_voz FROM %I WHERE id = $1::uuid LIMIT 1', p_assistant_table)
+      INTO v_prompt_voz
+      USING v_flow->>'assistente_id';
+    EXCEPTION WHEN undefined_column OR invalid_text_representation THEN
+      v_prompt_voz := NULL;
+    END;
+  END IF;
+
+  RETURN jsonb_build_object(
+    'flow', v_flow,
+    'blocks', v_blocks,
+    'prompt_voz', v_prompt_voz
+  );
+END;
+$$;
+
+-- Verificar
+SELECT get_flow_snapshot('00000000-0000-0000-0000-000000000000'::uuid);